@@ -17,9 +17,16 @@ imports = (
     'keepa_deals.janitor',
     'keepa_deals.maintenance_tasks',
     'keepa_deals.inventory_import',
-    'keepa_deals.prime_picks_task'
+    'keepa_deals.prime_picks_task',
+    'keepa_deals.ava_jobs'
 )
 
+# User-triggered xAI requests get their own queue and worker (start_celery.sh), so they
+# are never stuck behind an ingest run and never wait on a web thread.
+task_routes = {
+    'keepa_deals.ava_jobs.run_ava_job': {'queue': 'ava'},
+}
+
 beat_schedule_filename = 'celerybeat-schedule'
 worker_log_file = 'celery_worker.log'
 worker_log_level = 'INFO'
@@ -13,15 +13,16 @@ from datetime import datetime
 from .keepa_api import (
     fetch_deals_for_deals,
     fetch_product_batch,
+    split_cached,
     validate_asin,
-    fetch_seller_data,
 )
 from .token_manager import TokenManager
 from .field_mappings import FUNCTION_LIST
 from keepa_deals.db_utils import get_db_connection
+from .data_version import bump_data_version
 from .processing import _process_single_deal
-from .stable_calculations import infer_sale_events, analyze_sales_performance
-from .seller_info import get_all_seller_info
+from .stable_calculations import ProductAnalysisContext
+from .seller_info import get_all_seller_info, fetch_sellers_cached
 import sqlite3
 from .business_calculations import (
     load_settings as business_load_settings,
@@ -180,10 +181,14 @@ def run_keepa_script(api_key, no_cache=False, output_dir='data', deal_limit=None
             batch_asins = [d['asin'] for d in batch]
 
             # CRITICAL FIX: Restore the throttling mechanism. This waits if the refill rate is slower than the request rate.
-            token_manager.request_permission_for_call(estimated_cost=len(batch_asins) * COST_PER_PRODUCT)
-
-            product_data_response, _, _, tokens_left = fetch_product_batch(api_key, batch_asins, history=1, offers=20)
-            token_manager.update_after_call(tokens_left)
+            # Only ASINs missing from the Keepa response cache cost tokens.
+            cached, to_fetch = split_cached(batch_asins, days=365, offers=20, history=1)
+            if to_fetch:
+                token_manager.request_permission_for_call(estimated_cost=len(to_fetch) * COST_PER_PRODUCT)
+
+            product_data_response, _, _, tokens_left = fetch_product_batch(api_key, batch_asins, history=1, offers=20, cached=cached)
+            if tokens_left is not None:
+                token_manager.update_after_call(tokens_left)
             if product_data_response and 'products' in product_data_response:
                 for p in product_data_response['products']:
                     all_fetched_products_map[p['asin']] = p
@@ -204,14 +209,8 @@ def run_keepa_script(api_key, no_cache=False, output_dir='data', deal_limit=None
             if not token_manager.has_enough_tokens(seller_cost):
                  logger.warning(f"Insufficient tokens for seller data fetch. Cost: {seller_cost}, Available: {token_manager.tokens}. Skipping seller info.")
             else:
-                for i in range(0, len(seller_id_list), 100):
-                    batch_ids = seller_id_list[i:i+100]
-                    # Add the throttling back here as well
-                    token_manager.request_permission_for_call(estimated_cost=len(batch_ids) / 100.0)
-                    seller_data, _, _, tokens_left = fetch_seller_data(api_key, batch_ids)
-                    token_manager.update_after_call(tokens_left)
-                    if seller_data and 'sellers' in seller_data:
-                        seller_data_cache.update(seller_data['sellers'])
+                # Served from the seller cache where possible; misses are fetched 100 per call.
+                seller_data_cache = fetch_sellers_cached(seller_id_list, api_key, token_manager)
 
         # =================================================================
         # NEW: Multi-stage processing pipeline
@@ -219,16 +218,20 @@ def run_keepa_script(api_key, no_cache=False, output_dir='data', deal_limit=None
 
         # --- Stage 1: Analytics Pre-calculation ---
         # Run analytics first to get data needed for later stages (e.g., seasonality)
+        # The contexts are handed to Stage 2 so inference is not repeated per product.
         logger.info("Starting Stage 1: Analytics Pre-calculation")
+        analysis_contexts = {}
         for asin, product in all_fetched_products_map.items():
+            context = ProductAnalysisContext(product)
             try:
-                sale_events, _ = infer_sale_events(product)
-                analysis_results = analyze_sales_performance(product, sale_events)
+                analysis_results = context.analysis
                 # Store results back into the main product object
                 product['analytics_cache'] = analysis_results
             except Exception as e:
                 logger.error(f"ASIN {asin}: Analytics pre-calculation failed: {e}", exc_info=True)
                 product['analytics_cache'] = {} # Ensure the key exists
+                context = None
+            analysis_contexts[asin] = context
         logger.info("Finished Stage 1.")
 
 
@@ -254,7 +257,8 @@ def run_keepa_script(api_key, no_cache=False, output_dir='data', deal_limit=None
                 processed_row = _process_single_deal(
                     product_data,
                     seller_data_cache=seller_data_cache,
-                    xai_api_key=XAI_API_KEY
+                    xai_api_key=XAI_API_KEY,
+                    analysis_context=analysis_contexts.get(asin)
                 )
 
                 if processed_row:
@@ -323,6 +327,7 @@ def save_to_database(rows, headers, logger):
 
         cursor.executemany(insert_sql, data_to_insert)
         conn.commit()
+        bump_data_version('legacy_scan', count=len(data_to_insert))
     except Exception as e:
         logger.error(f"Database error: {e}", exc_info=True)
     finally:
@@ -17,6 +17,7 @@ STRATEGIES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(_
 INTELLIGENCE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'intelligence.json')
 
 from .platform_knowledge import get_platform_knowledge
+from .xai_token_manager import get_xai_token_manager, XAI_CLASS_DEFAULT, XAI_CLASS_TOOLTIPS, XAI_CLASS_AVA_ADVICE, XAI_CLASS_MENTOR_CHAT
 
 STRATEGIC_CORRECTIONS = """
         IMPORTANT — TEXTBOOK COUNTERFEIT RISK CORRECTION: Some strategies you have been given may suggest categorical rejection of textbooks (medical, engineering, AP, college subjects, etc.) due to counterfeit risk. This is overcautious and incorrect. Do NOT reject textbook candidates based on category alone or subject area alone.
@@ -203,9 +204,10 @@ def load_intelligence():
         logger.error(f"Error loading intelligence: {e}")
     return ""
 
-def query_xai_api(payload, api_key=None):
+def query_xai_api(payload, api_key=None, caller=XAI_CLASS_DEFAULT):
     """
-    Sends a request to the xAI API.
+    Sends a request to the xAI API, charged to the `caller` class of the xAI governor
+    (see xai_token_manager). Returns {"error": ...} if the call is not permitted.
     """
     # Use provided key or fetch lazily
     xai_api_key = api_key if api_key else os.getenv("XAI_TOKEN")
@@ -218,6 +220,13 @@ def query_xai_api(payload, api_key=None):
         logger.error("XAI_TOKEN is not set in environment variables or passed as argument.")
         return {"error": "XAI_TOKEN is not configured."}
 
+    with get_xai_token_manager().call_slot(caller) as permitted:
+        if not permitted:
+            return {"error": "xAI call limit reached. Please try again later."}
+        return _post_xai_request(payload, xai_api_key)
+
+def _post_xai_request(payload, xai_api_key):
+
     headers = {
         "Authorization": f"Bearer {xai_api_key}",
         "Content-Type": "application/json"
@@ -369,7 +378,7 @@ def generate_tooltip_advice(term, xai_api_key=None):
             "max_tokens": 100
         }
 
-        result = query_xai_api(payload, api_key=xai_api_key)
+        result = query_xai_api(payload, api_key=xai_api_key, caller=XAI_CLASS_TOOLTIPS)
 
         if "error" in result:
             logger.error(f"Error generating tooltip for {term}: {result['error']}")
@@ -486,7 +495,7 @@ def generate_ava_advice(deal_data, mentor_type='cfo', xai_api_key=None):
             "max_tokens": 1000
         }
 
-        result = query_xai_api(payload, api_key=xai_api_key)
+        result = query_xai_api(payload, api_key=xai_api_key, caller=XAI_CLASS_AVA_ADVICE)
 
         if "error" in result:
             logger.error(f"Error generating advice: {result['error']}")
@@ -502,3 +511,84 @@ def generate_ava_advice(deal_data, mentor_type='cfo', xai_api_key=None):
         logger.error(f"Exception in generate_ava_advice: {e}")
         logger.error(traceback.format_exc())
         return "Mentor unexpectedly failed ... Please try again"
+
+def generate_mentor_reply(message, mentor_name='olyvia', xai_api_key=None):
+    """
+    Answers a Mentor Chat message in the persona of `mentor_name`.
+    Returns {'reply': ...} or {'error': ...}.
+    """
+    mentor = get_mentor_config(mentor_name)
+
+    # Load Strategy Context
+    strategies_text = load_strategies()
+    strategy_section = ""
+    if strategies_text:
+         strategy_section = f"""
+    **Learned Strategies Knowledge Base:**
+    {strategies_text}
+    """
+
+    # Load Intelligence Context
+    intelligence_text = load_intelligence()
+    intelligence_section = ""
+    if intelligence_text:
+         intelligence_section = f"""
+    **Learned Intelligence/Concepts Knowledge Base:**
+    {intelligence_text}
+    """
+
+    prompt = f"""
+    You are {mentor['name']}, {mentor['role']}.
+
+    **Your Persona:**
+    *   **Intro:** "{mentor['intro']}"
+    *   **Focus:** {mentor['focus']}
+    *   **Tone:** {mentor['tone']}
+    *   **Style:** {mentor['style_guide']}
+
+    **Context:**
+    You are chatting with a user (Tim) about online arbitrage, Amazon FBA, and business strategy.
+    Use your specific persona and the knowledge bases below to answer their questions.
+    Prioritize the strategies and intelligence gathered.
+    *   **Constraint:** Do NOT start with an introduction or preamble.
+    *   **Constraint:** Do NOT use markdown. Use HTML tags (e.g., <b>, <br>, <p>) for formatting.
+
+    {strategy_section}
+
+    {intelligence_section}
+
+    {STRATEGIC_CORRECTIONS}
+
+    **User Message:**
+    {message}
+
+    **Your Response:**
+    """
+
+    payload = {
+        "messages": [
+            {
+                "role": "system",
+                "content": f"You are {mentor['name']}, an expert book arbitrage assistant. Stay in character."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "model": "grok-4-fast-reasoning", # Use reasoning model
+        "stream": False,
+        "temperature": 0.5,
+        "max_tokens": 300
+    }
+
+    result = query_xai_api(payload, api_key=xai_api_key, caller=XAI_CLASS_MENTOR_CHAT)
+
+    if "error" in result:
+        return {'error': result['error']}
+
+    try:
+        return {'reply': result['choices'][0]['message']['content'].strip()}
+    except (KeyError, IndexError):
+        logger.exception(f"Error parsing AI response: {result}")
+        return {'error': 'Invalid response from AI'}
@@ -0,0 +1,121 @@
+# keepa_deals/ava_jobs.py
+# Runs the user-triggered xAI requests (tooltips, Advice from Ava, Mentor Chat) on the
+# dedicated `ava` Celery queue, so a web thread never waits on xAI.
+
+import json
+import logging
+import os
+import time
+import uuid
+
+import redis
+
+from worker import celery_app as celery
+from .ava_advisor import generate_ava_advice, generate_mentor_reply, generate_tooltip_advice
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+AVA_QUEUE = 'ava'
+# Jobs one user may have queued or running at once; more are refused (HTTP 429).
+AVA_MAX_JOBS_PER_USER = int(os.getenv('AVA_MAX_JOBS_PER_USER', '3'))
+# A job's in-flight slot is given back after this long even if its worker never
+# finished it (e.g. the worker was killed). Covers query_xai_api's retries.
+AVA_JOB_LEASE_SECONDS = int(os.getenv('AVA_JOB_LEASE_SECONDS', '900'))
+# How long a job's state (and answer) can be polled.
+AVA_JOB_TTL_SECONDS = int(os.getenv('AVA_JOB_TTL_SECONDS', '1800'))
+
+JOB_TOOLTIP = 'tooltip'
+JOB_AVA_ADVICE = 'ava_advice'
+JOB_MENTOR_CHAT = 'mentor_chat'
+
+REDIS_KEY_JOB = 'ava_job'                 # string per job: JSON state
+REDIS_KEY_USER_JOBS = 'ava_jobs_in_flight'  # zset per user: job id -> lease expiry
+
+_redis_client = None
+
+class JobLimitReached(Exception):
+    """The user already has AVA_MAX_JOBS_PER_USER jobs in flight."""
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        redis_url = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+        _redis_client = redis.Redis.from_url(redis_url, decode_responses=True,
+                                            socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+def _set_job(job_id, state):
+    _client().set(f"{REDIS_KEY_JOB}:{job_id}", json.dumps(state), ex=AVA_JOB_TTL_SECONDS)
+
+def _release(user, job_id):
+    try:
+        _client().zrem(f"{REDIS_KEY_USER_JOBS}:{user}", job_id)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release Ava job slot (it expires on its own): {e}")
+
+def run_job(kind, params):
+    """
+    Answers one request. Returns the JSON body the endpoint used to return inline:
+    {'tooltip': ...}, {'advice': ...}, {'reply': ...} or {'error': ...}.
+    """
+    if kind == JOB_TOOLTIP:
+        return {'tooltip': generate_tooltip_advice(params['term'])}
+    if kind == JOB_AVA_ADVICE:
+        return {'advice': generate_ava_advice(params['deal'], mentor_type=params['mentor'])}
+    if kind == JOB_MENTOR_CHAT:
+        return generate_mentor_reply(params['message'], params['mentor'])
+    raise ValueError(f"Unknown Ava job kind '{kind}'")
+
+def submit_job(kind, user, params):
+    """
+    Queues `run_job(kind, params)` for `user` and returns its job id.
+    Raises JobLimitReached if the user is at their limit, or redis.RedisError /
+    the broker's error if the job could not be queued.
+    """
+    job_id = uuid.uuid4().hex
+    user_jobs = f"{REDIS_KEY_USER_JOBS}:{user}"
+    now = time.time()
+
+    # Optimistic reservation: add, count, and undo if over the limit
+    pipe = _client().pipeline()
+    pipe.zremrangebyscore(user_jobs, '-inf', now)
+    pipe.zadd(user_jobs, {job_id: now + AVA_JOB_LEASE_SECONDS})
+    pipe.zcard(user_jobs)
+    pipe.expire(user_jobs, AVA_JOB_LEASE_SECONDS)
+    in_flight = pipe.execute()[2]
+    if in_flight > AVA_MAX_JOBS_PER_USER:
+        _release(user, job_id)
+        raise JobLimitReached()
+
+    try:
+        _set_job(job_id, {'status': 'queued', 'kind': kind, 'user': user})
+        celery.send_task('keepa_deals.ava_jobs.run_ava_job', args=[job_id, kind, user, params])
+    except Exception:
+        _release(user, job_id)
+        raise
+    return job_id
+
+def get_job(job_id):
+    """The job's state ({'status': 'queued' | 'running' | 'done' | 'failed', 'user', 'result'}), or None."""
+    state = _client().get(f"{REDIS_KEY_JOB}:{job_id}")
+    return json.loads(state) if state else None
+
+@celery.task(name='keepa_deals.ava_jobs.run_ava_job')
+def run_ava_job(job_id, kind, user, params):
+    """Runs a job queued by submit_job and stores its answer for polling."""
+    state = {'status': 'running', 'kind': kind, 'user': user}
+    try:
+        _set_job(job_id, state)
+        result = run_job(kind, params)
+    except Exception as e:
+        logger.error(f"Ava job {job_id} ({kind}) failed: {e}", exc_info=True)
+        result = {'error': str(e)}
+    finally:
+        _release(user, job_id)
+
+    state.update(status='failed' if 'error' in result else 'done', result=result)
+    try:
+        _set_job(job_id, state)
+    except redis.RedisError as e:
+        logger.error(f"Could not store the answer of Ava job {job_id}: {e}")
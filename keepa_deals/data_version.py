@@ -0,0 +1,114 @@
+# keepa_deals/data_version.py
+# Change counter for the deals feed, its change notifications and the dashboard count cache.
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+DEAL_COUNT_CACHE_ENABLED = os.getenv('DEAL_COUNT_CACHE_ENABLED', '1') == '1'
+# Upper bound on cached counts (one per filter shape/values, user and version).
+DEAL_COUNT_CACHE_MAX_ENTRIES = int(os.getenv('DEAL_COUNT_CACHE_MAX_ENTRIES', '1024'))
+# Safety net: a count is recomputed after this long even if no write bumped the
+# version (e.g. a writer could not reach Redis).
+DEAL_COUNT_CACHE_TTL_SECONDS = float(os.getenv('DEAL_COUNT_CACHE_TTL_SECONDS', '300'))
+
+# Incremented after every committed write to `deals` or `user_restrictions`.
+REDIS_KEY = 'deals_data_version'
+# Pub/sub channel pushing feed changes, recalc progress and new Prime Picks to open
+# dashboards (the /api/events stream).
+EVENTS_CHANNEL = 'deals_feed_events'
+# Changed ASINs listed per event; larger writes only report their count.
+EVENT_MAX_ASINS = 200
+
+_redis_client = None
+_cache = OrderedDict()  # (key, version) -> (value, cached_at)
+_cache_lock = threading.Lock()
+
+def _client():
+    global _redis_client
+    if _redis_client is None:
+        redis_url = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+        _redis_client = redis.Redis.from_url(redis_url, decode_responses=True,
+                                            socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+def bump_data_version(source=None, asins=None, count=None):
+    """
+    Marks the deals feed as changed. Call after every committed write to `deals` or
+    `user_restrictions` (ingestor, janitor, recalculator, restriction checks) so cached
+    dashboard counts are recomputed, and open dashboards get a `deals` event naming the
+    writer (`source`) and the changed ASINs. Returns the new version, or None without Redis.
+    """
+    try:
+        version = _client().incr(REDIS_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Could not bump the deals data version: {e}")
+        return None
+
+    asins = [a for a in (asins or []) if a]
+    publish_event('deals', {
+        'version': version,
+        'source': source,
+        'count': len(asins) if count is None else count,
+        'asins': asins[:EVENT_MAX_ASINS],
+    })
+    return version
+
+def publish_event(event, data):
+    """Pushes `{"event": event, ...data}` to dashboard subscribers. Best effort: never raises."""
+    try:
+        _client().publish(EVENTS_CHANNEL, json.dumps({'event': event, **data}, default=str))
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish '{event}' event: {e}")
+
+def subscribe_events():
+    """A Redis PubSub subscribed to the feed events channel (caller closes it)."""
+    pubsub = _client().pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(EVENTS_CHANNEL)
+    return pubsub
+
+def data_version():
+    """Current version of the deals feed, or None if Redis is unavailable."""
+    try:
+        return int(_client().get(REDIS_KEY) or 0)
+    except redis.RedisError as e:
+        logger.debug(f"Could not read the deals data version: {e}")
+        return None
+
+def cached_count(key, compute):
+    """
+    `compute()` cached per (`key`, data version). While nothing has been written the
+    cached value is returned without touching SQLite. Without Redis (no version to
+    validate against) every call computes.
+    """
+    version = data_version() if DEAL_COUNT_CACHE_ENABLED else None
+    if version is None:
+        return compute()
+
+    cache_key = (key, version)
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _cache.get(cache_key)
+        if hit and now - hit[1] < DEAL_COUNT_CACHE_TTL_SECONDS:
+            _cache.move_to_end(cache_key)
+            return hit[0]
+
+    value = compute()
+    with _cache_lock:
+        _cache[cache_key] = (value, now)
+        _cache.move_to_end(cache_key)
+        while len(_cache) > DEAL_COUNT_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return value
+
+def clear_count_cache():
+    with _cache_lock:
+        _cache.clear()
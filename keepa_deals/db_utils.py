@@ -4,8 +4,11 @@ import json
 import os
 import re
 import logging
+import threading
 from datetime import datetime, timezone
 
+from .data_version import bump_data_version
+
 logger = logging.getLogger(__name__)
 
 # Use DATABASE_URL if set, otherwise default to deals.db in parent directory
@@ -14,19 +17,169 @@ TABLE_NAME = 'deals'
 HEADERS_PATH = os.path.join(os.path.dirname(__file__), 'headers.json')
 WATERMARK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'watermark.json')
 
+# --- Numeric Shadow Columns ---
+# Currency/percent fields are stored as display TEXT (e.g. "$12.34", "45%"). Each gets a
+# typed shadow column, written alongside it, so filters and sorts can use an index
+# instead of CAST(REPLACE(...)) on every row.
+# (source column, shadow column, SQL type)
+NUMERIC_SHADOW_COLUMNS = [
+    ('Profit', 'Profit_num', 'REAL'),
+    ('All_in_Cost', 'All_in_Cost_num', 'REAL'),
+    ('Margin', 'Margin_num', 'REAL'),
+    ('1yr_Avg', '1yr_Avg_num', 'REAL'),
+    ('List_at', 'List_at_num', 'REAL'),
+    ('Deal_Trust', 'Deal_Trust_num', 'REAL'),
+    ('Percent_Down', 'Percent_Down_num', 'INTEGER'),
+]
+SHADOW_COLUMN_FOR = {source: shadow for source, shadow, _ in NUMERIC_SHADOW_COLUMNS}
+
+# --- Managed Secondary Indexes on deals ---
+# Chosen from the query shapes the web tier and tasks emit; tests/test_query_plans.py
+# fails if one of those queries falls back to a table scan. Indexes named idx_deals_*
+# that are not listed here are dropped by the migration, changed ones are rebuilt.
+MANAGED_INDEX_PREFIX = f'idx_{TABLE_NAME}_'
+DEALS_INDEXES = {
+    # Janitor count/delete by age, stale rescue ordered by age
+    'idx_deals_last_seen_utc': ('last_seen_utc',),
+    # The dashboard floor every /api/deals and /api/deal-count query applies
+    # (Profit > 0, List at > 0, 1yr Avg > 0); covers the deal-count poll entirely.
+    'idx_deals_floor': ('Profit_num', 'List_at_num', '1yr_Avg_num'),
+    # Dashboard filters and numeric sorts
+    'idx_deals_Deal_Trust_num': ('Deal_Trust_num',),
+    'idx_deals_Percent_Down_num': ('Percent_Down_num',),
+    'idx_deals_Margin_num': ('Margin_num',),
+    'idx_deals_Sales_Rank_Current': ('Sales_Rank_Current',),
+}
+
+# --- Keyword Search Index ---
+# FTS5 index over the dashboard keyword columns, kept in sync with deals by triggers.
+# The trigram tokenizer indexes every 3-character substring, so a quoted phrase MATCH
+# returns exactly the rows LIKE '%keyword%' did (case-insensitive), from the index.
+KEYWORD_SEARCH_COLUMNS = ('Title', 'Categories_Sub', 'Detailed_Seasonality', 'Manufacturer', 'Author', 'Seller')
+KEYWORD_FTS_TABLE = f'{TABLE_NAME}_fts'
+# Shorter keywords have no trigram to look up and keep using LIKE.
+KEYWORD_FTS_MIN_LENGTH = 3
+_KEYWORD_FTS_TRIGGERS = tuple(f'{KEYWORD_FTS_TABLE}_{suffix}' for suffix in ('ai', 'ad', 'au'))
+
+# --- Connection Pool ---
+# get_db_connection hands out connections from a per-thread pool: web threads and
+# Celery worker processes (one thread each under prefork) reuse their connections,
+# and with them the page cache, instead of opening a new one per query.
+SQLITE_POOL_ENABLED = os.getenv('SQLITE_POOL_ENABLED', '1') == '1'
+# Idle connections kept per thread and database file.
+SQLITE_POOL_MAX_IDLE = int(os.getenv('SQLITE_POOL_MAX_IDLE', '2'))
+# Per-connection page cache (KiB) and memory-mapped I/O window (bytes).
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB', '32768'))
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+_pool = threading.local()  # .pid, .idle: {db_path: [connection, ...]}
+# Connections inherited across fork. Closing one in the child could checkpoint or
+# delete the parent's WAL, so they are kept referenced and never touched again.
+_inherited_connections = []
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A connection that goes back to its thread's pool when the caller is done with it:
+    on close(), and at the end of a `with` block (after the usual commit/rollback).
+    An uncommitted transaction is rolled back on release, as close() would have done.
+    """
+
+    def close(self):
+        self._release()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super().__exit__(exc_type, exc_value, traceback)
+        self._release()
+        return result
+
+    def _release(self):
+        if not self._checked_out:
+            return
+        self._checked_out = False
+        idle = _idle_connections(self._db_path)
+        # In-memory databases are private to their connection and never reused
+        if (self._owner != threading.get_ident() or idle is None or self._file_id is None
+                or len(idle) >= SQLITE_POOL_MAX_IDLE):
+            super().close()
+            return
+        try:
+            if self.in_transaction:
+                self.rollback()
+            # Undo per-caller settings so the next checkout starts from defaults
+            self.row_factory = None
+            self.text_factory = str
+            self.isolation_level = ''
+            self.set_trace_callback(None)
+        except sqlite3.Error:
+            super().close()
+            return
+        idle.append(self)
+
+
+def _idle_connections(db_path):
+    """This thread's idle connections to `db_path` (None if pooling is off)."""
+    if not SQLITE_POOL_ENABLED:
+        return None
+    pid = os.getpid()
+    if getattr(_pool, 'pid', None) != pid:
+        # First use in this thread, or first use after a fork
+        for connections in getattr(_pool, 'idle', {}).values():
+            _inherited_connections.extend(connections)
+        _pool.pid = pid
+        _pool.idle = {}
+    return _pool.idle.setdefault(db_path, [])
+
+
+def _file_id(db_path):
+    try:
+        stat = os.stat(db_path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
 def get_db_connection(db_path=None, timeout=5.0):
     """
     Returns a sqlite3 connection with busy_timeout and WAL journal mode set.
-    Use this instead of sqlite3.connect(DB_PATH) directly to ensure consistent
+    Use this instead of get_db_connection(DB_PATH) directly to ensure consistent
     concurrency settings across all DB access (WSGI + Celery + diagnostics).
+
+    Connections are pooled per thread: close() or leaving a `with` block returns it
+    to the pool, so don't use the connection after that.
     """
     path = db_path if db_path is not None else DB_PATH
-    conn = sqlite3.connect(path, timeout=timeout)
+    idle = _idle_connections(path)
+    file_id = _file_id(path)
+    while idle:
+        conn = idle.pop()
+        # A database file replaced since (e.g. deleted and recreated) needs a new connection
+        if conn._file_id == file_id:
+            conn._checked_out = True
+            return conn
+        sqlite3.Connection.close(conn)
+
+    conn = sqlite3.connect(path, timeout=timeout, factory=PooledConnection)
     conn.execute("PRAGMA busy_timeout=5000")
     conn.execute("PRAGMA journal_mode=WAL")
+    # Rows removed by INSERT OR REPLACE must fire delete triggers (keyword search index)
+    conn.execute("PRAGMA recursive_triggers=ON")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn._db_path = path
+    conn._file_id = file_id or _file_id(path)
+    conn._owner = threading.get_ident()
+    conn._checked_out = True
     return conn
 
 
+def close_db_connections():
+    """Closes this thread's idle pooled connections (e.g. before deleting a database file)."""
+    for connections in getattr(_pool, 'idle', {}).values():
+        while connections:
+            sqlite3.Connection.close(connections.pop())
+
+
 def sanitize_col_name(name):
     """Sanitizes a string to be a valid SQLite column name."""
     name = name.replace('%', 'Percent').replace('&', 'and').replace('.', '_')
@@ -35,6 +188,152 @@ def sanitize_col_name(name):
     name = name.strip('_')
     return name
 
+def parse_numeric(value, integer=False):
+    """
+    Parses a display value ("$1,234.56", "45%", 12.5) to a number.
+    Placeholders and unparseable text ("-", "N/A", "") return None.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        number = float(value)
+    else:
+        try:
+            number = float(str(value).strip().replace('$', '').replace(',', '').replace('%', ''))
+        except ValueError:
+            return None
+    if number != number:  # NaN
+        return None
+    return int(number) if integer else number
+
+def numeric_shadows(row):
+    """
+    Returns the shadow column values for the source columns present in `row`
+    (a dict keyed by sanitized column name). Merge into a row before writing it.
+    """
+    return {
+        shadow: parse_numeric(row[source], integer=(col_type == 'INTEGER'))
+        for source, shadow, col_type in NUMERIC_SHADOW_COLUMNS
+        if source in row
+    }
+
+def with_numeric_shadows(columns, rows):
+    """
+    Extends an executemany() upsert (column list + value tuples) with the shadow
+    columns of any source columns it writes.
+    """
+    shadow_columns = list(numeric_shadows(dict.fromkeys(columns)))
+    if not shadow_columns:
+        return list(columns), rows
+    extended = [tuple(row) + tuple(numeric_shadows(dict(zip(columns, row))).values()) for row in rows]
+    return list(columns) + shadow_columns, extended
+
+def ensure_numeric_shadow_columns(cursor, table_name=TABLE_NAME):
+    """
+    Migration: adds missing shadow columns and backfills them from their source
+    columns. Idempotent; only newly added columns are backfilled.
+    """
+    existing_columns = get_table_columns(cursor, table_name)
+    for source, shadow, col_type in NUMERIC_SHADOW_COLUMNS:
+        if shadow not in existing_columns:
+            logger.info(f"Schema Migration: Adding numeric shadow column '{shadow}' ({col_type}).")
+            cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN "{shadow}" {col_type}')
+            if source in existing_columns:
+                cursor.execute(f'SELECT id, "{source}" FROM {table_name} WHERE "{source}" IS NOT NULL')
+                updates = [(parse_numeric(value, integer=(col_type == 'INTEGER')), row_id) for row_id, value in cursor.fetchall()]
+                cursor.executemany(f'UPDATE {table_name} SET "{shadow}" = ? WHERE id = ?', updates)
+                logger.info(f"Schema Migration: Backfilled '{shadow}' for {len(updates)} rows.")
+
+def migrate_profit_confidence_to_deal_trust(cursor, table_name=TABLE_NAME):
+    """
+    Data migration (2026-02-12): copies Profit_Confidence into an empty Deal_Trust,
+    with its shadow value (the shadow columns must exist). Returns the rows updated.
+    """
+    cursor.execute(f'SELECT id, "Profit_Confidence" FROM {table_name} WHERE "Deal_Trust" IS NULL AND "Profit_Confidence" IS NOT NULL')
+    updates = [(value, parse_numeric(value), row_id) for row_id, value in cursor.fetchall()]
+    cursor.executemany(f'UPDATE {table_name} SET "Deal_Trust" = ?, "Deal_Trust_num" = ? WHERE id = ?', updates)
+    return len(updates)
+
+def ensure_deals_indexes(cursor):
+    """
+    Migration: brings the managed indexes on deals in line with DEALS_INDEXES
+    (creates missing ones, rebuilds changed ones, drops retired ones).
+    """
+    existing_columns = set(get_table_columns(cursor, TABLE_NAME))
+    cursor.execute(f"PRAGMA index_list('{TABLE_NAME}')")
+    current = {row[1] for row in cursor.fetchall() if row[1].startswith(MANAGED_INDEX_PREFIX)}
+
+    changed = False
+    for name in sorted(current - set(DEALS_INDEXES)):
+        logger.info(f"Index Migration: Dropping retired index '{name}'.")
+        cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        changed = True
+
+    for name, columns in DEALS_INDEXES.items():
+        missing = [c for c in columns if c not in existing_columns]
+        if missing:
+            logger.warning(f"Index Migration: Skipping '{name}', missing columns {missing}.")
+            continue
+        if name in current:
+            cursor.execute(f"PRAGMA index_info('{name}')")
+            if [row[2] for row in cursor.fetchall()] == list(columns):
+                continue
+            logger.info(f"Index Migration: Rebuilding changed index '{name}'.")
+            cursor.execute(f'DROP INDEX "{name}"')
+        else:
+            logger.info(f"Index Migration: Creating index '{name}' on {columns}.")
+        cols_sql = ', '.join(f'"{c}"' for c in columns)
+        cursor.execute(f'CREATE INDEX "{name}" ON {TABLE_NAME}({cols_sql})')
+        changed = True
+
+    if changed:
+        # Refresh planner statistics for the new indexes
+        cursor.execute("PRAGMA optimize")
+
+def ensure_keyword_search_index(cursor):
+    """
+    Migration: creates the keyword search index (KEYWORD_FTS_TABLE) and the triggers
+    that keep it in sync with deals, and backfills it. Rebuilt when the indexed columns
+    change or a trigger is missing (e.g. after the deals table was dropped).
+    """
+    existing_columns = set(get_table_columns(cursor, TABLE_NAME))
+    columns = [c for c in KEYWORD_SEARCH_COLUMNS if c in existing_columns]
+    if not columns:
+        return
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ?", (TABLE_NAME,))
+    triggers = {row[0] for row in cursor.fetchall()}
+    if get_table_columns(cursor, KEYWORD_FTS_TABLE) == columns and triggers.issuperset(_KEYWORD_FTS_TRIGGERS):
+        return
+
+    logger.info(f"Search Index Migration: Building '{KEYWORD_FTS_TABLE}' over {columns}.")
+    for trigger in _KEYWORD_FTS_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS "{trigger}"')
+    cursor.execute(f"DROP TABLE IF EXISTS {KEYWORD_FTS_TABLE}")
+
+    cols_sql = ', '.join(f'"{c}"' for c in columns)
+    new_sql = ', '.join(f'new."{c}"' for c in columns)
+    update_of = ', '.join(f'"{c}"' for c in columns)
+    ai, ad, au = _KEYWORD_FTS_TRIGGERS
+    cursor.execute(f"CREATE VIRTUAL TABLE {KEYWORD_FTS_TABLE} USING fts5({cols_sql}, tokenize='trigram')")
+    cursor.execute(f"""
+        CREATE TRIGGER "{ai}" AFTER INSERT ON {TABLE_NAME} BEGIN
+            INSERT INTO {KEYWORD_FTS_TABLE}(rowid, {cols_sql}) VALUES (new.id, {new_sql});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER "{ad}" AFTER DELETE ON {TABLE_NAME} BEGIN
+            DELETE FROM {KEYWORD_FTS_TABLE} WHERE rowid = old.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER "{au}" AFTER UPDATE OF {update_of} ON {TABLE_NAME} BEGIN
+            DELETE FROM {KEYWORD_FTS_TABLE} WHERE rowid = old.id;
+            INSERT INTO {KEYWORD_FTS_TABLE}(rowid, {cols_sql}) VALUES (new.id, {new_sql});
+        END
+    """)
+    cursor.execute(f"INSERT INTO {KEYWORD_FTS_TABLE}(rowid, {cols_sql}) SELECT id, {cols_sql} FROM {TABLE_NAME}")
+    logger.info(f"Search Index Migration: Indexed {cursor.rowcount} deals.")
+
 def get_table_columns(cursor, table_name):
     """Fetches the column names for a given table."""
     cursor.execute(f"PRAGMA table_info({table_name})")
@@ -64,7 +363,7 @@ def create_system_state_table_if_not_exists():
     """
     logger.info(f"Database check: Ensuring table 'system_state' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS system_state (
@@ -81,7 +380,7 @@ def create_system_state_table_if_not_exists():
 def get_system_state(key: str, default=None):
     """Retrieves a value from the system_state table."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT value FROM system_state WHERE key = ?", (key,))
             row = cursor.fetchone()
@@ -95,7 +394,7 @@ def get_system_state(key: str, default=None):
 def set_system_state(key: str, value: str):
     """Sets a value in the system_state table."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             updated_at = datetime.now(timezone.utc).isoformat()
             cursor.execute("""
@@ -125,7 +424,7 @@ def create_deals_table_if_not_exists():
 
     logger.info(f"Database check: Ensuring table '{TABLE_NAME}' at '{DB_PATH}' is correctly configured.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
 
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{TABLE_NAME}'")
@@ -189,6 +488,10 @@ def create_deals_table_if_not_exists():
                 logger.info("Adding 'AMZ' column.")
                 cursor.execute(f'ALTER TABLE {TABLE_NAME} ADD COLUMN AMZ TEXT')
 
+            ensure_numeric_shadow_columns(cursor)
+            ensure_deals_indexes(cursor)
+            ensure_keyword_search_index(cursor)
+
             if not has_unique_index_on_asin(cursor, TABLE_NAME):
                 logger.warning("No unique index found on ASIN column. This should have been created with the table.")
 
@@ -196,13 +499,9 @@ def create_deals_table_if_not_exists():
             if "Profit_Confidence" in existing_columns and "Deal_Trust" in existing_columns:
                 logger.info("Migrating data from 'Profit_Confidence' to 'Deal_Trust'...")
                 try:
-                    cursor.execute("""
-                        UPDATE deals
-                        SET "Deal_Trust" = "Profit_Confidence"
-                        WHERE "Deal_Trust" IS NULL AND "Profit_Confidence" IS NOT NULL
-                    """)
-                    if cursor.rowcount > 0:
-                        logger.info(f"Migration successful. Updated {cursor.rowcount} rows.")
+                    migrated = migrate_profit_confidence_to_deal_trust(cursor)
+                    if migrated > 0:
+                        logger.info(f"Migration successful. Updated {migrated} rows.")
                 except sqlite3.Error as e:
                     logger.error(f"Error migrating Profit_Confidence data: {e}")
 
@@ -221,7 +520,7 @@ def recreate_deals_table():
     """
     logger.info(f"Recreating '{TABLE_NAME}' table at '{DB_PATH}'. This will delete all existing data in the table.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
 
             # Drop the old table to ensure a completely fresh start
@@ -261,8 +560,13 @@ def recreate_deals_table():
             cursor.execute(f"CREATE UNIQUE INDEX idx_asin_unique ON {TABLE_NAME}(ASIN)")
             logger.info("Created unique index on ASIN.")
 
+            ensure_numeric_shadow_columns(cursor)
+            ensure_deals_indexes(cursor)
+            ensure_keyword_search_index(cursor)
+
             conn.commit()
             logger.info("Database schema recreation complete.")
+        bump_data_version('reset')
 
     except (sqlite3.Error, IOError, json.JSONDecodeError) as e:
         logger.error(f"A critical error occurred during table recreation: {e}", exc_info=True)
@@ -308,7 +612,7 @@ def create_user_restrictions_table_if_not_exists():
     table_name = 'user_restrictions'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' is correctly configured.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
 
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
@@ -345,7 +649,7 @@ def recreate_user_restrictions_table():
     table_name = 'user_restrictions'
     logger.info(f"Recreating '{table_name}' table at '{DB_PATH}'. This will delete all existing restriction data.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
             conn.commit()
@@ -367,7 +671,7 @@ def create_user_credentials_table_if_not_exists():
     table_name = 'user_credentials'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
@@ -390,7 +694,7 @@ def create_prime_picks_table_if_not_exists():
     table_name = 'prime_picks'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
@@ -415,7 +719,7 @@ def create_prime_picks_table_if_not_exists():
 def save_user_credentials(user_id: str, refresh_token: str):
     """Saves or updates user SP-API credentials."""
     # Let exceptions propagate to the caller for proper UI feedback
-    with sqlite3.connect(DB_PATH) as conn:
+    with get_db_connection(DB_PATH) as conn:
         cursor = conn.cursor()
         updated_at = datetime.now(timezone.utc).isoformat()
         cursor.execute("""
@@ -428,7 +732,7 @@ def save_user_credentials(user_id: str, refresh_token: str):
 def get_all_user_credentials():
     """Retrieves all user credentials for background processing."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("SELECT user_id, refresh_token FROM user_credentials")
@@ -440,7 +744,7 @@ def get_all_user_credentials():
 def get_deal_count():
     """Returns the total number of rows in the deals table."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}")
             row = cursor.fetchone()
@@ -456,7 +760,7 @@ def save_deals_to_db(deals_data):
     if not deals_data:
         return
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection(DB_PATH)
     cursor = conn.cursor()
 
     # Get the columns from the deals table to ensure we only insert what's expected
@@ -470,6 +774,7 @@ def save_deals_to_db(deals_data):
             sanitized_key = sanitize_col_name(k)
             if sanitized_key in table_columns:
                  sanitized_deal[sanitized_key] = v
+        sanitized_deal.update({k: v for k, v in numeric_shadows(sanitized_deal).items() if k in table_columns})
 
         if not sanitized_deal:
              logger.warning(f"Skipping deal for ASIN {deal.get('ASIN')} because no valid columns were found.")
@@ -488,14 +793,16 @@ def save_deals_to_db(deals_data):
 
     conn.commit()
     conn.close()
+    bump_data_version('save_deals', asins=[deal.get('ASIN') for deal in deals_data])
     logging.info(f"Successfully saved/updated {len(deals_data)} deals to the database.")
 
 def clear_deals_table():
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection(DB_PATH)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM deals")
     conn.commit()
     conn.close()
+    bump_data_version('reset')
     logging.info("Deals table cleared.")
 
 
@@ -503,7 +810,7 @@ def create_confirmed_buys_table_if_not_exists():
     table_name = 'confirmed_buys'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
@@ -546,7 +853,7 @@ def create_confirmed_buy_units_table_if_not_exists():
     table_name = 'confirmed_buy_units'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
@@ -576,7 +883,7 @@ def create_inventory_ledger_table_if_not_exists():
     table_name = 'inventory_ledger'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
@@ -620,7 +927,7 @@ def create_sales_ledger_table_if_not_exists():
     table_name = 'sales_ledger'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
 
@@ -669,7 +976,7 @@ def create_reconciliation_log_table_if_not_exists():
     table_name = 'reconciliation_log'
     logger.info(f"Database check: Ensuring table '{table_name}' at '{DB_PATH}' exists.")
     try:
-        with sqlite3.connect(DB_PATH) as conn:
+        with get_db_connection(DB_PATH) as conn:
             cursor = conn.cursor()
             cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
             if not cursor.fetchone():
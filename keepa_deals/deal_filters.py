@@ -0,0 +1,363 @@
+# keepa_deals/deal_filters.py
+# Shared filter-to-SQL planner for the dashboard endpoints (/api/deals and /api/deal-count).
+
+import base64
+import json
+import logging
+import os
+from functools import lru_cache
+
+from .db_utils import SHADOW_COLUMN_FOR, KEYWORD_SEARCH_COLUMNS, KEYWORD_FTS_TABLE, KEYWORD_FTS_MIN_LENGTH
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = 'deals'
+RESTRICTIONS_TABLE = 'user_restrictions'
+
+# Compiled statements kept per process. One entry per filter *shape* (which filters are
+# active, excluded conditions, join and sort), never per value: values are always bound.
+STATEMENT_CACHE_SIZE = 256
+
+# Excluded condition -> clause. The DB holds both codes ('1') and labels ('New'),
+# so every representation is excluded. Dict order is the canonical clause order.
+CONDITION_EXCLUSIONS = {
+    'New': "(\"Condition\" != '1' AND \"Condition\" != 'New' AND \"Condition\" NOT LIKE 'New, %')",
+    'U-Like New': "(\"Condition\" != '2' AND \"Condition\" != 'like new' AND \"Condition\" != 'Used - Like New')",
+    'U-Very Good': "(\"Condition\" != '3' AND \"Condition\" != 'very good' AND \"Condition\" != 'Used - Very Good')",
+    'U-Good': "(\"Condition\" != '4' AND \"Condition\" != 'good' AND \"Condition\" != 'Used - Good')",
+    'U-Acceptable': "(\"Condition\" != '5' AND \"Condition\" != 'acceptable' AND \"Condition\" != 'Used - Acceptable')",
+    # Anything starting with Collectible or C-
+    'Collectible': "(\"Condition\" NOT LIKE 'Collectible%' AND \"Condition\" NOT LIKE 'C-%' AND \"Condition\" NOT LIKE 'C -%')",
+}
+
+KEYWORD_COLUMNS = KEYWORD_SEARCH_COLUMNS
+# Keyword through the trigram search index (db_utils.ensure_keyword_search_index):
+# same rows as the LIKE filter, without a scan.
+KEYWORD_FTS_SQL = f"deals.id IN (SELECT rowid FROM {KEYWORD_FTS_TABLE} WHERE {KEYWORD_FTS_TABLE} MATCH ?)"
+
+# Numeric shadow columns (db_utils.NUMERIC_SHADOW_COLUMNS) hold the parsed currency/percent
+# values; placeholders ('-', 'N/A', '') are NULL there, so "> 0" also excludes missing data.
+ROI_SQL = "(\"Profit_num\" * 1.0 / \"All_in_Cost_num\") * 100"
+
+# Always applied: positive profit (unless profit_gte is set) and complete pricing data.
+DEFAULT_FLOOR = ("\"Profit_num\" > 0", "\"List_at_num\" > 0", "\"1yr_Avg_num\" > 0")
+# Agent's Choice "Smart Floor" (replaces the default floor and profit_gte).
+SMART_FLOOR = (
+    "\"Profit_num\" >= 10",
+    f"(\"All_in_Cost_num\" > 0 AND ({ROI_SQL}) >= 15)",
+    "\"Deal_Trust_num\" >= 40",
+    "\"List_at_num\" <= 1500",
+    "\"List_at_num\" > 0",
+    "\"1yr_Avg_num\" > 0",
+)
+
+# Value filters in canonical clause order: (name, arg type, clause, bind values).
+VALUE_FILTERS = (
+    ('sales_rank_current_lte', int, "\"Sales_Rank_Current\" <= ?", lambda v: (v,)),
+    # Cost > 0 guards the division
+    ('roi_gte', int, f"(\"All_in_Cost_num\" > 0 AND ({ROI_SQL}) >= ?)", lambda v: (v,)),
+    ('drops_30_gte', int, "\"Sales_Rank_Drops_last_30_days\" >= ?", lambda v: (v,)),
+    ('keyword', str, "(" + " OR ".join(f"\"{c}\" LIKE ?" for c in KEYWORD_COLUMNS) + ")",
+     lambda v: (f"%{v}%",) * len(KEYWORD_COLUMNS)),
+    ('deal_trust_gte', int, "\"Deal_Trust_num\" >= ?", lambda v: (v,)),
+    # User input is 0-10, DB is 0-1 (Wilson Score). Display rounds to the nearest tenth
+    # (0.95 -> 10/10), so match the rounding lower bound: (input - 0.5) / 10.0
+    ('seller_trust_gte', int, "\"Seller_Quality_Score\" >= ?", lambda v: ((v - 0.5) / 10.0,)),
+    ('profit_gte', float, "\"Profit_num\" >= ?", lambda v: (v,)),
+    ('percent_down_gte', int, "\"Percent_Down_num\" >= ?", lambda v: (v,)),
+)
+_VALUE_FILTERS = {name: (clause, bind) for name, _, clause, bind in VALUE_FILTERS}
+# The keyword as one FTS5 phrase (quotes doubled): matched as a literal substring.
+_VALUE_FILTERS['keyword_fts'] = (KEYWORD_FTS_SQL, lambda v: ('"' + v.replace('"', '""') + '"',))
+_FILTER_SOURCE = {'keyword_fts': 'keyword'}
+
+# Filters that keep their historical "None means off" semantics (0 is a valid bound).
+_ZERO_IS_ACTIVE = {'sales_rank_current_lte'}
+
+# Include NULL (Pending), 0 (Not Restricted) and -1 (Error).
+HIDE_GATED_SQL = "(ur.is_restricted IS NULL OR ur.is_restricted != 1)"
+# Amazon is selling (AMZ column holds the warning icon)
+HIDE_AMZ_SQL = "(deals.\"AMZ\" IS NULL OR deals.\"AMZ\" != '⚠️')"
+
+RESTRICTIONS_JOIN = f" LEFT JOIN {RESTRICTIONS_TABLE} AS ur ON deals.\"ASIN\" = ur.asin AND ur.user_id = ?"
+RESTRICTIONS_COLUMNS = ", ur.is_restricted, ur.approval_url"
+
+# Named column sets a client can request instead of every deals column (`columns=`).
+# Columns missing from the table are skipped. Every set includes ASIN (cursor paging needs it).
+COLUMN_SETS = {
+    # The dashboard grid plus the deal overlay opened from a row
+    'dashboard': (
+        'id', 'ASIN', 'Title', 'Condition', 'Binding', 'Categories_Sub', 'Manufacturer', 'Publication_Date',
+        'Sales_Rank_Current', 'Sales_Rank_180_days_avg', 'Sales_Rank_365_days_avg',
+        'Sales_Rank_Drops_last_180_days', 'Sales_Rank_Drops_last_365_days', 'Drops',
+        'Offers', 'Offers_180', 'Offers_365', 'Detailed_Seasonality', 'Sells', 'Trough_Season',
+        '1yr_Avg', 'Price_Now', 'Percent_Down', 'last_price_change', 'Trend', 'List_at', 'List_Price_Highest',
+        'Expected_Trough_Price', 'Min_Listing_Price', 'Amazon_Current', 'Amazon_365_days_avg', 'AMZ',
+        'Buy_Box_Used_Current', 'Buy_Box_Used_365_days_avg', 'Shipping_Included',
+        'Seller', 'Seller_Quality_Score', 'Deal_Trust', 'All_in_Cost', 'Profit', 'Margin', 'ROI',
+    ),
+}
+
+def parse_filters(args):
+    """
+    Normalizes dashboard query args (a Flask `request.args`) into a canonical filter dict
+    holding only the filters that change the result. Invalid or neutral values (e.g.
+    `roi_gte=0`, unknown conditions) are dropped, so equivalent requests share one shape.
+    """
+    filters = {}
+    if args.get('agents_choice', type=str) == 'true':
+        filters['agents_choice'] = True
+
+    for name, arg_type, _, _ in VALUE_FILTERS:
+        value = args.get(name, type=arg_type)
+        if value is None or value == '':
+            continue
+        if arg_type is not str and name not in _ZERO_IS_ACTIVE and value <= 0:
+            continue
+        filters[name] = value
+
+    for name in ('hide_gated', 'hide_amz'):
+        if args.get(name, type=int) == 1:
+            filters[name] = True
+
+    excluded = set((args.get('excluded_conditions', type=str) or '').split(','))
+    conditions = tuple(c for c in CONDITION_EXCLUSIONS if c in excluded)
+    if conditions:
+        filters['excluded_conditions'] = conditions
+    return filters
+
+def _shape(filters, restrictions_joined, keyword_index=False):
+    """Hashable key of the SQL a filter dict compiles to (values excluded)."""
+    agents_choice = bool(filters.get('agents_choice'))
+    value_filters = tuple(
+        name for name, _, _, _ in VALUE_FILTERS
+        if name in filters and not (agents_choice and name == 'profit_gte')
+    )
+    if keyword_index and len(filters.get('keyword') or '') >= KEYWORD_FTS_MIN_LENGTH:
+        value_filters = tuple('keyword_fts' if name == 'keyword' else name for name in value_filters)
+    return (
+        agents_choice,
+        value_filters,
+        filters.get('excluded_conditions', ()),
+        bool(filters.get('hide_gated')) and restrictions_joined,
+        bool(filters.get('hide_amz')),
+    )
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _compile_where(shape):
+    agents_choice, value_filters, conditions, hide_gated, hide_amz = shape
+    clauses = [CONDITION_EXCLUSIONS[c] for c in conditions]
+    if agents_choice:
+        clauses.extend(SMART_FLOOR)
+    elif 'profit_gte' in value_filters:
+        clauses.extend(DEFAULT_FLOOR[1:])
+    else:
+        clauses.extend(DEFAULT_FLOOR)
+    clauses.extend(_VALUE_FILTERS[name][0] for name in value_filters)
+    if hide_gated:
+        clauses.append(HIDE_GATED_SQL)
+    if hide_amz:
+        clauses.append(HIDE_AMZ_SQL)
+    return " WHERE " + " AND ".join(clauses)
+
+def _bind(filters, shape, user_id):
+    params = [user_id] if user_id else []
+    for name in shape[1]:
+        params.extend(_VALUE_FILTERS[name][1](filters[_FILTER_SOURCE.get(name, name)]))
+    return params
+
+def where_clause(filters, restrictions_joined=False, keyword_index=False):
+    """
+    (" WHERE ...", params) for a filter dict. `hide_gated` needs the restrictions join
+    (alias `ur`) and is ignored without it (fail-open: gated items are shown).
+    `keyword_index` (see keyword_index_ready) runs the keyword filter through the
+    search index; every builder below takes it too.
+    """
+    shape = _shape(filters, restrictions_joined, keyword_index)
+    return _compile_where(shape), _bind(filters, shape, None)
+
+def filter_key(filters):
+    """Hashable identity of a canonical filter dict (shape and values), e.g. for caching results."""
+    return tuple(sorted(filters.items()))
+
+def count_query(filters, user_id=None, keyword_index=False):
+    """
+    COUNT(*) and MAX(id) of the filtered deals for /api/deal-count. The restrictions
+    table is only joined when `hide_gated` needs it (`user_id` of a connected SP-API user).
+    """
+    join = bool(user_id) and bool(filters.get('hide_gated'))
+    shape = _shape(filters, join, keyword_index)
+    return _compile_count(shape, join), _bind(filters, shape, user_id if join else None)
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _compile_count(shape, join):
+    from_clause = f"FROM {TABLE_NAME}" + (RESTRICTIONS_JOIN if join else "")
+    return f"SELECT COUNT(*), MAX(deals.id) {from_clause}{_compile_where(shape)}"
+
+def projection(name, available_columns):
+    """
+    Columns of the named `COLUMN_SETS` entry that exist in the table, for the `columns`
+    argument of the page builders. Raises ValueError for an unknown set.
+    """
+    if name not in COLUMN_SETS:
+        raise ValueError(f"Unknown column set '{name}'. Available: {', '.join(sorted(COLUMN_SETS))}")
+    return tuple(c for c in COLUMN_SETS[name] if c in available_columns)
+
+def _select_clause(columns, join, extra=None):
+    select_clause = "deals.*" if columns is None else ", ".join(f'deals."{c}"' for c in columns)
+    if extra:
+        select_clause += f", {extra}"
+    return select_clause + (RESTRICTIONS_COLUMNS if join else "")
+
+def page_query(filters, sort_clause, order, user_id=None, keyword_index=False, columns=None):
+    """
+    (sql, params) for one /api/deals page. With `user_id` (connected SP-API user) rows
+    carry their restriction status. `columns` (see `projection`) limits the deals columns
+    selected, default all. `sql` expects LIMIT and OFFSET appended to `params`.
+    """
+    shape = _shape(filters, bool(user_id), keyword_index)
+    return _compile_page(shape, bool(user_id), sort_clause, order, columns), _bind(filters, shape, user_id)
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _compile_page(shape, join, sort_clause, order, columns=None):
+    select_clause = _select_clause(columns, join)
+    from_clause = f"FROM {TABLE_NAME}" + (RESTRICTIONS_JOIN if join else "")
+    return f"SELECT {select_clause} {from_clause}{_compile_where(shape)} ORDER BY {sort_clause} {order} LIMIT ? OFFSET ?"
+
+def keyset_page_queries(filters, sort_clause, order, user_id=None, after=None, keyword_index=False, columns=None):
+    """
+    [(sql, params), ...] for one keyset (cursor) page of /api/deals: rows strictly after
+    `after` = (last sort key, last ASIN) in `ORDER BY sort, ASIN` order, so the database
+    seeks to the position instead of skipping OFFSET rows.
+
+    SQLite sorts NULL keys first ascending and last descending. Rows with and without a
+    sort key are read by separate segments, each a plain index range: run them in order
+    until the page is full. Each `sql` returns the sort key as `_sort_key` and expects
+    LIMIT appended to its params.
+    """
+    shape = _shape(filters, bool(user_id), keyword_index)
+    join = bool(user_id)
+    base = _bind(filters, shape, user_id)
+    segments = ('null', 'value') if order == 'asc' else ('value', 'null')
+    if after is None:
+        seek = None
+    else:
+        sort_key, asin = after
+        # Resume inside the segment of the last row; later segments start from their top.
+        segments = segments[segments.index('null' if sort_key is None else 'value'):]
+        seek = (asin,) if sort_key is None else (sort_key, sort_key, asin)
+    queries = []
+    for segment in segments:
+        queries.append((_compile_keyset(shape, join, sort_clause, order, segment, seek is not None, columns),
+                        base + list(seek or ())))
+        seek = None
+    return queries
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _compile_keyset(shape, join, sort_clause, order, segment, seek, columns=None):
+    select_clause = _select_clause(columns, join)
+    from_clause = f"FROM {TABLE_NAME}" + (RESTRICTIONS_JOIN if join else "")
+    op = '>' if order == 'asc' else '<'
+    if segment == 'null':
+        where_sql = f"{_compile_where(shape)} AND {sort_clause} IS NULL"
+        if seek:
+            where_sql += f" AND deals.\"ASIN\" {op} ?"
+        order_by = f"deals.\"ASIN\" {order}"
+    else:
+        if seek:
+            # The range on the sort key alone lets an index on it do the seek;
+            # the ASIN tie-break only filters rows at the boundary key.
+            where_sql = (f"{_compile_where(shape)} AND {sort_clause} {op}= ? "
+                         f"AND ({sort_clause} {op} ? OR deals.\"ASIN\" {op} ?)")
+        else:
+            where_sql = f"{_compile_where(shape)} AND {sort_clause} IS NOT NULL"
+        order_by = f"{sort_clause} {order}, deals.\"ASIN\" {order}"
+    return f"SELECT {select_clause}, {sort_clause} AS _sort_key {from_clause}{where_sql} ORDER BY {order_by} LIMIT ?"
+
+def encode_cursor(sort_by, order, sort_key, asin):
+    """Opaque continuation token for the page after the row (`sort_key`, `asin`)."""
+    payload = json.dumps([sort_by, order, sort_key, asin], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort_by, order):
+    """
+    (sort_key, asin) from a token made by `encode_cursor`. Raises ValueError if the
+    token is malformed or was issued for a different sort.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        token_sort, token_order, sort_key, asin = json.loads(payload)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if (token_sort, token_order) != (sort_by, order) or not isinstance(asin, str):
+        raise ValueError("Cursor does not match the requested sort")
+    return sort_key, asin
+
+def prime_picks_query(filters, user_id=None, keyword_index=False, columns=None):
+    """(sql, params) for the Agent's Choice list: cached Prime Picks that pass the UI filters, by rank."""
+    shape = _shape(filters, bool(user_id), keyword_index)
+    return _compile_prime_picks(shape, bool(user_id), columns), _bind(filters, shape, user_id)
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _compile_prime_picks(shape, join, columns=None):
+    select_clause = _select_clause(columns, join, "pp.rank, pp.score")
+    from_clause = f"FROM prime_picks pp INNER JOIN {TABLE_NAME} AS deals ON pp.asin = deals.\"ASIN\""
+    if join:
+        from_clause += RESTRICTIONS_JOIN
+    return f"SELECT {select_clause} {from_clause}{_compile_where(shape)} ORDER BY pp.rank ASC"
+
+def sort_clause(sort_by, columns, restrictions_joined=False):
+    """ORDER BY expression for a dashboard sort key, validated against the table's columns."""
+    if sort_by == 'Gated':
+        return 'ur.is_restricted' if restrictions_joined else 'deals."id"'
+    if sort_by == 'ROI':
+        # NULLIF prevents division by zero errors in SQLite
+        return '(deals."Profit_num" / NULLIF(deals."All_in_Cost_num", 0))'
+    if sort_by in SHADOW_COLUMN_FOR and SHADOW_COLUMN_FOR[sort_by] in columns:
+        # Sort currency/percent text columns numerically (and by index)
+        return f'deals."{SHADOW_COLUMN_FOR[sort_by]}"'
+    if sort_by in columns:
+        return f'deals."{sort_by}"'
+    return 'deals."id"'
+
+# --- Column metadata ---
+# db_path -> ((inode, PRAGMA schema_version), frozenset of deals columns, keyword index present)
+_columns_cache = {}
+
+def _schema_identity(conn, db_path):
+    try:
+        inode = os.stat(db_path).st_ino
+    except OSError:
+        inode = None  # In-memory / not yet created
+    return inode, conn.execute("PRAGMA schema_version").fetchone()[0]
+
+def _schema(conn, db_path):
+    """
+    (deals columns, keyword index present), cached per process. `PRAGMA schema_version`
+    changes with every schema change (including recreate_deals_table and added shadow
+    columns) and the inode with a replaced database file, so a stale entry is detected
+    without re-reading table_info.
+    """
+    version = _schema_identity(conn, db_path)
+    cached = _columns_cache.get(db_path)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    columns = frozenset(row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})"))
+    has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                             (KEYWORD_FTS_TABLE,)).fetchone() is not None
+    _columns_cache[db_path] = (version, columns, has_index)
+    return columns, has_index
+
+def deal_columns(conn, db_path):
+    """Columns of the deals table (empty if it does not exist), cached per process."""
+    return _schema(conn, db_path)[0]
+
+def keyword_index_ready(conn, db_path):
+    """True if the keyword search index exists (the migration has run on this database)."""
+    return _schema(conn, db_path)[1]
+
+def clear_caches():
+    """Drops compiled statements and column metadata (tests, schema migrations)."""
+    _columns_cache.clear()
+    for compiled in (_compile_where, _compile_count, _compile_page, _compile_keyset, _compile_prime_picks):
+        compiled.cache_clear()
@@ -1,5 +1,7 @@
 from worker import celery_app as celery
 from .db_utils import DB_PATH
+from .data_version import bump_data_version
+from .write_queue import run_write
 import sqlite3
 import logging
 from datetime import datetime, timedelta, timezone
@@ -13,28 +15,32 @@ def _clean_stale_deals_logic(grace_period_hours):
     cutoff_time = (datetime.now(timezone.utc) - timedelta(hours=grace_period_hours)).isoformat()
     logger.info(f"Janitor: Starting cleanup. Deleting deals older than {cutoff_time}...")
 
+    def delete_stale(conn):
+        cursor = conn.cursor()
+        # Count before deleting for logging
+        cursor.execute("SELECT COUNT(*) FROM deals WHERE last_seen_utc < ?", (cutoff_time,))
+        count = cursor.fetchone()[0]
+        if count > 0:
+            cursor.execute("DELETE FROM deals WHERE last_seen_utc < ?", (cutoff_time,))
+        return count
+
     try:
-        with get_db_connection(DB_PATH) as conn:
-            cursor = conn.cursor()
-
-            # Count before deleting for logging
-            cursor.execute("SELECT COUNT(*) FROM deals WHERE last_seen_utc < ?", (cutoff_time,))
-            to_delete_count = cursor.fetchone()[0]
-
-            if to_delete_count > 0:
-                cursor.execute("DELETE FROM deals WHERE last_seen_utc < ?", (cutoff_time,))
-                conn.commit()
-                logger.info(f"Janitor: Successfully deleted {to_delete_count} stale deals.")
-
-                # Optional: VACUUM if many deletions occurred (e.g., > 1000)
-                if to_delete_count > 1000:
-                    logger.info("Janitor: Performing VACUUM to reclaim space...")
-                    cursor.execute("VACUUM")
-                    logger.info("Janitor: VACUUM complete.")
-            else:
-                logger.info("Janitor: No stale deals found.")
-
-            return to_delete_count
+        to_delete_count = run_write(delete_stale, DB_PATH)
+
+        if to_delete_count > 0:
+            bump_data_version('janitor', count=to_delete_count)
+            logger.info(f"Janitor: Successfully deleted {to_delete_count} stale deals.")
+
+            # Optional: VACUUM if many deletions occurred (e.g., > 1000)
+            if to_delete_count > 1000:
+                logger.info("Janitor: Performing VACUUM to reclaim space...")
+                with get_db_connection(DB_PATH) as conn:
+                    conn.execute("VACUUM")
+                logger.info("Janitor: VACUUM complete.")
+        else:
+            logger.info("Janitor: No stale deals found.")
+
+        return to_delete_count
 
     except Exception as e:
         logger.error(f"Janitor failed: {e}", exc_info=True)
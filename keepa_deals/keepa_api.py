@@ -9,9 +9,30 @@ import urllib.parse
 from retrying import retry
 import time
 
+from .keepa_cache import get_keepa_cache
+
 logger = logging.getLogger(__name__)
 SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'settings.json')
 
+# One pooled, keep-alive session for every Keepa call in this process, so consecutive
+# and concurrent requests reuse TCP/TLS connections instead of re-handshaking per call.
+KEEPA_HTTP_POOL_SIZE = int(os.getenv('KEEPA_HTTP_POOL_SIZE', '8'))
+
+def _create_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=KEEPA_HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    return session
+
+_session = _create_session()
+
+def _reset_session_after_fork():
+    # Prefork Celery workers must not share pooled sockets with their parent.
+    global _session
+    _session = _create_session()
+
+os.register_at_fork(after_in_child=_reset_session_after_fork)
+
 
 def validate_asin(asin):
     if not isinstance(asin, str) or len(asin) != 10 or not asin.isalnum():
@@ -27,7 +48,7 @@ def get_token_status(api_key):
     url = f"https://api.keepa.com/token?key={api_key}"
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/90.0.4430.212'}
     try:
-        response = requests.get(url, headers=headers, timeout=30)
+        response = _session.get(url, headers=headers, timeout=30)
         response.raise_for_status()
         data = response.json()
         logger.info(f"Successfully retrieved token status: {data}")
@@ -134,7 +155,7 @@ def fetch_deals_for_deals(page, api_key, use_deal_settings=False, sort_type=4, t
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/90.0.4430.212'}
     
     try:
-        response = requests.get(url, headers=headers, timeout=60)
+        response = _session.get(url, headers=headers, timeout=60)
         response.raise_for_status()
         data = response.json()
         deals = data.get('deals', {}).get('dr', [])
@@ -174,16 +195,51 @@ def fetch_deals_for_deals(page, api_key, use_deal_settings=False, sort_type=4, t
         return None, 0, None
 
 
-def fetch_product_batch(api_key, asins_list, days=365, offers=20, rating=1, history=0):
+def split_cached(asins_list, days, offers, rating=1, history=0):
+    """
+    Returns ({asin: cached_product}, [asins still to fetch]) for a product query shape.
+    To reserve tokens for a fetch, size the reservation from the second list and pass
+    the first to the fetch as `cached`, so both see the same cache state.
+    """
+    cache = get_keepa_cache()
+    if cache is None:
+        return {}, list(asins_list)
+    cached = cache.get_many(asins_list, days, offers, rating=rating, history=history)
+    return cached, [a for a in asins_list if a not in cached]
+
+def _store_and_merge(data, asins_list, cached, days, offers, rating, history):
+    """Caches freshly fetched products and merges cached ones back in request order."""
+    fetched = data.get('products') or []
+    cache = get_keepa_cache()
+    if cache is not None:
+        cache.put_many(fetched, days, offers, rating=rating, history=history)
+    if cached:
+        by_asin = {p.get('asin'): p for p in fetched if isinstance(p, dict)}
+        by_asin.update(cached)
+        data['products'] = [by_asin[a] for a in asins_list if a in by_asin]
+    return data
+
+def fetch_product_batch(api_key, asins_list, days=365, offers=20, rating=1, history=0, cached=None):
     """
     Fetches a batch of products from the Keepa API.
     Returns the response data, API info, tokens consumed, and tokens left.
     Optimized for the upserter task by default.
+    ASINs with a fresh entry in the Keepa response cache are not re-requested; if every
+    ASIN is cached no call is made and tokens left is None. `cached` is the first half of
+    an earlier split_cached() for this shape; the cache is then not consulted again.
     """
     if not asins_list:
         logger.warning("fetch_product_batch called with an empty list of ASINs.")
         return None, {'error_status_code': 'EMPTY_ASIN_LIST'}, 0, None
 
+    requested_asins = asins_list
+    if cached is None:
+        cached, asins_list = split_cached(requested_asins, days, offers, rating, history)
+    else:
+        asins_list = [a for a in requested_asins if a not in cached]
+    if not asins_list:
+        return {'products': [cached[a] for a in requested_asins]}, {'error_status_code': None}, 0, None
+
     logger.info(f"Fetching batch of {len(asins_list)} ASINs: {','.join(asins_list[:3])}...")
 
     comma_separated_asins = ','.join(asins_list)
@@ -192,7 +248,7 @@ def fetch_product_batch(api_key, asins_list, days=365, offers=20, rating=1, hist
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/90.0.4430.212'}
 
     try:
-        response = requests.get(url, headers=headers, timeout=120)
+        response = _session.get(url, headers=headers, timeout=120)
         response.raise_for_status()
         data = response.json()
         
@@ -200,6 +256,7 @@ def fetch_product_batch(api_key, asins_list, days=365, offers=20, rating=1, hist
         tokens_left = data.get('tokensLeft')
         logger.info(f"Batch API call successful. Tokens consumed: {tokens_consumed}. Tokens left: {tokens_left}")
 
+        data = _store_and_merge(data, requested_asins, cached, days, offers, rating, history)
         api_info = {'error_status_code': None}
         return data, api_info, tokens_consumed, tokens_left
 
@@ -227,16 +284,26 @@ def fetch_product_batch(api_key, asins_list, days=365, offers=20, rating=1, hist
         api_info_on_error = {'error_status_code': 'GENERIC_SCRIPT_ERROR'}
         return None, api_info_on_error, 0, None
 
-def fetch_current_stats_batch(api_key, asins_list, days=180, offers=20):
+def fetch_current_stats_batch(api_key, asins_list, days=180, offers=20, cached=None):
     """
     Fetches lightweight current stats for a batch of ASINs.
     Returns the response data, API info, tokens consumed, and tokens left.
     Used for maintaining existing deals at low cost (~1 token/ASIN).
+    Served from the Keepa response cache where possible (see fetch_product_batch,
+    also for `cached`).
     """
     if not asins_list:
         logger.warning("fetch_current_stats_batch called with empty list.")
         return None, {'error_status_code': 'EMPTY_ASIN_LIST'}, 0, None
 
+    requested_asins = asins_list
+    if cached is None:
+        cached, asins_list = split_cached(requested_asins, days, offers, 1, 0)
+    else:
+        asins_list = [a for a in requested_asins if a not in cached]
+    if not asins_list:
+        return {'products': [cached[a] for a in requested_asins]}, {'error_status_code': None}, 0, None
+
     logger.info(f"Fetching lightweight stats (days={days}, offers={offers}) for {len(asins_list)} ASINs: {','.join(asins_list[:3])}...")
 
     comma_separated_asins = ','.join(asins_list)
@@ -245,7 +312,7 @@ def fetch_current_stats_batch(api_key, asins_list, days=180, offers=20):
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/90.0.4430.212'}
 
     try:
-        response = requests.get(url, headers=headers, timeout=60)
+        response = _session.get(url, headers=headers, timeout=60)
         response.raise_for_status()
         data = response.json()
 
@@ -253,6 +320,7 @@ def fetch_current_stats_batch(api_key, asins_list, days=180, offers=20):
         tokens_left = data.get('tokensLeft')
         logger.info(f"Lightweight batch call successful. Tokens consumed: {tokens_consumed}. Tokens left: {tokens_left}")
 
+        data = _store_and_merge(data, requested_asins, cached, days, offers, 1, 0)
         api_info = {'error_status_code': None}
         return data, api_info, tokens_consumed, tokens_left
 
@@ -299,7 +367,7 @@ def fetch_seller_data(api_key, seller_ids):
     headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/90.0.4430.212'}
     
     try:
-        response = requests.get(url, headers=headers, timeout=60)
+        response = _session.get(url, headers=headers, timeout=60)
         response.raise_for_status()
         data = response.json()
         
@@ -0,0 +1,267 @@
+# keepa_deals/keepa_cache.py
+# Local SQLite caches for Keepa /product responses (per ASIN and query shape) and /seller objects.
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from .db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+KEEPA_CACHE_ENABLED = os.getenv('KEEPA_CACHE_ENABLED', '1') == '1'
+KEEPA_CACHE_PATH = os.getenv('KEEPA_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'keepa_cache.db'))
+# Upper bound on cached rows; least recently used rows are evicted first.
+KEEPA_CACHE_MAX_ENTRIES = int(os.getenv('KEEPA_CACHE_MAX_ENTRIES', '5000'))
+# TTLs (seconds) per query shape. Full history responses are expensive (~20 tokens/ASIN)
+# and change slowly; lightweight stats responses carry current prices and expire sooner.
+KEEPA_CACHE_TTL_HISTORY = int(os.getenv('KEEPA_CACHE_TTL_HISTORY', '3600'))
+KEEPA_CACHE_TTL_STATS = int(os.getenv('KEEPA_CACHE_TTL_STATS', '600'))
+
+TABLE_NAME = 'keepa_product_cache'
+
+class KeepaProductCache:
+    """
+    Caches Keepa product objects keyed by (asin, stats days, offers, rating, history).
+
+    A row fetched with history=1 is a superset of the history=0 response for the same
+    stats window, so it also satisfies later history=0 lookups (within the history=0 TTL).
+    All failures are logged and treated as misses: the cache never blocks a fetch.
+    """
+    def __init__(self, db_path=None, max_entries=None, ttl_history=None, ttl_stats=None):
+        self.db_path = db_path or KEEPA_CACHE_PATH
+        self.max_entries = KEEPA_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_history = KEEPA_CACHE_TTL_HISTORY if ttl_history is None else ttl_history
+        self.ttl_stats = KEEPA_CACHE_TTL_STATS if ttl_stats is None else ttl_stats
+        self._ensure_table()
+
+    def _ensure_table(self):
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                        asin TEXT NOT NULL,
+                        days INTEGER NOT NULL,
+                        offers INTEGER NOT NULL,
+                        rating INTEGER NOT NULL,
+                        history INTEGER NOT NULL,
+                        last_update INTEGER,
+                        fetched_at REAL NOT NULL,
+                        last_access REAL NOT NULL,
+                        payload BLOB NOT NULL,
+                        PRIMARY KEY (asin, days, offers, rating, history)
+                    )
+                """)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_last_access ON {TABLE_NAME} (last_access)")
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Could not initialise Keepa cache at '{self.db_path}': {e}")
+
+    def ttl_for(self, history):
+        return self.ttl_history if history else self.ttl_stats
+
+    def get_many(self, asins, days, offers, rating=1, history=0, now=None):
+        """
+        Returns {asin: product} for every ASIN with a fresh cached response of a
+        compatible shape. Rows of a richer shape (history=1) serve history=0 lookups.
+        """
+        if not asins:
+            return {}
+        now = now or time.time()
+        oldest = now - self.ttl_for(history)
+        placeholders = ','.join('?' for _ in asins)
+        hits = {}
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                rows = conn.execute(f"""
+                    SELECT asin, history, payload FROM {TABLE_NAME}
+                    WHERE asin IN ({placeholders}) AND days = ? AND offers = ? AND rating = ?
+                      AND history >= ? AND fetched_at >= ?
+                    ORDER BY fetched_at ASC
+                """, (*asins, days, offers, rating, history, oldest)).fetchall()
+                hit_keys = []
+                for asin, row_history, payload in rows:
+                    # Ordered oldest first, so the freshest compatible row wins.
+                    hits[asin] = json.loads(zlib.decompress(payload))
+                    hit_keys.append((now, asin, days, offers, rating, row_history))
+                if hit_keys:
+                    conn.executemany(f"""
+                        UPDATE {TABLE_NAME} SET last_access = ?
+                        WHERE asin = ? AND days = ? AND offers = ? AND rating = ? AND history = ?
+                    """, hit_keys)
+                    conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            logger.warning(f"Keepa cache lookup failed, treating as miss: {e}")
+            return {}
+        if hits:
+            logger.info(f"Keepa cache: {len(hits)}/{len(asins)} ASINs served from cache (days={days}, history={history}).")
+        return hits
+
+    def put_many(self, products, days, offers, rating=1, history=0, now=None):
+        """Stores fetched product objects and evicts rows beyond the size bound."""
+        now = now or time.time()
+        rows = [
+            (p['asin'], days, offers, rating, history, p.get('lastUpdate'), now, now,
+             zlib.compress(json.dumps(p, separators=(',', ':')).encode('utf-8')))
+            for p in products if isinstance(p, dict) and p.get('asin')
+        ]
+        if not rows:
+            return
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.executemany(f"INSERT OR REPLACE INTO {TABLE_NAME} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Keepa cache write failed: {e}")
+
+    def _evict(self, conn, now):
+        # Nothing older than the longest TTL can ever be served again.
+        conn.execute(f"DELETE FROM {TABLE_NAME} WHERE fetched_at < ?", (now - max(self.ttl_history, self.ttl_stats),))
+        overflow = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(f"""
+                DELETE FROM {TABLE_NAME} WHERE rowid IN (
+                    SELECT rowid FROM {TABLE_NAME} ORDER BY last_access ASC LIMIT ?
+                )
+            """, (overflow,))
+
+    def invalidate_updated(self, last_updates):
+        """
+        Drops cached rows older than a known Keepa `lastUpdate` (Keepa minutes),
+        e.g. for ASINs the deal feed reports as changed since they were cached.
+        """
+        if not last_updates:
+            return
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.executemany(
+                    f"DELETE FROM {TABLE_NAME} WHERE asin = ? AND (last_update IS NULL OR last_update < ?)",
+                    list(last_updates.items())
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Keepa cache invalidation failed: {e}")
+
+_cache = None
+
+def get_keepa_cache():
+    """Returns the process-wide cache, or None when KEEPA_CACHE_ENABLED is off."""
+    global _cache
+    if not KEEPA_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = KeepaProductCache()
+    return _cache
+
+def invalidate_updated(last_updates):
+    cache = get_keepa_cache()
+    if cache is not None:
+        cache.invalidate_updated(last_updates)
+
+# --- Seller Cache ---
+# Seller ratings move slowly, so seller objects are kept for a day. IDs Keepa returned
+# nothing for are remembered for a shorter time so they are not re-requested per deal.
+KEEPA_SELLER_CACHE_TTL = int(os.getenv('KEEPA_SELLER_CACHE_TTL', '86400'))
+KEEPA_SELLER_CACHE_MISS_TTL = int(os.getenv('KEEPA_SELLER_CACHE_MISS_TTL', '3600'))
+
+SELLER_TABLE_NAME = 'keepa_seller_cache'
+
+class KeepaSellerCache:
+    """
+    Caches Keepa /seller objects by seller ID. Every row carries its own expiry, so
+    found sellers and unknown IDs (cached as None) can live for different TTLs.
+    """
+    def __init__(self, db_path=None, ttl=None, miss_ttl=None):
+        self.db_path = db_path or KEEPA_CACHE_PATH
+        self.ttl = KEEPA_SELLER_CACHE_TTL if ttl is None else ttl
+        self.miss_ttl = KEEPA_SELLER_CACHE_MISS_TTL if miss_ttl is None else miss_ttl
+        self._ensure_table()
+
+    def _ensure_table(self):
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {SELLER_TABLE_NAME} (
+                        seller_id TEXT PRIMARY KEY,
+                        expires_at REAL NOT NULL,
+                        payload TEXT
+                    )
+                """)
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"Could not initialise Keepa seller cache at '{self.db_path}': {e}")
+
+    def get_many(self, seller_ids, now=None):
+        """
+        Returns {seller_id: seller_data_or_None} for unexpired rows. A None value
+        means Keepa had no data for that seller when it was last asked.
+        """
+        if not seller_ids:
+            return {}
+        now = now or time.time()
+        placeholders = ','.join('?' for _ in seller_ids)
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                rows = conn.execute(
+                    f"SELECT seller_id, payload FROM {SELLER_TABLE_NAME} WHERE seller_id IN ({placeholders}) AND expires_at > ?",
+                    (*seller_ids, now)
+                ).fetchall()
+            finally:
+                conn.close()
+            return {seller_id: (json.loads(payload) if payload else None) for seller_id, payload in rows}
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"Keepa seller cache lookup failed, treating as miss: {e}")
+            return {}
+
+    def put_many(self, sellers, requested_ids=(), now=None):
+        """
+        Stores a /seller response ({seller_id: data}). Requested IDs missing from
+        the response are stored as misses with the shorter TTL.
+        """
+        now = now or time.time()
+        rows = [(seller_id, now + self.ttl, json.dumps(data, separators=(',', ':'))) for seller_id, data in sellers.items()]
+        rows += [(seller_id, now + self.miss_ttl, None) for seller_id in requested_ids if seller_id not in sellers]
+        if not rows:
+            return
+        try:
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.executemany(f"INSERT OR REPLACE INTO {SELLER_TABLE_NAME} VALUES (?, ?, ?)", rows)
+                conn.execute(f"DELETE FROM {SELLER_TABLE_NAME} WHERE expires_at <= ?", (now,))
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Keepa seller cache write failed: {e}")
+
+_seller_cache = None
+
+def get_seller_cache():
+    """Returns the process-wide seller cache, or None when KEEPA_CACHE_ENABLED is off."""
+    global _seller_cache
+    if not KEEPA_CACHE_ENABLED:
+        return None
+    if _seller_cache is None:
+        _seller_cache = KeepaSellerCache()
+    return _seller_cache
@@ -0,0 +1,153 @@
+# keepa_deals/keepa_history.py
+# Compact, decode-once representation of Keepa `csv` histories.
+
+import logging
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Keepa epoch is minutes from 2011-01-01
+KEEPA_EPOCH = datetime(2011, 1, 1)
+
+# Indices into product['csv'] used by the analytics modules
+NEW_PRICE = 1
+USED_PRICE = 2
+SALES_RANK = 3
+NEW_OFFER_COUNT = 11
+USED_OFFER_COUNT = 12
+
+# Keepa's "no data" sentinel, used for values that are not numeric
+MISSING_VALUE = -1
+
+def datetime_to_keepa_minutes(dt):
+    """Converts a datetime to (fractional) Keepa Time Minutes."""
+    return (dt - KEEPA_EPOCH).total_seconds() / 60
+
+def keepa_minutes_to_datetime(minutes):
+    """Converts Keepa Time Minutes (scalar or array) to pandas Timestamp(s)."""
+    return pd.to_datetime(minutes, unit='m', origin=KEEPA_EPOCH)
+
+class HistorySeries:
+    """
+    One Keepa history as paired int32 arrays: `times` (Keepa minutes, ascending)
+    and `values`. Window methods return views over the same buffers, not copies.
+    """
+    __slots__ = ('times', 'values')
+
+    def __init__(self, times, values):
+        self.times = times
+        self.values = values
+
+    @classmethod
+    def from_flat(cls, flat):
+        """
+        Decodes a flat [t, v, t, v, ...] list. A trailing unpaired element is
+        ignored, rows with non-numeric timestamps are dropped, non-numeric values
+        become MISSING_VALUE, and out-of-order rows are stably sorted by time.
+        """
+        raw = np.asarray(flat[:len(flat) - (len(flat) % 2)])
+        if raw.dtype.kind not in 'iu':
+            raw = pd.to_numeric(raw, errors='coerce')
+        pairs = raw.reshape(-1, 2)
+        times, values = pairs[:, 0], pairs[:, 1]
+        if times.dtype.kind == 'f':
+            valid = ~np.isnan(times)
+            times, values = times[valid], np.nan_to_num(values[valid], nan=MISSING_VALUE)
+        times = times.astype(np.int32)
+        values = values.astype(np.int32)
+        if times.size > 1 and (np.diff(times) < 0).any():
+            order = np.argsort(times, kind='stable')
+            times, values = times[order], values[order]
+        return cls(times, values)
+
+    def __len__(self):
+        return int(self.times.size)
+
+    def since(self, minutes):
+        """Rows at or after `minutes` (Keepa minutes, may be fractional)."""
+        start = np.searchsorted(self.times, minutes, side='left')
+        return HistorySeries(self.times[start:], self.values[start:])
+
+    def since_datetime(self, dt):
+        """Rows at or after the given datetime."""
+        return self.since(datetime_to_keepa_minutes(dt))
+
+    def last_days(self, days, now=None):
+        """Rows within the last `days` days (relative to `now`, default datetime.now())."""
+        return self.since_datetime((now or datetime.now()) - timedelta(days=days))
+
+    def change_points(self):
+        """Rows where the value differs from the previous row (first row always kept)."""
+        if self.times.size < 2:
+            return self
+        keep = np.concatenate(([True], self.values[1:] != self.values[:-1]))
+        return HistorySeries(self.times[keep], self.values[keep])
+
+    def value_at(self, minutes):
+        """
+        Last known value at or before each of `minutes` (array), like
+        merge_asof(direction='backward'). Returns (values, found_mask).
+        """
+        idx = np.searchsorted(self.times, minutes, side='right') - 1
+        found = idx >= 0
+        return self.values[np.maximum(idx, 0)], found
+
+    def datetimes(self):
+        """Timestamps of every row as pandas Timestamps."""
+        return keepa_minutes_to_datetime(self.times)
+
+class KeepaHistory:
+    """
+    Decoded view of a product's `csv` histories. Each index is decoded at most
+    once, on first access, and shared by every analytics consumer of the product.
+    """
+    def __init__(self, csv_data):
+        self._csv = csv_data if isinstance(csv_data, list) else []
+        self._series = {}
+
+    @classmethod
+    def from_product(cls, product):
+        return cls(product.get('csv', []))
+
+    @property
+    def is_complete(self):
+        """True if the csv array reaches the offer-count indices (Keepa returns 13+ entries)."""
+        return len(self._csv) > USED_OFFER_COUNT
+
+    def series(self, index):
+        """
+        Returns the HistorySeries for a csv index, or None when the raw history is
+        missing or holds less than one data point.
+        """
+        if index not in self._series:
+            raw = self._csv[index] if index < len(self._csv) else None
+            decoded = None
+            if isinstance(raw, list) and len(raw) > 1:
+                try:
+                    decoded = HistorySeries.from_flat(raw)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Could not decode Keepa history at csv index {index}: {e}")
+            self._series[index] = decoded
+        return self._series[index]
+
+    @property
+    def new_price(self):
+        return self.series(NEW_PRICE)
+
+    @property
+    def used_price(self):
+        return self.series(USED_PRICE)
+
+    @property
+    def sales_rank(self):
+        return self.series(SALES_RANK)
+
+    @property
+    def new_offer_count(self):
+        return self.series(NEW_OFFER_COUNT)
+
+    @property
+    def used_offer_count(self):
+        return self.series(USED_OFFER_COUNT)
@@ -6,6 +6,7 @@ import re
 from datetime import datetime
 from worker import celery_app as celery
 from .ava_advisor import query_xai_api
+from .xai_token_manager import XAI_CLASS_HOMOGENIZATION
 
 logger = getLogger(__name__)
 
@@ -102,7 +103,7 @@ def homogenize_intelligence_task():
                 "temperature": 0.1
             }
 
-            result = query_xai_api(payload)
+            result = query_xai_api(payload, caller=XAI_CLASS_HOMOGENIZATION)
 
             if "error" in result:
                 logger.error(f"xAI Error in homogenization chunk {i}: {result['error']}")
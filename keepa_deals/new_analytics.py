@@ -3,8 +3,10 @@
 
 import logging
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-from .stable_calculations import infer_sale_events
+from .stable_calculations import get_analysis_context
+from .keepa_history import HistorySeries
 # Keepa epoch is minutes from 2011-01-01
 KEEPA_EPOCH = datetime(2011, 1, 1)
 
@@ -51,7 +53,7 @@ def get_1yr_avg_sale_price(product, logger=None):
         # However, `infer_sale_events` needs CSV.
         pass
 
-    sale_events, _ = infer_sale_events(product)
+    sale_events = get_analysis_context(product).sale_events
 
     mean_price_cents = -1
 
@@ -140,8 +142,6 @@ def get_percent_discount(avg_price, now_price, logger=None):
         logger.error(f"Error calculating discount with inputs '{avg_price}' and '{now_price}': {e}", exc_info=True)
         return None
 
-from itertools import groupby
-
 def get_trend(product, logger=None):
     """
     Indicates the price trend based on a dynamic sample of recent unique price changes.
@@ -163,16 +163,20 @@ def get_trend(product, logger=None):
         if avg_rank < 100000: sample_size = 10
         elif avg_rank < 500000: sample_size = 5
 
-    csv_data = product.get('csv', [])
-    combined_history = []
-    if csv_data and len(csv_data) > 1 and csv_data[1]: combined_history.extend(csv_data[1])
-    if csv_data and len(csv_data) > 2 and csv_data[2]: combined_history.extend(csv_data[2])
+    history = get_analysis_context(product).history
+    price_series = [s for s in (history.new_price, history.used_price) if s]
 
-    if not combined_history:
+    if not price_series:
         return {COLUMN_NAME: "⇨"}
 
-    price_points = sorted([(combined_history[i], combined_history[i+1]) for i in range(0, len(combined_history), 2) if combined_history[i+1] > 0])
-    unique_prices = [k for k, g in groupby([p[1] for p in price_points])]
+    # Merge New and Used price points in time order (ties by price), ignoring
+    # unavailable (<= 0) prices, then collapse consecutive repeats.
+    times = np.concatenate([s.times for s in price_series])
+    prices = np.concatenate([s.values for s in price_series])
+    valid = prices > 0
+    times, prices = times[valid], prices[valid]
+    order = np.lexsort((prices, times))
+    unique_prices = HistorySeries(times[order], prices[order]).change_points().values.tolist()
 
     if len(unique_prices) < 2:
         return {COLUMN_NAME: "⇨"}
@@ -8,7 +8,9 @@ import os
 
 from worker import celery_app as celery
 from .db_utils import DB_PATH
+from .data_version import publish_event
 from .ava_advisor import query_xai_api, STRATEGIES_FILE
+from .xai_token_manager import XAI_CLASS_PRIME_PICKS
 from .new_analytics import get_offer_count_trend_from_flat
 from keepa_deals.db_utils import get_db_connection
 
@@ -123,26 +125,21 @@ def generate_prime_picks():
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
 
-            sanitized_profit = "CAST(REPLACE(REPLACE(\"Profit\", '$', ''), ',', '') AS REAL)"
-            sanitized_cost = "CAST(REPLACE(REPLACE(\"All_in_Cost\", '$', ''), ',', '') AS REAL)"
-            sanitized_list_at = "CAST(REPLACE(REPLACE(\"List_at\", '$', ''), ',', '') AS REAL)"
-
+            # Numeric shadow columns (see db_utils.NUMERIC_SHADOW_COLUMNS): currency symbols
+            # stripped, placeholders NULL, and indexed.
             # Additional ROI cap at 300% added per requirements
-            roi_expr = f"(({sanitized_profit} * 1.0 / {sanitized_cost}) * 100)"
+            roi_expr = '(("Profit_num" * 1.0 / "All_in_Cost_num") * 100)'
 
             query = f"""
                 SELECT * FROM deals
-                WHERE {sanitized_profit} >= {PASS_1_MIN_PROFIT}
-                AND {sanitized_cost} > 0
+                WHERE "Profit_num" >= {PASS_1_MIN_PROFIT}
+                AND "All_in_Cost_num" > 0
                 AND {roi_expr} >= {PASS_1_MIN_ROI}
                 AND {roi_expr} <= {PASS_1_MAX_ROI}
-                AND CAST(REPLACE(\"Deal_Trust\", '%', '') AS REAL) >= {PASS_1_MIN_DEAL_TRUST}
-                AND \"List_at\" IS NOT NULL
-                AND {sanitized_list_at} > 0
-                AND {sanitized_list_at} <= {PASS_1_MAX_LIST_AT}
-                AND \"1yr_Avg\" IS NOT NULL
-                AND \"1yr_Avg\" NOT IN ('-', 'N/A', '', '0', '0.00', '$0.00')
-                AND \"1yr_Avg\" != 0
+                AND "Deal_Trust_num" >= {PASS_1_MIN_DEAL_TRUST}
+                AND "List_at_num" > 0
+                AND "List_at_num" <= {PASS_1_MAX_LIST_AT}
+                AND "1yr_Avg_num" > 0
             """
 
             deal_rows = cursor.execute(query).fetchall()
@@ -302,7 +299,7 @@ def generate_prime_picks():
         prompt_size = len(prompt)
         logger.info(f"Pass 2: Querying xAI API (prompt size: {prompt_size} chars)...")
         start_time = time.time()
-        response_data = query_xai_api(payload)
+        response_data = query_xai_api(payload, caller=XAI_CLASS_PRIME_PICKS)
         latency = time.time() - start_time
         logger.info(f"Pass 2: xAI API call took {latency:.2f} seconds.")
 
@@ -411,6 +408,7 @@ def generate_prime_picks():
                 """, records_to_insert)
                 cursor.execute("COMMIT")
                 logger.info(f"Successfully saved {len(records_to_insert)} Prime Picks to database (run_id: {run_id}).")
+                publish_event('prime_picks', {'generated_at': generated_at})
             except Exception as e:
                 cursor.execute("ROLLBACK")
                 logger.error(f"Failed to save Prime Picks to DB: {e}")
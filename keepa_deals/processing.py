@@ -6,9 +6,9 @@ from .business_calculations import (
     load_settings as business_load_settings,
 )
 from .new_analytics import get_1yr_avg_sale_price, get_percent_discount, get_trend, analyze_sales_rank_trends, get_offer_count_trend, get_offer_count_trend_180, get_offer_count_trend_365
-from .seasonality_classifier import classify_seasonality, get_sells_period
+from .seasonality_classifier import classify_seasonality, heuristic_seasonality, get_sells_period, PENDING_SEASONALITY_KEY
 from .seller_info import get_used_product_info, CONDITION_CODE_MAP
-from .stable_calculations import analyze_sales_performance, recent_inferred_sale_price, infer_sale_events, calculate_seller_quality_score, get_expected_trough_price
+from .stable_calculations import recent_inferred_sale_price, calculate_seller_quality_score, get_expected_trough_price, ProductAnalysisContext, activate_analysis_context, verify_reasonableness_batch
 from .stable_products import sales_rank_drops_last_30_days, sales_rank_drops_last_180_days, amazon_current
 from .field_mappings import FUNCTION_LIST
 import json
@@ -28,6 +28,9 @@ HEADERS_PATH = os.path.join(os.path.dirname(__file__), 'headers.json')
 # Flipping this to True is a behavioural change and must not be done casually.
 ENABLE_LIGHTWEIGHT_CEILING_CLAMP = False
 
+# Row key holding a 'List at' price check deferred to resolve_pending_reasonableness.
+PENDING_REASONABLENESS_KEY = '_pending_reasonableness'
+
 # Load headers at module level to avoid I/O in loop
 try:
     with open(HEADERS_PATH, 'r') as f:
@@ -56,7 +59,24 @@ def _parse_percent(value_str):
     try: return float(value_str.strip().replace('%', ''))
     except ValueError: return 0.0
 
-def _process_single_deal(product_data, seller_data_cache, xai_api_key):
+def _process_single_deal(product_data, seller_data_cache, xai_api_key, analysis_context=None, defer_seasonality=False,
+                         defer_reasonableness=False):
+    """
+    Builds a full deal row for one product. Sale-event inference and sales analysis
+    run once per product through a shared ProductAnalysisContext; pass a pre-built
+    `analysis_context` to reuse results computed earlier in the pipeline.
+
+    With `defer_seasonality`, a book the seasonality heuristics cannot place is left
+    "Year-round" and marked for resolve_pending_seasonality, which classifies a whole
+    batch of rows in a few XAI calls. Likewise, with `defer_reasonableness` an
+    unverified 'List at' price is kept provisionally and marked for
+    resolve_pending_reasonableness.
+    """
+    context = analysis_context or ProductAnalysisContext(product_data, defer_reasonableness=defer_reasonableness)
+    with activate_analysis_context(context):
+        return _process_single_deal_in_context(product_data, seller_data_cache, xai_api_key, context, defer_seasonality)
+
+def _process_single_deal_in_context(product_data, seller_data_cache, xai_api_key, context, defer_seasonality=False):
     asin = product_data.get('asin')
     if not asin:
         return None
@@ -140,10 +160,9 @@ def _process_single_deal(product_data, seller_data_cache, xai_api_key):
         logger.info(f"ASIN {asin}: Persisting deal with Missing List at.")
 
     business_settings = business_load_settings()
-    sale_events, _ = infer_sale_events(product_data)
 
     try:
-        sales_perf = analyze_sales_performance(product_data, sale_events)
+        sales_perf = context.analysis
         if sales_perf is None:
             logger.warning(f"ASIN {asin}: Could not analyze sales performance. Skipping.")
             return None
@@ -181,22 +200,16 @@ def _process_single_deal(product_data, seller_data_cache, xai_api_key):
                      break
 
         all_in_cost = calculate_all_in_cost(now_price, business_settings, shipping_included_flag)
-
-        # Calculate Amazon Fees manually since it was removed from All-in Cost
-        referral_fee_amount = 0.0
-        if isinstance(list_at_price, (int, float)) and list_at_price > 0:
-            referral_fee_amount = list_at_price * (referral_percent / 100.0)
-        total_amz_fees = referral_fee_amount + fba_fee
-
-        profit_margin = calculate_profit_and_margin(list_at_price, all_in_cost, total_amz_fees)
         min_listing = calculate_min_listing_price(all_in_cost, fba_fee, referral_percent, business_settings)
 
-        row_data.update({
-            'All-in Cost': all_in_cost,
-            'Total_AMZ_fees': round(total_amz_fees, 2),
-            'Profit': profit_margin['profit'], 'Margin': profit_margin['margin'],
-            'Min. Listing Price': min_listing
-        })
+        row_data.update({'All-in Cost': all_in_cost, 'Min. Listing Price': min_listing})
+        row_data.update(_profit_fields(list_at_price, all_in_cost, fba_fee, referral_percent))
+
+        # A deferred XAI price check: resolve_pending_reasonableness needs the costs to
+        # recompute the profit if the price is rejected
+        reasonableness_check = row_data.pop('reasonableness_check', None)
+        if reasonableness_check:
+            row_data[PENDING_REASONABLENESS_KEY] = {'check': reasonableness_check, 'all_in_cost': all_in_cost, 'fba_fee': fba_fee}
 
         # Exclusion: Profit must be positive - REMOVED (Allow zero/negative profit for DB storage)
         # if row_data.get('Profit') is not None and row_data.get('Profit') <= 0:
@@ -259,11 +272,17 @@ def _process_single_deal(product_data, seller_data_cache, xai_api_key):
         peak_season_str = row_data.get('Peak Sales Month', '-')
         trough_season_str = row_data.get('Trough Sales Month', '-')
 
-        detailed_season = classify_seasonality(
-            title, categories, manufacturer,
-            peak_season_str, trough_season_str,
-            xai_api_key=xai_api_key
-        )
+        if defer_seasonality:
+            detailed_season = heuristic_seasonality(title, categories, manufacturer)
+            if detailed_season is None:
+                row_data[PENDING_SEASONALITY_KEY] = (title, categories, manufacturer, peak_season_str, trough_season_str)
+                detailed_season = "Year-round"
+        else:
+            detailed_season = classify_seasonality(
+                title, categories, manufacturer,
+                peak_season_str, trough_season_str,
+                xai_api_key=xai_api_key
+            )
 
         row_data['Detailed_Seasonality'] = detailed_season # Keep "Year-round" instead of "None"
         row_data['Sells'] = get_sells_period(detailed_season)
@@ -305,6 +324,41 @@ def _process_single_deal(product_data, seller_data_cache, xai_api_key):
 
     return row_data
 
+def _profit_fields(list_at_price, all_in_cost, fba_fee, referral_percent):
+    """Amazon fees, Profit and Margin of a new deal row for a given 'List at' price."""
+    # Calculate Amazon Fees manually since it was removed from All-in Cost
+    referral_fee_amount = 0.0
+    if isinstance(list_at_price, (int, float)) and list_at_price > 0:
+        referral_fee_amount = list_at_price * (referral_percent / 100.0)
+    total_amz_fees = referral_fee_amount + fba_fee
+
+    profit_margin = calculate_profit_and_margin(list_at_price, all_in_cost, total_amz_fees)
+    return {
+        'Total_AMZ_fees': round(total_amz_fees, 2),
+        'Profit': profit_margin['profit'], 'Margin': profit_margin['margin'],
+    }
+
+def resolve_pending_reasonableness(rows, xai_api_key):
+    """
+    Verifies the provisional 'List at' prices of the rows built with
+    `defer_reasonableness`, in batched XAI calls. A rejected price is cleared and the
+    row's fees, Profit and Margin recomputed, as if the check had run inline.
+    """
+    pending_rows, checks = [], []
+    for row in rows:
+        pending = row.pop(PENDING_REASONABLENESS_KEY, None) if row else None
+        if pending:
+            pending_rows.append((row, pending))
+            checks.append(pending['check'])
+    if not checks:
+        return
+    for (row, pending), is_reasonable in zip(pending_rows, verify_reasonableness_batch(checks, xai_api_key)):
+        if is_reasonable:
+            continue
+        logger.warning(f"ASIN {row.get('ASIN')}: XAI check FAILED. Price ${pending['check']['price_usd']:.2f} was deemed unreasonable for '{pending['check']['title']}'. Invalidating price.")
+        row['List at'] = None
+        row.update(_profit_fields(0.0, pending['all_in_cost'], pending['fba_fee'], 0.0))
+
 def clean_numeric_values(row_data):
     """
     Cleans and converts numeric string values in the row data to actual numbers.
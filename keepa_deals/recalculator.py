@@ -13,9 +13,11 @@ from .business_calculations import (
     calculate_profit_and_margin,
     calculate_min_listing_price,
 )
-from .seasonality_classifier import classify_seasonality, get_sells_period
+from .seasonality_classifier import heuristic_seasonality, get_sells_period, resolve_pending_seasonality, PENDING_SEASONALITY_KEY
 from .processing import clean_numeric_values
-from .db_utils import sanitize_col_name
+from .db_utils import sanitize_col_name, numeric_shadows
+from .data_version import bump_data_version, publish_event
+from .write_queue import run_write
 from keepa_deals.db_utils import get_db_connection
 
 logger = logging.getLogger(__name__)
@@ -49,13 +51,14 @@ def _parse_stored_price(raw):
 
 
 def set_recalc_status(status_data):
-    """Helper to write to the recalculation status file."""
+    """Helper to write to the recalculation status file (and push it to open dashboards)."""
     RECALC_STATUS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'recalc_status.json')
     try:
         with open(RECALC_STATUS_FILE, 'w') as f:
             json.dump(status_data, f, indent=4)
     except IOError as e:
         logger.error(f"Error writing recalc status file: {e}")
+    publish_event('recalc', status_data)
 
 @celery_app.task(name='keepa_deals.recalculator.recalculate_deals')
 def recalculate_deals():
@@ -188,14 +191,13 @@ def recalculate_deals():
             try:
                 peak_s = deal_data.get('Peak_Season', '-')
                 trough_s = deal_data.get('Trough_Season', '-')
-                detailed_season = classify_seasonality(
-                    deal_data.get('Title', ''),
-                    deal_data.get('Categories_Sub', ''),
-                    deal_data.get('Manufacturer', ''),
-                    peak_s,
-                    trough_s,
-                    xai_api_key=XAI_API_KEY
-                )
+                seasonality_args = (deal_data.get('Title', ''), deal_data.get('Categories_Sub', ''),
+                                    deal_data.get('Manufacturer', ''), peak_s, trough_s)
+                detailed_season = heuristic_seasonality(*seasonality_args[:3])
+                if detailed_season is None:
+                    # Classified with the rest in batched XAI calls once the loop is done
+                    row_updates[PENDING_SEASONALITY_KEY] = seasonality_args
+                    detailed_season = "Year-round"
                 sells_period = get_sells_period(detailed_season)
                 row_updates['Detailed_Seasonality'] = detailed_season # Keep "Year-round" instead of "None"
                 row_updates['Sells'] = sells_period
@@ -210,33 +212,41 @@ def recalculate_deals():
                     "total_deals": total_deals, "processed_deals": i + 1
                 })
 
-        conn = get_db_connection(DB_PATH)
-        cursor = conn.cursor()
+        set_recalc_status({
+            "status": "Running", "message": f"Classifying seasonality for {total_deals} deals.",
+            "total_deals": total_deals, "processed_deals": total_deals
+        })
+        resolve_pending_seasonality(all_rows_to_update, XAI_API_KEY)
 
-        update_count = 0
         NULL_ALLOWED_COLS = {'Profit', 'Margin', 'Total_AMZ_fees'}
-        for row in all_rows_to_update:
-            try:
-                update_dict = {
-                    k: v for k, v in row.items()
-                    if (v is not None or k in NULL_ALLOWED_COLS) and k != 'ASIN'
-                }
-                if not update_dict: continue
 
-                sanitized_update_dict = {sanitize_col_name(k): v for k, v in update_dict.items()}
-                set_clauses = ', '.join([f'"{col}" = :{col}' for col in sanitized_update_dict.keys()])
-
-                # The primary key for the WHERE clause also needs to be in the dictionary
-                sanitized_update_dict['ASIN_WHERE'] = row['ASIN']
-                logger.debug(f"Updating ASIN {row['ASIN']} with: {sanitized_update_dict}")
-
-                cursor.execute(f'UPDATE deals SET {set_clauses} WHERE ASIN = :ASIN_WHERE', sanitized_update_dict)
-                update_count += 1
-            except sqlite3.Error as e:
-                logger.error(f"Recalculation: Failed to update DB for ASIN {row.get('ASIN', 'UNKNOWN')}. Error: {e}", exc_info=True)
-
-        conn.commit()
-        conn.close()
+        def write_updates(conn):
+            cursor = conn.cursor()
+            update_count = 0
+            for row in all_rows_to_update:
+                try:
+                    update_dict = {
+                        k: v for k, v in row.items()
+                        if (v is not None or k in NULL_ALLOWED_COLS) and k != 'ASIN'
+                    }
+                    if not update_dict: continue
+
+                    sanitized_update_dict = {sanitize_col_name(k): v for k, v in update_dict.items()}
+                    sanitized_update_dict.update(numeric_shadows(sanitized_update_dict))
+                    set_clauses = ', '.join([f'"{col}" = :{col}' for col in sanitized_update_dict.keys()])
+
+                    # The primary key for the WHERE clause also needs to be in the dictionary
+                    sanitized_update_dict['ASIN_WHERE'] = row['ASIN']
+                    logger.debug(f"Updating ASIN {row['ASIN']} with: {sanitized_update_dict}")
+
+                    cursor.execute(f'UPDATE deals SET {set_clauses} WHERE ASIN = :ASIN_WHERE', sanitized_update_dict)
+                    update_count += 1
+                except sqlite3.Error as e:
+                    logger.error(f"Recalculation: Failed to update DB for ASIN {row.get('ASIN', 'UNKNOWN')}. Error: {e}", exc_info=True)
+            return update_count
+
+        update_count = run_write(write_updates, DB_PATH)
+        bump_data_version('recalculator', count=update_count)
 
         task_duration = time.time() - task_start_time
         logger.info(f"Recalculation finished in {task_duration:.2f}s. Updated {update_count} rows.")
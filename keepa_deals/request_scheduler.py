@@ -0,0 +1,112 @@
+# keepa_deals/request_scheduler.py
+# Token-cost-aware sizing of Keepa product requests.
+
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# --- Request Shapes ---
+STALE_RESCUE = 'stale_rescue'  # stats=180, history=0
+PEEK = 'peek'                  # stats=365, history=0
+COMMIT = 'commit'              # stats=365, history=1
+LIGHT_UPDATE = 'light_update'  # stats=180, history=0
+
+# Cold-start token cost per ASIN for each shape (the former fixed multipliers).
+# Replaced by learned values as soon as Keepa reports tokensConsumed for that shape.
+DEFAULT_COST_PER_ASIN = {
+    STALE_RESCUE: 3.0,
+    PEEK: 2.0,
+    COMMIT: 20.0,
+    LIGHT_UPDATE: 5.0,
+}
+
+# Weight of the newest observation in the moving average of cost per ASIN.
+COST_EWMA_ALPHA = 0.3
+
+class TokenCostModel:
+    """
+    Learns the actual Keepa token cost per ASIN of each request shape from the
+    `tokensConsumed` of past responses (exponentially weighted moving average).
+    Learned costs are shared across workers and runs through Redis when available.
+    """
+    REDIS_KEY = "keepa_cost_per_asin"
+
+    def __init__(self, redis_client=None):
+        self.redis_client = redis_client
+        self.costs = dict(DEFAULT_COST_PER_ASIN)
+        self._load()
+
+    def _load(self):
+        if not self.redis_client:
+            return
+        try:
+            for shape, value in (self.redis_client.hgetall(self.REDIS_KEY) or {}).items():
+                if shape in self.costs:
+                    self.costs[shape] = float(value)
+        except Exception as e:
+            logger.warning(f"Could not load learned Keepa costs from Redis: {e}")
+
+    def cost_per_asin(self, shape):
+        return self.costs[shape]
+
+    def estimate(self, shape, asin_count):
+        """Expected tokens for a request of `asin_count` uncached ASINs."""
+        return math.ceil(self.costs[shape] * asin_count)
+
+    def observe(self, shape, asin_count, tokens_consumed):
+        """
+        Folds one response into the model. Responses that fetched nothing or report
+        no consumption (cache hits, errors) carry no information and are ignored.
+        """
+        if not asin_count or not tokens_consumed or tokens_consumed <= 0:
+            return
+        sample = tokens_consumed / asin_count
+        self.costs[shape] = (1 - COST_EWMA_ALPHA) * self.costs[shape] + COST_EWMA_ALPHA * sample
+        logger.debug(f"Keepa cost model: {shape} observed {sample:.2f}/ASIN, now {self.costs[shape]:.2f}/ASIN.")
+        if self.redis_client:
+            try:
+                self.redis_client.hset(self.REDIS_KEY, shape, str(self.costs[shape]))
+            except Exception as e:
+                logger.warning(f"Could not persist learned Keepa cost for {shape}: {e}")
+
+class RequestScheduler:
+    """
+    Sizes Keepa batches so each one fits the live token projection.
+
+    The budget is the projected token balance, but never less than the
+    TokenManager's burst threshold: below that, request_permission_for_call waits
+    for a recharge to the threshold anyway, so a batch sized for the current
+    (low) balance would only waste the refill window.
+    """
+    def __init__(self, token_manager, cost_model=None):
+        self.token_manager = token_manager
+        self.cost_model = cost_model or TokenCostModel(getattr(token_manager, 'redis_client', None))
+
+    def budget(self):
+        return max(self.token_manager.get_projected_tokens(), self.token_manager.BURST_THRESHOLD)
+
+    def batch_size(self, shape, pending, max_size):
+        """Largest batch (1..max_size, at most `pending`) whose estimated cost fits the budget."""
+        if pending <= 0:
+            return 0
+        fits = int(self.budget() // self.cost_model.cost_per_asin(shape))
+        return max(1, min(fits, max_size, pending))
+
+    def scan_batch_size(self, deals, existing_asins, max_size):
+        """
+        Size of the next scan chunk: new ASINs cost a peek, existing ones a light
+        update, weighted by their share of the upcoming deals. Commits are sized
+        separately against the balance left after the peek.
+        """
+        if not deals:
+            return 0
+        window = deals[:max_size]
+        new_share = sum(1 for d in window if d['asin'] not in existing_asins) / len(window)
+        per_asin = (new_share * self.cost_model.cost_per_asin(PEEK)
+                    + (1 - new_share) * self.cost_model.cost_per_asin(LIGHT_UPDATE))
+        fits = int(self.budget() // per_asin)
+        return max(1, min(fits, max_size, len(deals)))
+
+    def observe(self, shape, asin_count, tokens_consumed):
+        self.cost_model.observe(shape, asin_count, tokens_consumed)
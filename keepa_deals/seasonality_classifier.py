@@ -1,17 +1,18 @@
 # Restore Dashboard Functionality
 import re
+import os
 import httpx
 import json
 import logging
-from .xai_token_manager import XaiTokenManager
-from .xai_cache import XaiCache
+from .xai_token_manager import get_xai_token_manager, XAI_CLASS_SEASONALITY
+from .xai_cache import get_xai_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 # Initialize cache and token manager at the module level to act as singletons
-xai_cache = XaiCache()
-xai_token_manager = XaiTokenManager()
+xai_cache = get_xai_cache()
+xai_token_manager = get_xai_token_manager()
 
 SEASON_CLASSIFICATIONS = [
     "Textbook (Summer)", "Textbook (Winter)", "High School AP Textbooks",
@@ -21,6 +22,17 @@ SEASON_CLASSIFICATIONS = [
     "Year-round"
 ]
 
+# Books classified per xAI call by classify_seasonality_batch.
+SEASONALITY_BATCH_SIZE = int(os.getenv('SEASONALITY_BATCH_SIZE', '25'))
+# Row key holding the inputs of an LLM classification deferred to resolve_pending_seasonality.
+PENDING_SEASONALITY_KEY = '_pending_seasonality'
+
+def _seasonality_cache_key(title, categories_sub, manufacturer):
+    return f"seasonality:{title}|{categories_sub}|{manufacturer}"
+
+def _month_or_na(month_str):
+    return month_str if month_str and month_str != '-' else 'N/A'
+
 def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_str, trough_season_str, api_key):
     """
     Queries the XAI API to classify seasonality, now with caching and token management.
@@ -30,7 +42,7 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
         return "Year-round"
 
     # 1. Create a unique cache key
-    cache_key = f"seasonality:{title}|{categories_sub}|{manufacturer}"
+    cache_key = _seasonality_cache_key(title, categories_sub, manufacturer)
 
     # 2. Check cache first
     cached_result = xai_cache.get(cache_key)
@@ -38,12 +50,7 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
         logger.info(f"XAI Cache HIT for seasonality. Found classification '{cached_result}' for title '{title}'.")
         return cached_result
 
-    # 3. If not in cache, check for permission to make a call
-    if not xai_token_manager.request_permission():
-        logger.warning(f"XAI daily limit reached. Cannot classify '{title}'. Defaulting to Year-round.")
-        return "Year-round"
-
-    # 4. If permission granted, proceed with the API call
+    # 3. If not in cache, build the API call (made below only if the governor permits it)
     prompt = f"""
     Based on the following book details and historical sales data, choose the single most likely sales season from the provided list.
     Respond with ONLY the name of the season from the list.
@@ -54,8 +61,8 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
     - **Publisher:** "{manufacturer}"
 
     **Sales Data Insights:**
-    - **Inferred Peak Price Month:** "{peak_season_str if peak_season_str and peak_season_str != '-' else 'N/A'}"
-    - **Inferred Trough Price Month:** "{trough_season_str if trough_season_str and trough_season_str != '-' else 'N/A'}"
+    - **Inferred Peak Price Month:** "{_month_or_na(peak_season_str)}"
+    - **Inferred Trough Price Month:** "{_month_or_na(trough_season_str)}"
 
     **Season List:**
     {', '.join(SEASON_CLASSIFICATIONS)}
@@ -80,7 +87,10 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
     }
 
     try:
-        with httpx.Client(timeout=30.0) as client:
+        with xai_token_manager.call_slot(XAI_CLASS_SEASONALITY) as permitted, httpx.Client(timeout=30.0) as client:
+            if not permitted:
+                logger.warning(f"XAI call limit reached. Cannot classify '{title}'. Defaulting to Year-round.")
+                return "Year-round"
             response = client.post("https://api.x.ai/v1/chat/completions", headers=headers, json=payload)
             response.raise_for_status() # This will now handle 429 errors as failures
             data = response.json()
@@ -88,7 +98,7 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
 
             if llm_choice in SEASON_CLASSIFICATIONS:
                 logger.info(f"LLM classified '{title}' as: {llm_choice}")
-                xai_cache.set(cache_key, llm_choice) # 5. Cache the successful result
+                xai_cache.set(cache_key, llm_choice) # 4. Cache the successful result
                 return llm_choice
             else:
                 logger.warning(f"LLM returned an invalid classification: '{llm_choice}'. Defaulting to Year-round.")
@@ -100,6 +110,87 @@ def _query_xai_for_seasonality(title, categories_sub, manufacturer, peak_season_
         return "Year-round"
 
 
+def _query_xai_for_seasonality_batch(items, api_key):
+    """
+    Classifies several books in one XAI call. `items` are (title, categories_sub,
+    manufacturer, peak_season_str, trough_season_str) tuples.
+
+    Returns a dict of item index -> season for the items the response covered (valid
+    classifications are cached), or None if the call failed, was not permitted or
+    its response was not a JSON array.
+    """
+    books = [
+        {"id": i, "title": title, "category": categories_sub, "publisher": manufacturer,
+         "peak_price_month": _month_or_na(peak), "trough_price_month": _month_or_na(trough)}
+        for i, (title, categories_sub, manufacturer, peak, trough) in enumerate(items)
+    ]
+    prompt = f"""
+    For each of the following books, choose the single most likely sales season from the provided list,
+    based on the book details and the inferred peak and trough price months.
+
+    **Season List:**
+    {', '.join(SEASON_CLASSIFICATIONS)}
+
+    **Books:**
+    {json.dumps(books)}
+
+    Respond with ONLY a JSON array containing one object per book: {{"id": <book id>, "season": "<season from the list>"}}.
+    """
+
+    logger.info(f"XAI Seasonality Batch Request for {len(items)} books (Cache MISS).")
+
+    payload = {
+        "messages": [
+            {"role": "system", "content": "You are a book classification expert. Your task is to select the most appropriate seasonal category for each book from a given list."},
+            {"role": "user", "content": prompt}
+        ],
+        "model": "grok-4-fast-reasoning",
+        "temperature": 0.1,
+        "max_tokens": 50 + 30 * len(items)
+    }
+
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+    try:
+        with xai_token_manager.call_slot(XAI_CLASS_SEASONALITY) as permitted, httpx.Client(timeout=60.0) as client:
+            if not permitted:
+                logger.warning(f"XAI call limit reached. Cannot classify {len(items)} books. Defaulting to Year-round.")
+                return None
+            response = client.post("https://api.x.ai/v1/chat/completions", headers=headers, json=payload)
+            response.raise_for_status()
+            content = response.json()['choices'][0]['message']['content'].strip()
+    except (httpx.HTTPStatusError, httpx.RequestError, json.JSONDecodeError, KeyError, IndexError) as e:
+        logger.error(f"XAI batch seasonality request for {len(items)} books failed: {e}")
+        return None
+
+    try:
+        answers = json.loads(re.sub(r'^```json\s*|\s*```$', '', content, flags=re.MULTILINE))
+    except json.JSONDecodeError:
+        answers = None
+    if not isinstance(answers, list):
+        # Unusable as a whole: a failed call, not books left out of the response
+        logger.warning(f"XAI batch seasonality response is not a JSON array: {content[:200]}")
+        return None
+
+    seasons = {}
+    for answer in answers:
+        i = answer.get('id') if isinstance(answer, dict) else None
+        if not isinstance(i, int) or not 0 <= i < len(items):
+            continue
+        season = str(answer.get('season', '')).strip()
+        if season in SEASON_CLASSIFICATIONS:
+            xai_cache.set(_seasonality_cache_key(*items[i][:3]), season)
+            seasons[i] = season
+        else:
+            logger.warning(f"LLM returned an invalid classification for '{items[i][0]}': '{season}'. Defaulting to Year-round.")
+            seasons[i] = "Year-round"
+    logger.info(f"LLM classified {len(seasons)} of {len(items)} books in one batch.")
+    return seasons
+
+
 def classify_seasonality(title, categories_sub, manufacturer, peak_season_str, trough_season_str, xai_api_key=None):
     """
     Classifies a book's seasonality based on heuristics and an XAI model,
@@ -120,9 +211,30 @@ def classify_seasonality(title, categories_sub, manufacturer, peak_season_str, t
     if not categories_sub: categories_sub = ""
     if not manufacturer: manufacturer = ""
 
-    title_lower = title.lower()
-    cat_lower = categories_sub.lower()
-    mfr_lower = manufacturer.lower()
+    heuristic_season = heuristic_seasonality(title, categories_sub, manufacturer)
+    if heuristic_season:
+        return heuristic_season
+
+    # --- Fallback to LLM with enriched data ---
+    # Heuristics resulted in "Year-round", so we query the AI with the date data for a more refined answer.
+    logger.info(f"Heuristics resulted in 'Year-round' for '{title}'. Querying XAI with sales data for refinement.")
+
+    llm_result = _query_xai_for_seasonality(
+        title, categories_sub, manufacturer, peak_season_str, trough_season_str, xai_api_key
+    )
+
+    # The AI's response is now the final answer for this logic path.
+    return llm_result
+
+
+def heuristic_seasonality(title, categories_sub, manufacturer):
+    """
+    The keyword heuristics of classify_seasonality. Returns the season, or None when
+    they fall through to "Year-round" and the LLM should decide.
+    """
+    title_lower = (title or "").lower()
+    cat_lower = (categories_sub or "").lower()
+    mfr_lower = (manufacturer or "").lower()
 
     # --- Textbook Classifications ---
     textbook_publishers = ['cengage', 'mcgraw-hill', 'pearson', 'wiley', 'macmillan', 'sage']
@@ -168,16 +280,79 @@ def classify_seasonality(title, categories_sub, manufacturer, peak_season_str, t
     if "valentine" in title_lower or "romance" in cat_lower:
         return "Romance/Valentine's Day"
 
-    # --- Fallback to LLM with enriched data ---
-    # Heuristics resulted in "Year-round", so we query the AI with the date data for a more refined answer.
-    logger.info(f"Heuristics resulted in 'Year-round' for '{title}'. Querying XAI with sales data for refinement.")
+    return None
 
-    llm_result = _query_xai_for_seasonality(
-        title, categories_sub, manufacturer, peak_season_str, trough_season_str, xai_api_key
-    )
 
-    # The AI's response is now the final answer for this logic path.
-    return llm_result
+def classify_seasonality_batch(items, xai_api_key=None):
+    """
+    Classifies many books like classify_seasonality, but the ones the heuristics cannot
+    place are sent to the XAI model SEASONALITY_BATCH_SIZE at a time.
+
+    Args:
+        items (list): (title, categories_sub, manufacturer, peak_season_str,
+            trough_season_str) tuples.
+        xai_api_key (str, optional): The API key for the XAI service.
+
+    Returns:
+        list: The classified season of each item, in input order.
+    """
+    seasons = [None] * len(items)
+    pending = {}  # cache key -> (item, positions); books sharing a key are asked about once
+    for position, (title, categories_sub, manufacturer, peak, trough) in enumerate(items):
+        item = (title or "", categories_sub or "", manufacturer or "", peak, trough)
+        season = heuristic_seasonality(*item[:3])
+        if season:
+            seasons[position] = season
+            continue
+        cache_key = _seasonality_cache_key(*item[:3])
+        pending.setdefault(cache_key, (item, []))[1].append(position)
+
+    if pending and not xai_api_key:
+        logger.warning("XAI API key is not provided. Skipping LLM classification.")
+        pending = {}
+    for cache_key in list(pending):
+        cached_result = xai_cache.get(cache_key)
+        if cached_result:
+            for position in pending.pop(cache_key)[1]:
+                seasons[position] = cached_result
+
+    entries = list(pending.values())
+    if entries:
+        logger.info(f"Heuristics resulted in 'Year-round' for {len(entries)} uncached books. Querying XAI in batches of {SEASONALITY_BATCH_SIZE}.")
+    for start in range(0, len(entries), SEASONALITY_BATCH_SIZE):
+        chunk = entries[start:start + SEASONALITY_BATCH_SIZE]
+        answers = _query_xai_for_seasonality_batch([item for item, _ in chunk], xai_api_key)
+        for i, (item, positions) in enumerate(chunk):
+            if answers is None:
+                season = "Year-round"
+            elif i in answers:
+                season = answers[i]
+            else:
+                # Left out of an otherwise usable response: ask about it on its own
+                season = _query_xai_for_seasonality(*item, xai_api_key)
+            for position in positions:
+                seasons[position] = season
+
+    return [season or "Year-round" for season in seasons]
+
+
+def resolve_pending_seasonality(rows, xai_api_key=None):
+    """
+    Classifies the rows whose LLM seasonality classification was deferred (their
+    PENDING_SEASONALITY_KEY holds the classify_seasonality arguments) in batches, and
+    sets their 'Detailed_Seasonality' and 'Sells'. Other rows are left as they are.
+    """
+    pending_rows, items = [], []
+    for row in rows:
+        item = row.pop(PENDING_SEASONALITY_KEY, None) if row else None
+        if item:
+            pending_rows.append(row)
+            items.append(item)
+    if not items:
+        return
+    for row, season in zip(pending_rows, classify_seasonality_batch(items, xai_api_key)):
+        row['Detailed_Seasonality'] = season
+        row['Sells'] = get_sells_period(season)
 
 
 def get_sells_period(detailed_season):
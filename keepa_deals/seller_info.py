@@ -2,6 +2,7 @@ import logging
 from keepa_deals.keepa_api import fetch_seller_data
 from keepa_deals.token_manager import TokenManager
 from keepa_deals.business_calculations import load_settings
+from keepa_deals.keepa_cache import get_seller_cache
 from datetime import datetime
 
 # Set up logging
@@ -25,6 +26,56 @@ CONDITION_CODE_MAP = {
     11: 'New, other'
 }
 
+def fetch_sellers_cached(seller_ids, api_key, token_manager: TokenManager):
+    """
+    Returns {seller_id: seller_data} for the given IDs. Sellers in the seller cache
+    are served locally; the rest are fetched in batches of up to 100 IDs per call.
+    IDs Keepa has no data for are omitted.
+    """
+    seller_ids = list(dict.fromkeys(sid for sid in seller_ids if sid))
+    cache = get_seller_cache()
+    cached = cache.get_many(seller_ids) if cache else {}
+    sellers = {sid: data for sid, data in cached.items() if data}
+    missing = [sid for sid in seller_ids if sid not in cached]
+    if cached:
+        logger.info(f"Seller cache: {len(cached)}/{len(seller_ids)} sellers served from cache.")
+
+    for i in range(0, len(missing), 100):
+        batch_ids = missing[i:i + 100]
+        # Estimate cost (1 token per seller) and wait for tokens
+        token_manager.request_permission_for_call(len(batch_ids))
+        seller_data, _, _, tokens_left = fetch_seller_data(api_key, batch_ids)
+        if tokens_left is not None:
+            token_manager.update_after_call(tokens_left)
+
+        if seller_data and seller_data.get('sellers') is not None:
+            sellers.update(seller_data['sellers'])
+            if cache:
+                cache.put_many(seller_data['sellers'], requested_ids=batch_ids)
+        else:
+            logger.warning(f"Failed to fetch data for {len(batch_ids)} sellers.")
+    return sellers
+
+def prefetch_seller_info(products, api_key, token_manager: TokenManager):
+    """
+    Batch counterpart of get_seller_info_for_single_deal: resolves the lowest-priced
+    seller of every product and fetches them together.
+    Returns {asin: seller_data_cache} in the same shape the single-deal call returns.
+    """
+    seller_by_asin = {}
+    for product in products:
+        _, seller_id, _, _ = get_used_product_info(product)
+        if seller_id:
+            seller_by_asin[product.get('asin')] = seller_id
+        else:
+            logger.warning(f"ASIN {product.get('asin')}: Could not determine the lowest-priced used seller.")
+
+    sellers = fetch_sellers_cached(seller_by_asin.values(), api_key, token_manager) if seller_by_asin else {}
+    return {
+        asin: ({seller_id: sellers[seller_id]} if seller_id in sellers else {})
+        for asin, seller_id in seller_by_asin.items()
+    }
+
 def get_seller_info_for_single_deal(product, api_key, token_manager: TokenManager):
     """
     Finds the lowest-priced used offer for a single product, fetches data
@@ -40,16 +91,9 @@ def get_seller_info_for_single_deal(product, api_key, token_manager: TokenManage
 
     logger.info(f"ASIN {product.get('asin')}: Found lowest-priced seller: {seller_id}. Fetching their data.")
 
-    # Estimate cost and wait for tokens
-    estimated_cost = 1
-    token_manager.request_permission_for_call(estimated_cost)
-
-    # Fetch seller data from Keepa
-    seller_data, _, _, tokens_left = fetch_seller_data(api_key, [seller_id])
-    token_manager.update_after_call(tokens_left)
-
-    if seller_data and seller_data.get('sellers'):
-        return seller_data['sellers']
+    sellers = fetch_sellers_cached([seller_id], api_key, token_manager)
+    if seller_id in sellers:
+        return {seller_id: sellers[seller_id]}
     else:
         logger.warning(f"ASIN {product.get('asin')}: Failed to fetch data for seller {seller_id}.")
         return {}
@@ -3,16 +3,26 @@ import os
 import json
 import sqlite3
 import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 import redis
 
 from worker import celery_app as celery
-from .db_utils import create_deals_table_if_not_exists, sanitize_col_name, load_watermark, save_watermark, DB_PATH
-from .keepa_api import fetch_deals_for_deals, fetch_product_batch, validate_asin, fetch_current_stats_batch
-from .token_manager import TokenManager, TokenRechargeError
+from .db_utils import create_deals_table_if_not_exists, sanitize_col_name, load_watermark, save_watermark, with_numeric_shadows, DB_PATH
+from .keepa_api import fetch_deals_for_deals, fetch_product_batch, validate_asin, fetch_current_stats_batch, split_cached
+from .keepa_cache import invalidate_updated
+from .data_version import bump_data_version
+from .write_queue import run_write
+from .request_scheduler import RequestScheduler, STALE_RESCUE, PEEK, COMMIT, LIGHT_UPDATE
+from .token_manager import (
+    TokenManager, TokenRechargeError,
+    PRIORITY_STALE_RESCUE, PRIORITY_LIGHT_UPDATE, PRIORITY_COMMIT, PRIORITY_PEEK,
+)
 from .field_mappings import FUNCTION_LIST
-from .seller_info import get_seller_info_for_single_deal
+from .seller_info import prefetch_seller_info
 from .business_calculations import (
     load_settings as business_load_settings,
     calculate_all_in_cost,
@@ -20,8 +30,8 @@ from .business_calculations import (
     calculate_min_listing_price,
 )
 from .new_analytics import get_1yr_avg_sale_price, get_percent_discount, get_trend
-from .seasonality_classifier import classify_seasonality, get_sells_period
-from .processing import _process_single_deal, clean_numeric_values, _process_lightweight_update
+from .seasonality_classifier import classify_seasonality, get_sells_period, resolve_pending_seasonality
+from .processing import _process_single_deal, clean_numeric_values, _process_lightweight_update, resolve_pending_reasonableness
 from keepa_deals.db_utils import get_db_connection
 
 # Configure logging
@@ -38,12 +48,22 @@ SMART_INGESTOR_VERSION = "3.0-Consolidated"
 TABLE_NAME = 'deals'
 HEADERS_PATH = os.path.join(os.path.dirname(__file__), 'headers.json')
 MAX_ASINS_PER_BATCH = 5 # Legacy constant, preserved for safety
-SCAN_BATCH_SIZE = 50 # Optimized for Peek/Light Update
-COMMIT_BATCH_SIZE = 5 # Safety limit for expensive commits
+# Upper bounds only: actual batch sizes come from RequestScheduler, which fits each
+# batch to the live token projection using learned per-ASIN costs.
+SCAN_BATCH_SIZE = 50 # Max ASINs per Peek/Light Update chunk
+COMMIT_BATCH_SIZE = 10 # Max ASINs per heavy (history=1) commit fetch
 LOCK_KEY = "smart_ingestor_lock"
 LOCK_TIMEOUT = 60 * 30  # 30 minutes
 MAX_PAGES_PER_RUN = 50 # Safety limit
 MAX_NEW_DEALS_PER_RUN = 200 # Safety limit
+# Opt-in parallel commit stage: number of worker processes for the CPU-bound
+# per-product analysis. 0 or 1 keeps the original sequential behaviour. Needs a worker
+# whose task processes may have children (not the default prefork pool, whose
+# children are daemonic); otherwise the stage runs sequentially.
+COMMIT_POOL_WORKERS = int(os.getenv('SMART_INGESTOR_COMMIT_WORKERS', '0'))
+# Max Keepa requests in flight per chunk (the light-update fetch overlaps with the
+# peek/commit of new ASINs). 1 keeps every request sequential.
+KEEPA_CONCURRENT_REQUESTS = int(os.getenv('KEEPA_CONCURRENT_REQUESTS', '2'))
 
 def _convert_keepa_time_to_iso(keepa_minutes):
     """Converts Keepa time (minutes since 2011-01-01) to ISO 8601 UTC string."""
@@ -75,13 +95,12 @@ def save_safe_watermark(iso_timestamp):
 
     save_watermark(iso_timestamp)
 
-def check_peek_viability(stats):
+def _peek_prices(stats):
     """
-    Heuristic check to see if a deal is worth a heavy fetch (20 tokens).
-    Returns True if potentially profitable, False if obviously bad.
+    Returns (buy_price, sell_candidates) from lightweight Peek stats: the current
+    Used (or New) price and every Used average from avg90/avg365. buy_price is -1
+    when the item cannot be bought.
     """
-    if not stats: return False
-
     current = stats.get('current', [])
     avg90 = stats.get('avg90', [])
     avg365 = stats.get('avg365', [])
@@ -95,9 +114,6 @@ def check_peek_viability(stats):
     elif len(current) > 1 and current[1] != -1: # Fallback to New if Used missing
         buy_price = current[1]
 
-    if buy_price == -1:
-        return False # Can't buy it
-
     # 2. Determine Sell Price (Highest of Avg90 or Avg365)
     # We are optimistic here - find highest historical reference
     # CRITICAL UPDATE: Only consider USED prices (Index 2, 21) to align with processing logic.
@@ -119,6 +135,33 @@ def check_peek_viability(stats):
     if len(avg365) > 21 and avg365[21] != -1: sell_candidates.append(avg365[21]) # Used - Good
     if len(avg365) > 22 and avg365[22] != -1: sell_candidates.append(avg365[22]) # Used - Acceptable
 
+    return buy_price, sell_candidates
+
+def peek_expected_value(stats):
+    """
+    Rough expected value of committing (heavy-fetching) a Peek survivor: the gross
+    spread between the best Used average and the buy price, times its yearly
+    sales-rank drops. Only used to order commit work; it is not a filter.
+    """
+    if not stats: return 0
+    buy_price, sell_candidates = _peek_prices(stats)
+    if buy_price == -1 or not sell_candidates:
+        return 0
+    drops365 = stats.get('salesRankDrops365', -1)
+    return max(max(sell_candidates) - buy_price, 0) * max(drops365, 1)
+
+def check_peek_viability(stats):
+    """
+    Heuristic check to see if a deal is worth a heavy fetch (20 tokens).
+    Returns True if potentially profitable, False if obviously bad.
+    """
+    if not stats: return False
+
+    buy_price, sell_candidates = _peek_prices(stats)
+
+    if buy_price == -1:
+        return False # Can't buy it
+
     if not sell_candidates:
         return False # No Used history
 
@@ -161,6 +204,57 @@ def check_peek_viability(stats):
 
     return True
 
+def _fetch_with_arrival(fetch, *args, **kwargs):
+    """Runs a Keepa fetch on the I/O pool. Returns (its result, when the response arrived)."""
+    result = fetch(*args, **kwargs)
+    return result, time.time()
+
+def _create_commit_pool():
+    """
+    Returns a bounded process pool for the commit stage, or None when parallel mode
+    is off (or only one core is available). 'spawn' is used so children do not
+    inherit the parent's Redis/SQLite handles or the Celery worker's threads.
+    Also None in a daemonic process (a prefork Celery child), which may not start
+    children of its own.
+    """
+    workers = min(COMMIT_POOL_WORKERS, os.cpu_count() or 1)
+    if workers < 2:
+        return None
+    if multiprocessing.current_process().daemon:
+        logger.warning("Parallel commit stage needs a non-prefork worker (task processes here are daemonic). Processing sequentially.")
+        return None
+    logger.info(f"Parallel commit stage enabled with {workers} worker processes.")
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+def _process_commit_batch(commit_items, xai_api_key, pool=None):
+    """
+    Runs _process_single_deal for each (product_data, seller_data_cache) pair and
+    returns the rows in input order. Network work (Keepa seller fetch, token
+    accounting) has already been done by the caller. With a pool, products are
+    analysed concurrently; if the pool cannot start or breaks, the remaining products
+    fall back to in-process execution so the chunk still completes. The XAI price checks and LLM
+    seasonality are deferred: pass the rows to resolve_pending_reasonableness and
+    resolve_pending_seasonality.
+    """
+    if pool is None or len(commit_items) < 2:
+        return [_process_single_deal(product_data, seller_data_cache, xai_api_key, defer_seasonality=True, defer_reasonableness=True) for product_data, seller_data_cache in commit_items]
+
+    try:
+        futures = [pool.submit(_process_single_deal, product_data, seller_data_cache, xai_api_key, defer_seasonality=True, defer_reasonableness=True) for product_data, seller_data_cache in commit_items]
+    except Exception as e:
+        # BrokenProcessPool, or the pool could not start its workers at all
+        logger.error(f"Commit pool is unusable ({type(e).__name__}: {e}). Processing chunk sequentially.")
+        return [_process_single_deal(product_data, seller_data_cache, xai_api_key, defer_seasonality=True, defer_reasonableness=True) for product_data, seller_data_cache in commit_items]
+
+    results = []
+    for (product_data, seller_data_cache), future in zip(commit_items, futures):
+        try:
+            results.append(future.result())
+        except BrokenProcessPool:
+            logger.error(f"ASIN {product_data.get('asin')}: Commit worker died. Processing in the parent instead.")
+            results.append(_process_single_deal(product_data, seller_data_cache, xai_api_key, defer_seasonality=True, defer_reasonableness=True))
+    return results
+
 def requeue_stuck_restrictions():
     """
     Finds deals stuck in Pending (is_restricted IS NULL) for > 1 hour and re-queues them.
@@ -187,12 +281,16 @@ def requeue_stuck_restrictions():
     except Exception as e:
         logger.error(f"Error in requeue_stuck_restrictions: {e}")
 
-def rescue_stale_deals(token_manager, limit=20):
+def rescue_stale_deals(token_manager, limit=20, scheduler=None):
     """
     Finds deals that are approaching the Janitor's 72h deadline (e.g. > 48h old)
     and forces a refresh to prevent them from being deleted if they are still valid.
+    With a scheduler, `limit` is reduced to what the current token budget affords.
     """
     try:
+        if scheduler is not None:
+            limit = scheduler.batch_size(STALE_RESCUE, limit, limit)
+
         # 1. Check Refill Rate - Don't rescue if we are starving
         if token_manager.REFILL_RATE_PER_MINUTE < 10:
             logger.info(f"Skipping Stale Rescue: Low Refill Rate ({token_manager.REFILL_RATE_PER_MINUTE}/min).")
@@ -219,15 +317,20 @@ def rescue_stale_deals(token_manager, limit=20):
         logger.info(f"Stale Deal Rescue: Found {len(stale_asins)} deals > 48h old. Refreshing: {stale_asins}")
 
         # 3. Fetch Stats (Light Update)
-        # Estimate cost: ~3 tokens/ASIN
-        token_manager.request_permission_for_call(3 * len(stale_asins))
+        # Estimate cost from the learned stale-rescue cost (cached responses cost nothing)
+        cached, to_fetch = split_cached(stale_asins, days=180, offers=20)
+        if to_fetch:
+            estimated_cost = scheduler.cost_model.estimate(STALE_RESCUE, len(to_fetch)) if scheduler else 3 * len(to_fetch)
+            token_manager.request_permission_for_call(estimated_cost, priority=PRIORITY_STALE_RESCUE)
 
         # Use same params as light update: days=180, offers=20
         api_key = os.getenv("KEEPA_API_KEY")
-        prod_resp, _, _, tokens_left = fetch_current_stats_batch(api_key, stale_asins, days=180, offers=20)
+        prod_resp, _, tokens_consumed, tokens_left = fetch_current_stats_batch(api_key, stale_asins, days=180, offers=20, cached=cached)
 
         if tokens_left:
             token_manager.update_after_call(tokens_left)
+        if scheduler is not None:
+            scheduler.observe(STALE_RESCUE, len(to_fetch), tokens_consumed)
 
         if not prod_resp or 'products' not in prod_resp:
             logger.warning("Stale Deal Rescue: Keepa returned no products.")
@@ -262,25 +365,24 @@ def rescue_stale_deals(token_manager, limit=20):
                 rows_to_upsert.append(processed_row)
 
         if rows_to_upsert:
-            with get_db_connection(DB_PATH) as conn:
-                cursor = conn.cursor()
-                sanitized_headers = [sanitize_col_name(h) for h in headers_list]
-                sanitized_headers.extend(['last_seen_utc', 'source'])
-
-                data_for_upsert = []
-                for row_dict in rows_to_upsert:
-                    row_tuple = tuple(row_dict.get(h) for h in sanitized_headers)
-                    data_for_upsert.append(row_tuple)
-
-                cols_str = ', '.join(f'"{h}"' for h in sanitized_headers)
-                vals_str = ', '.join(['?'] * len(sanitized_headers))
-                # Explicitly exclude ASIN from update set to keep syntax valid
-                update_str = ', '.join(f'"{h}"=excluded."{h}"' for h in sanitized_headers if h != 'ASIN')
-                upsert_sql = f"INSERT INTO {TABLE_NAME} ({cols_str}) VALUES ({vals_str}) ON CONFLICT(ASIN) DO UPDATE SET {update_str}"
-
-                cursor.executemany(upsert_sql, data_for_upsert)
-                conn.commit()
-                logger.info(f"Stale Deal Rescue: Successfully refreshed {len(rows_to_upsert)} deals.")
+            sanitized_headers = [sanitize_col_name(h) for h in headers_list]
+            sanitized_headers.extend(['last_seen_utc', 'source'])
+
+            data_for_upsert = []
+            for row_dict in rows_to_upsert:
+                row_tuple = tuple(row_dict.get(h) for h in sanitized_headers)
+                data_for_upsert.append(row_tuple)
+            sanitized_headers, data_for_upsert = with_numeric_shadows(sanitized_headers, data_for_upsert)
+
+            cols_str = ', '.join(f'"{h}"' for h in sanitized_headers)
+            vals_str = ', '.join(['?'] * len(sanitized_headers))
+            # Explicitly exclude ASIN from update set to keep syntax valid
+            update_str = ', '.join(f'"{h}"=excluded."{h}"' for h in sanitized_headers if h != 'ASIN')
+            upsert_sql = f"INSERT INTO {TABLE_NAME} ({cols_str}) VALUES ({vals_str}) ON CONFLICT(ASIN) DO UPDATE SET {update_str}"
+
+            run_write(lambda conn: conn.executemany(upsert_sql, data_for_upsert).rowcount, DB_PATH)
+            bump_data_version('stale_rescue', asins=[row.get('ASIN') for row in rows_to_upsert])
+            logger.info(f"Stale Deal Rescue: Successfully refreshed {len(rows_to_upsert)} deals.")
 
     except Exception as e:
         logger.error(f"Error in rescue_stale_deals: {e}", exc_info=True)
@@ -294,6 +396,9 @@ def run():
         logger.info("--- Task: smart_ingestor is already running. Skipping execution. ---")
         return
 
+    commit_pool = None
+    commit_pool_tried = False
+    io_pool = None
     try:
         logger.info(f"--- Task: smart_ingestor started (Version: {SMART_INGESTOR_VERSION}) ---")
 
@@ -319,7 +424,8 @@ def run():
         # 0.5. Stale Deal Rescue (Prevent Diminishing Deals)
         # Run this BEFORE the main sync to ensure we prioritize saving existing deals
         # from the Janitor over finding new ones.
-        rescue_stale_deals(token_manager, limit=20)
+        scheduler = RequestScheduler(token_manager)
+        rescue_stale_deals(token_manager, limit=20, scheduler=scheduler)
 
         logger.info("Step 1: Initializing Sync...")
         # Blocking wait (raises TokenRechargeError if wait is long)
@@ -418,8 +524,9 @@ def run():
             if found_older_deal:
                 break
 
+            # No fixed sleep between pages: request_permission_for_call above already paces
+            # page fetches against the token budget.
             page += 1
-            time.sleep(1)
 
         if not all_new_deals:
             logger.info("No new deals found.")
@@ -478,145 +585,185 @@ def run():
                     logger.warning("Failed to close existing-ASIN check connection.", exc_info=True)
 
         # Processing Loop
-        # Iterate chunks
-        current_batch_size = SCAN_BATCH_SIZE
-        # Dynamic Batch Sizing: Reduce batch size for slow connections to avoid "Deficit Lockout".
-        if token_manager.REFILL_RATE_PER_MINUTE < 10:
-            # Reduced to 1 to safely fit within Burst Threshold (40 tokens).
-            # Peek (1*2=2) + Commit (1*20=20) = 22 tokens. Fits comfortably in 40.
-            current_batch_size = 1
-            logger.info(f"Critically Low Refill Rate ({token_manager.REFILL_RATE_PER_MINUTE}/min). Reducing SCAN_BATCH_SIZE to {current_batch_size} (Max potential cost 22 tokens).")
-        elif token_manager.REFILL_RATE_PER_MINUTE < 20:
-            current_batch_size = 20
-            logger.info(f"Low Refill Rate ({token_manager.REFILL_RATE_PER_MINUTE}/min). Reducing SCAN_BATCH_SIZE to {current_batch_size} to prevent Deficit Lockout.")
-        elif token_manager.REFILL_RATE_PER_MINUTE < 30:
-            # Mid-tier plan (e.g. 25/min). A 50-ASIN peek at days=365,offers=20 costs ~386 tokens,
-            # far exceeding the burst budget and causing deep deficit. Cap at 15 (~115 tokens) so one
-            # peek fits within a refillable budget and recharges in ~5 min.
-            current_batch_size = 15
-            logger.info(f"Mid Refill Rate ({token_manager.REFILL_RATE_PER_MINUTE}/min). Reducing SCAN_BATCH_SIZE to {current_batch_size} to prevent Deficit Lockout.")
-
-        # We process large batches (50) for cheap "Peek" checks, but small batches (5) for expensive "Commits".
+        # Chunk and commit sizes are planned per batch by the scheduler against the live
+        # token projection, so they shrink on low-tier plans (or after a deep spend) and
+        # grow back to the caps when the bucket is full.
 
         with open(HEADERS_PATH) as f:
             headers = json.load(f)
 
         total_upserted = 0
 
-        for i in range(0, len(all_new_deals), current_batch_size):
+        i = 0
+        while i < len(all_new_deals):
             # Heartbeat to prevent stall detection during heavy processing
             token_manager.emit_heartbeat()
 
+            current_batch_size = scheduler.scan_batch_size(all_new_deals[i:], existing_asins_set, SCAN_BATCH_SIZE)
             chunk_deals = all_new_deals[i:i + current_batch_size]
+            i += current_batch_size
+            logger.info(f"Scheduler: scan chunk of {current_batch_size} deals (budget {scheduler.budget():.0f} tokens).")
             chunk_asins = [d['asin'] for d in chunk_deals]
 
             chunk_new_asins = [a for a in chunk_asins if a not in existing_asins_set]
             chunk_existing_asins = [a for a in chunk_asins if a in existing_asins_set]
 
+            # The delta feed says these ASINs changed; never serve them from an older cached response.
+            invalidate_updated({d['asin']: d['lastUpdate'] for d in chunk_deals if d.get('lastUpdate')})
+
             chunk_products = {}
 
+            # --- EXISTING DEALS (Light Update) ---
+            # Independent of the peek/commit of new ASINs, so its fetch overlaps with them on
+            # the I/O pool. Tokens are reserved here, on the main thread, before submitting.
+            light_future = None
+            light_cached, light_to_fetch = {}, []
+            if chunk_existing_asins:
+                light_cached, light_to_fetch = split_cached(chunk_existing_asins, days=180, offers=20)
+                if light_to_fetch:
+                    token_manager.request_permission_for_call(scheduler.cost_model.estimate(LIGHT_UPDATE, len(light_to_fetch)), priority=PRIORITY_LIGHT_UPDATE)
+                if io_pool is None and KEEPA_CONCURRENT_REQUESTS > 1 and chunk_new_asins:
+                    io_pool = ThreadPoolExecutor(max_workers=KEEPA_CONCURRENT_REQUESTS - 1)
+                if io_pool is not None:
+                    light_future = io_pool.submit(_fetch_with_arrival, fetch_current_stats_batch, api_key, chunk_existing_asins, days=180, offers=20, cached=light_cached)
+
             # --- STAGE 1: PEEK (For New/Zombie Deals) ---
             new_candidates = []
             if chunk_new_asins:
-                # Estimate: Reduced from 5 to 2 tokens/ASIN.
-                # fetch_current_stats_batch uses history=0, which is cheap (1 token + offers cost).
-                # Reserving 5 was overly pessimistic and caused premature stalling.
-                token_manager.request_permission_for_call(2 * len(chunk_new_asins))
+                # Estimate from the learned peek cost (history=0, stats=365, offers=20).
+                cached, to_fetch = split_cached(chunk_new_asins, days=365, offers=20)
+                if to_fetch:
+                    token_manager.request_permission_for_call(scheduler.cost_model.estimate(PEEK, len(to_fetch)), priority=PRIORITY_PEEK)
                 # Use stats=365 for Peek. Explicit offers=20.
-                peek_resp, _, _, tokens_left = fetch_current_stats_batch(api_key, chunk_new_asins, days=365, offers=20)
+                peek_resp, _, tokens_consumed, tokens_left = fetch_current_stats_batch(api_key, chunk_new_asins, days=365, offers=20, cached=cached)
                 if tokens_left: token_manager.update_after_call(tokens_left)
+                scheduler.observe(PEEK, len(to_fetch), tokens_consumed)
 
                 if peek_resp and 'products' in peek_resp:
+                    peek_values = {}
                     for p in peek_resp['products']:
                         if check_peek_viability(p.get('stats')):
                             new_candidates.append(p['asin'])
+                            peek_values[p['asin']] = peek_expected_value(p.get('stats'))
                         else:
                             logger.info(f"Peek Rejected: ASIN {p.get('asin')}")
+                    # Highest expected value first, so if the budget runs out mid-chunk the
+                    # best candidates are already fetched (and cached for the next run).
+                    new_candidates.sort(key=lambda a: peek_values[a], reverse=True)
 
             # --- STAGE 2: COMMIT (For Survivors) ---
             if new_candidates:
-                # Process in sub-batches to prevent deficit shock
-                for j in range(0, len(new_candidates), COMMIT_BATCH_SIZE):
-                    sub_batch = new_candidates[j:j + COMMIT_BATCH_SIZE]
-                    token_manager.request_permission_for_call(20 * len(sub_batch))
-                    prod_resp, _, _, tokens_left = fetch_product_batch(api_key, sub_batch, days=365, history=1, offers=20)
+                # Process in sub-batches sized to the remaining budget to prevent deficit shock
+                j = 0
+                while j < len(new_candidates):
+                    commit_size = scheduler.batch_size(COMMIT, len(new_candidates) - j, COMMIT_BATCH_SIZE)
+                    sub_batch = new_candidates[j:j + commit_size]
+                    j += commit_size
+                    cached, to_fetch = split_cached(sub_batch, days=365, offers=20, history=1)
+                    if to_fetch:
+                        token_manager.request_permission_for_call(scheduler.cost_model.estimate(COMMIT, len(to_fetch)), priority=PRIORITY_COMMIT)
+                    prod_resp, _, tokens_consumed, tokens_left = fetch_product_batch(api_key, sub_batch, days=365, history=1, offers=20, cached=cached)
                     if tokens_left: token_manager.update_after_call(tokens_left)
+                    scheduler.observe(COMMIT, len(to_fetch), tokens_consumed)
                     if prod_resp and 'products' in prod_resp:
                         for p in prod_resp['products']:
                             chunk_products[p['asin']] = p
 
-            # --- EXISTING DEALS (Light Update) ---
+            # --- EXISTING DEALS (Light Update, collect) ---
             if chunk_existing_asins:
-                # Estimate: 5 tokens/ASIN (offers=20)
-                token_manager.request_permission_for_call(5 * len(chunk_existing_asins))
-                prod_resp_light, _, _, tokens_left = fetch_current_stats_batch(api_key, chunk_existing_asins, days=180, offers=20)
-                if tokens_left: token_manager.update_after_call(tokens_left)
+                light_received_at = None
+                if light_future is not None:
+                    (prod_resp_light, _, tokens_consumed, tokens_left), light_received_at = light_future.result()
+                else:
+                    prod_resp_light, _, tokens_consumed, tokens_left = fetch_current_stats_batch(api_key, chunk_existing_asins, days=180, offers=20, cached=light_cached)
+                # Collected last, but it may have arrived before the peek/commit responses:
+                # their (newer, lower) balance must not be overwritten with its older one.
+                if tokens_left: token_manager.update_after_call(tokens_left, received_at=light_received_at)
+                scheduler.observe(LIGHT_UPDATE, len(light_to_fetch), tokens_consumed)
                 if prod_resp_light and 'products' in prod_resp_light:
                     for p in prod_resp_light['products']:
                         chunk_products[p['asin']] = p
 
             # --- PROCESS ---
-            rows_to_upsert = []
-            for deal in chunk_deals:
+            # Light updates are cheap and run inline. New deals get their seller data
+            # prefetched here in one batch (network, token-managed, seller-cached) and are
+            # then analysed as one batch, optionally on the commit pool. Rows are merged
+            # back in chunk order.
+            processed_rows = [None] * len(chunk_deals)
+            commit_positions = []
+            commit_products = []
+            for position, deal in enumerate(chunk_deals):
                 asin = deal['asin']
                 if asin not in chunk_products: continue
 
                 product_data = chunk_products[asin]
                 product_data.update(deal)
 
-                processed_row = None
                 if asin in existing_asins_set:
                      processed_row = _process_lightweight_update(existing_rows_map[asin], product_data)
                      if processed_row:
                          processed_row = clean_numeric_values(processed_row)
                          processed_row['last_seen_utc'] = datetime.now(timezone.utc).isoformat()
                          processed_row['source'] = 'smart_ingestor_light'
+                     processed_rows[position] = processed_row
                 else:
-                     seller_data_cache = get_seller_info_for_single_deal(product_data, api_key, token_manager)
-                     processed_row = _process_single_deal(product_data, seller_data_cache, xai_api_key)
+                     commit_positions.append(position)
+                     commit_products.append(product_data)
+
+            if commit_products:
+                seller_caches = prefetch_seller_info(commit_products, api_key, token_manager)
+                commit_items = [(p, seller_caches.get(p['asin'], {})) for p in commit_products]
+                if not commit_pool_tried and COMMIT_POOL_WORKERS > 1 and len(commit_items) > 1:
+                    commit_pool_tried = True
+                    commit_pool = _create_commit_pool()
+                token_manager.emit_heartbeat()
+                for position, processed_row in zip(commit_positions, _process_commit_batch(commit_items, xai_api_key, commit_pool)):
                      if processed_row:
                          processed_row = clean_numeric_values(processed_row)
                          processed_row['last_seen_utc'] = datetime.now(timezone.utc).isoformat()
                          processed_row['source'] = 'smart_ingestor'
+                     processed_rows[position] = processed_row
 
-                if processed_row:
-                    rows_to_upsert.append(processed_row)
+            rows_to_upsert = [row for row in processed_rows if row]
+            # The chunk's XAI price checks and the seasonality the heuristics could not
+            # place, each in a few batched calls
+            resolve_pending_reasonableness(rows_to_upsert, xai_api_key)
+            resolve_pending_seasonality(rows_to_upsert, xai_api_key)
 
             # --- UPSERT & WATERMARK RATCHET ---
             if rows_to_upsert:
                 logger.info(f"Upserting {len(rows_to_upsert)} deals to DB. ASINs: {[r.get('ASIN') for r in rows_to_upsert[:10]]}...")
                 try:
-                    with get_db_connection(DB_PATH, timeout=60) as conn:
-                        cursor = conn.cursor()
-                        sanitized_headers = [sanitize_col_name(h) for h in headers]
-                        sanitized_headers.extend(['last_seen_utc', 'source'])
-
-                        data_for_upsert = []
-                        for row_dict in rows_to_upsert:
-                            row_tuple = tuple(row_dict.get(h) for h in headers) + (row_dict.get('last_seen_utc'), row_dict.get('source'))
-                            data_for_upsert.append(row_tuple)
-
-                        cols_str = ', '.join(f'"{h}"' for h in sanitized_headers)
-                        vals_str = ', '.join(['?'] * len(sanitized_headers))
-                        update_str = ', '.join(f'"{h}"=excluded."{h}"' for h in sanitized_headers if h != 'ASIN')
-                        upsert_sql = f"INSERT INTO {TABLE_NAME} ({cols_str}) VALUES ({vals_str}) ON CONFLICT(ASIN) DO UPDATE SET {update_str}"
-
-                        cursor.executemany(upsert_sql, data_for_upsert)
-                        conn.commit()
-                        total_upserted += len(rows_to_upsert)
-
-                        # Trigger restriction check
-                        new_asins = [row['ASIN'] for row in rows_to_upsert if 'ASIN' in row]
-                        if new_asins:
-                            celery.send_task('keepa_deals.sp_api_tasks.check_restriction_for_asins', args=[new_asins])
-
-                        # Watermark Ratchet
-                        # We are processing Oldest -> Newest.
-                        # The last deal in this chunk is the "newest" we have fully processed so far.
-                        last_deal_in_chunk = chunk_deals[-1] # This is safe because chunk_deals corresponds to loop
-                        new_wm_iso = _convert_keepa_time_to_iso(last_deal_in_chunk['lastUpdate'])
-                        save_safe_watermark(new_wm_iso)
-                        logger.info(f"Watermark ratcheted to {new_wm_iso}")
+                    sanitized_headers = [sanitize_col_name(h) for h in headers]
+                    sanitized_headers.extend(['last_seen_utc', 'source'])
+
+                    data_for_upsert = []
+                    for row_dict in rows_to_upsert:
+                        row_tuple = tuple(row_dict.get(h) for h in headers) + (row_dict.get('last_seen_utc'), row_dict.get('source'))
+                        data_for_upsert.append(row_tuple)
+                    sanitized_headers, data_for_upsert = with_numeric_shadows(sanitized_headers, data_for_upsert)
+
+                    cols_str = ', '.join(f'"{h}"' for h in sanitized_headers)
+                    vals_str = ', '.join(['?'] * len(sanitized_headers))
+                    update_str = ', '.join(f'"{h}"=excluded."{h}"' for h in sanitized_headers if h != 'ASIN')
+                    upsert_sql = f"INSERT INTO {TABLE_NAME} ({cols_str}) VALUES ({vals_str}) ON CONFLICT(ASIN) DO UPDATE SET {update_str}"
+
+                    run_write(lambda conn: conn.executemany(upsert_sql, data_for_upsert).rowcount, DB_PATH)
+                    bump_data_version('ingestor', asins=[row.get('ASIN') for row in rows_to_upsert])
+                    total_upserted += len(rows_to_upsert)
+
+                    # Trigger restriction check
+                    new_asins = [row['ASIN'] for row in rows_to_upsert if 'ASIN' in row]
+                    if new_asins:
+                        celery.send_task('keepa_deals.sp_api_tasks.check_restriction_for_asins', args=[new_asins])
+
+                    # Watermark Ratchet
+                    # We are processing Oldest -> Newest.
+                    # The last deal in this chunk is the "newest" we have fully processed so far.
+                    last_deal_in_chunk = chunk_deals[-1] # This is safe because chunk_deals corresponds to loop
+                    new_wm_iso = _convert_keepa_time_to_iso(last_deal_in_chunk['lastUpdate'])
+                    save_safe_watermark(new_wm_iso)
+                    logger.info(f"Watermark ratcheted to {new_wm_iso}")
 
                 except Exception as e:
                     logger.error(f"Chunk processing/upsert failed: {e}", exc_info=True)
@@ -637,6 +784,10 @@ def run():
         return # Exit task, releasing lock
 
     finally:
+        if commit_pool is not None:
+            commit_pool.shutdown(wait=True)
+        if io_pool is not None:
+            io_pool.shutdown(wait=True)
         if lock.locked():
             lock.release()
             logger.info("--- Task: smart_ingestor lock released. ---")
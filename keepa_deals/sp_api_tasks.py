@@ -12,10 +12,38 @@ import httpx
 from worker import celery_app as celery
 from keepa_deals.amazon_sp_api import check_restrictions, refresh_sp_api_token
 from keepa_deals.db_utils import DB_PATH, get_all_user_credentials
+from keepa_deals.data_version import bump_data_version
+from keepa_deals.write_queue import run_write
 
 logger = logging.getLogger(__name__)
 
 
+def _restriction_value(is_restricted):
+    """Stored is_restricted: True -> 1 (Restricted), False -> 0 (Not Restricted), -1 -> -1 (Error)."""
+    if is_restricted is True:
+        return 1
+    if is_restricted == -1:
+        return -1
+    return 0
+
+
+def _save_restrictions(user_id, rows):
+    """
+    Writes (asin, is_restricted, approval_url) rows for a user through the write queue,
+    where concurrent batches share one transaction, then bumps the data version.
+    """
+    def write(conn):
+        now = datetime.utcnow()
+        conn.executemany("""
+            INSERT OR REPLACE INTO user_restrictions
+            (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(user_id, asin, is_restricted, approval_url, now) for asin, is_restricted, approval_url in rows])
+
+    run_write(write, DB_PATH)
+    bump_data_version('restrictions')
+
+
 @celery.task(name='keepa_deals.sp_api_tasks.check_all_restrictions_for_user', bind=True)
 def check_all_restrictions_for_user(self, user_id: str, seller_id: str, access_token: str, refresh_token: str):
     """
@@ -68,31 +96,8 @@ def check_all_restrictions_for_user(self, user_id: str, seller_id: str, access_t
                     results = check_restrictions(batch_items, access_token, seller_id)
 
                 # Save results to the database immediately
-                with get_db_connection(DB_PATH) as conn:
-                    cursor = conn.cursor()
-                    for asin, result in results.items():
-                        # Determine stored value for is_restricted:
-                        # True -> 1 (Restricted)
-                        # False -> 0 (Not Restricted)
-                        # -1 -> -1 (Error)
-                        is_restricted_val = 0
-                        if result['is_restricted'] is True:
-                            is_restricted_val = 1
-                        elif result['is_restricted'] == -1:
-                            is_restricted_val = -1
-
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO user_restrictions
-                            (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (
-                            user_id,
-                            asin,
-                            is_restricted_val,
-                            result['approval_url'],
-                            datetime.utcnow()
-                        ))
-                    conn.commit()
+                _save_restrictions(user_id, [(asin, _restriction_value(result['is_restricted']), result['approval_url'])
+                                             for asin, result in results.items()])
 
                 total_processed += len(results)
                 logger.info(f"Progress: Saved restriction data for {total_processed}/{len(items)} ASINs for user_id: {user_id}")
@@ -100,23 +105,8 @@ def check_all_restrictions_for_user(self, user_id: str, seller_id: str, access_t
                 logger.error(f"Error processing restriction check batch for user {user_id}: {e}", exc_info=True)
                 # Fallback: Mark batch as error to prevent infinite spinner
                 try:
-                    with get_db_connection(DB_PATH) as conn:
-                        cursor = conn.cursor()
-                        for item in batch_items:
-                            asin = item['asin']
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO user_restrictions
-                                (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                                VALUES (?, ?, ?, ?, ?)
-                            """, (
-                                user_id,
-                                asin,
-                                -1, # Error
-                                "ERROR",
-                                datetime.utcnow()
-                            ))
-                        conn.commit()
-                        total_processed += len(batch_items) # Count them as processed (errored)
+                    _save_restrictions(user_id, [(item['asin'], -1, "ERROR") for item in batch_items])
+                    total_processed += len(batch_items) # Count them as processed (errored)
                 except Exception as db_e:
                     logger.error(f"CRITICAL: Failed to save error fallback state for batch: {db_e}", exc_info=True)
 
@@ -131,36 +121,11 @@ def check_all_restrictions_for_user(self, user_id: str, seller_id: str, access_t
             remaining_count = len(items) - total_processed
             logger.warning(f"Task crashed with {remaining_count} items pending. Marking them as Error.")
             try:
-                # Identify remaining items
-                # We can't easily know which specific ones were processed if `total_processed` is just a count,
-                # but since we process sequentially, we can approximate or just mark ALL pending ones.
-                # Safer strategy: Query DB for NULLs and mark them.
-                with get_db_connection(DB_PATH) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT asin FROM user_restrictions
-                        WHERE user_id = ? AND is_restricted IS NULL
-                    """, (user_id,))
-                    # Actually, pending items might NOT have a row yet if we use INSERT OR REPLACE?
-                    # No, check_all_restrictions iterates 'deals'. If a deal has no row in user_restrictions, it's pending.
-                    # So we should insert error rows for deals that are missing from user_restrictions.
-
-                    # Optimized approach: Iterate the local `items` list, skipping the first `total_processed`.
-                    remaining_items = items[total_processed:]
-                    for item in remaining_items:
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO user_restrictions
-                            (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (
-                            user_id,
-                            item['asin'],
-                            -1,
-                            "ERROR",
-                            datetime.utcnow()
-                        ))
-                    conn.commit()
-                    logger.info(f"Successfully marked {len(remaining_items)} remaining items as Error.")
+                # We process sequentially, so everything after the first `total_processed`
+                # items is still pending (and may not have a user_restrictions row yet).
+                remaining_items = items[total_processed:]
+                _save_restrictions(user_id, [(item['asin'], -1, "ERROR") for item in remaining_items])
+                logger.info(f"Successfully marked {len(remaining_items)} remaining items as Error.")
             except Exception as fallback_e:
                 logger.error(f"CRITICAL: Emergency fallback failed: {fallback_e}", exc_info=True)
 
@@ -214,21 +179,7 @@ def check_restriction_for_asins(asins: list[str]):
             if not access_token:
                 logger.warning(f"Could not refresh token for user {user_id}. Marking {len(items)} items as error.")
                 try:
-                    with get_db_connection(DB_PATH) as conn:
-                        cursor = conn.cursor()
-                        for item in items:
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO user_restrictions
-                                (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                                VALUES (?, ?, ?, ?, ?)
-                            """, (
-                                user_id,
-                                item['asin'],
-                                -1, # Error State
-                                "ERROR",
-                                datetime.utcnow()
-                            ))
-                        conn.commit()
+                    _save_restrictions(user_id, [(item['asin'], -1, "ERROR") for item in items]) # Error State
                 except Exception as db_e:
                     logger.error(f"Failed to save auth failure state to DB: {db_e}", exc_info=True)
                 continue
@@ -240,46 +191,12 @@ def check_restriction_for_asins(asins: list[str]):
                 try:
                     results = check_restrictions(batch_items, access_token, user_id)
 
-                    with get_db_connection(DB_PATH) as conn:
-                        cursor = conn.cursor()
-                        for asin, result in results.items():
-                            is_restricted_val = 0
-                            if result['is_restricted'] is True:
-                                is_restricted_val = 1
-                            elif result['is_restricted'] == -1:
-                                is_restricted_val = -1
-
-                            cursor.execute("""
-                                INSERT OR REPLACE INTO user_restrictions
-                                (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                                VALUES (?, ?, ?, ?, ?)
-                            """, (
-                                user_id,
-                                asin,
-                                is_restricted_val,
-                                result['approval_url'],
-                                datetime.utcnow()
-                            ))
-                        conn.commit()
+                    _save_restrictions(user_id, [(asin, _restriction_value(result['is_restricted']), result['approval_url'])
+                                                 for asin, result in results.items()])
                 except Exception as e:
                     logger.error(f"Error processing restriction check batch for user {user_id}: {e}", exc_info=True)
                     try:
-                        with get_db_connection(DB_PATH) as conn:
-                            cursor = conn.cursor()
-                            for item in batch_items:
-                                asin = item['asin']
-                                cursor.execute("""
-                                    INSERT OR REPLACE INTO user_restrictions
-                                    (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                                    VALUES (?, ?, ?, ?, ?)
-                                """, (
-                                    user_id,
-                                    asin,
-                                    -1, # Error
-                                    "ERROR",
-                                    datetime.utcnow()
-                                ))
-                            conn.commit()
+                        _save_restrictions(user_id, [(item['asin'], -1, "ERROR") for item in batch_items]) # Error
                     except Exception as db_e:
                         logger.error(f"CRITICAL: Failed to save error fallback state for batch: {db_e}", exc_info=True)
 
@@ -288,21 +205,7 @@ def check_restriction_for_asins(asins: list[str]):
         except Exception as e:
             logger.error(f"An unexpected error occurred in check_restriction_for_asins for user {user_id}: {e}", exc_info=True)
             try:
-                with get_db_connection(DB_PATH) as conn:
-                    cursor = conn.cursor()
-                    for asin in asins:
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO user_restrictions
-                            (user_id, asin, is_restricted, approval_url, last_checked_timestamp)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (
-                            user_id,
-                            asin,
-                            -1,
-                            "ERROR",
-                            datetime.utcnow()
-                        ))
-                    conn.commit()
+                _save_restrictions(user_id, [(asin, -1, "ERROR") for asin in asins])
             except Exception as db_e:
                 logger.error(f"CRITICAL: Failed to save outer fallback state: {db_e}", exc_info=True)
 
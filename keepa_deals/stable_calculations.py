@@ -4,8 +4,12 @@
 # stable_calculations.py
 # (Last update: Version 5)
 
+import json
 import logging
 import math
+import re
+import threading
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -14,17 +18,32 @@ import os
 import httpx
 import time
 import scipy.stats as st
-from .xai_token_manager import XaiTokenManager
-from .xai_cache import XaiCache
+from .xai_token_manager import get_xai_token_manager, XAI_CLASS_REASONABLENESS
+from .xai_cache import get_xai_cache
 from .xai_sales_inference import infer_sales_with_xai
+from .keepa_history import KeepaHistory, keepa_minutes_to_datetime, datetime_to_keepa_minutes
 
 # Initialize cache and token manager at the module level
-xai_cache = XaiCache()
-xai_token_manager = XaiTokenManager()
+xai_cache = get_xai_cache()
+xai_token_manager = get_xai_token_manager()
 
 # Keepa epoch is minutes from 2011-01-01
 KEEPA_EPOCH = datetime(2011, 1, 1)
 
+# Prices verified per XAI call by verify_reasonableness_batch.
+REASONABLENESS_BATCH_SIZE = int(os.getenv('REASONABLENESS_BATCH_SIZE', '20'))
+
+# NOTE: We explicitly explain that the "3-Year Average Price" includes off-season lows and that seasonal items
+# (especially Textbooks) can validly have peak prices 200-400% higher than the average.
+# This context is critical to prevent the AI from falsely rejecting valid peak season prices.
+REASONABLENESS_CONTEXT = """You are an expert Arbitrage Advisor.
+    CONTEXT: The "3-Year Average Price" is a simple mean of all sales, including off-season lows.
+    For seasonal items (especially Textbooks), the "Peak Season" price can validly be 200-400% higher than the average.
+    However, any used book price over $500 should face intense scrutiny and is highly likely unreasonable unless it is a known textbook or rare collectible, and prices over $1,000 are almost always unreasonable."""
+
+def _reasonableness_cache_key(title, category, season, price_usd, binding="N/A", rank_info="N/A", trend_info="N/A", avg_3yr_usd="N/A", **_):
+    return f"reasonableness:{title}|{category}|{season}|{price_usd:.2f}|{binding}|{rank_info}|{trend_info}|{avg_3yr_usd}"
+
 def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, binding="N/A", page_count="N/A", image_url="N/A", rank_info="N/A", trend_info="N/A", avg_3yr_usd="N/A"):
     """
     Queries the XAI API to act as a reasonableness check for a calculated price,
@@ -35,7 +54,7 @@ def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, b
         return True
 
     # 1. Create a unique cache key (include new fields to differentiate contexts)
-    cache_key = f"reasonableness:{title}|{category}|{season}|{price_usd:.2f}|{binding}|{rank_info}|{trend_info}|{avg_3yr_usd}"
+    cache_key = _reasonableness_cache_key(title, category, season, price_usd, binding, rank_info, trend_info, avg_3yr_usd)
 
     # 2. Check cache first
     cached_result = xai_cache.get(cache_key)
@@ -44,20 +63,9 @@ def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, b
         logging.info(f"XAI Cache HIT for reasonableness. Found '{is_reasonable}' for title '{title}'.")
         return is_reasonable
 
-    # 3. If not in cache, check for permission to make a call
-    if not xai_token_manager.request_permission():
-        logging.warning(f"XAI daily limit reached. Cannot perform reasonableness check for '{title}'. Defaulting to reasonable.")
-        return True
-
-    # 4. If permission granted, proceed with the API call
-    # NOTE: We explicitly explain that the "3-Year Average Price" includes off-season lows and that seasonal items
-    # (especially Textbooks) can validly have peak prices 200-400% higher than the average.
-    # This context is critical to prevent the AI from falsely rejecting valid peak season prices.
+    # 3. If not in cache, build the API call (made below only if the governor permits it)
     prompt = f"""
-    You are an expert Arbitrage Advisor.
-    CONTEXT: The "3-Year Average Price" is a simple mean of all sales, including off-season lows.
-    For seasonal items (especially Textbooks), the "Peak Season" price can validly be 200-400% higher than the average.
-    However, any used book price over $500 should face intense scrutiny and is highly likely unreasonable unless it is a known textbook or rare collectible, and prices over $1,000 are almost always unreasonable.
+    {REASONABLENESS_CONTEXT}
 
     Given the following book details, is a peak selling price of ${price_usd:.2f} reasonable during {season}?
     Respond with only "Yes" or "No".
@@ -81,7 +89,10 @@ def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, b
     logging.info(f"XAI Reasonableness Request for '{title}' (Cache MISS)")
 
     try:
-        with httpx.Client(timeout=30.0) as client:
+        with xai_token_manager.call_slot(XAI_CLASS_REASONABLENESS) as permitted, httpx.Client(timeout=30.0) as client:
+            if not permitted:
+                logging.warning(f"XAI call limit reached. Cannot perform reasonableness check for '{title}'. Defaulting to reasonable.")
+                return True
             response = client.post("https://api.x.ai/v1/chat/completions", headers=headers, json=payload)
             response.raise_for_status()
 
@@ -93,7 +104,7 @@ def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, b
             if not is_reasonable:
                 logging.warning(f"XAI REJECTED: Title='{title}', Price=${price_usd:.2f}, Category='{category}', Season='{season}', Binding='{binding}', Rank='{rank_info}', Trend='{trend_info}', 3yrAvg='${avg_3yr_usd}'")
 
-            # 5. Cache the successful result as a string
+            # 4. Cache the successful result as a string
             xai_cache.set(cache_key, str(is_reasonable))
             return is_reasonable
 
@@ -102,6 +113,112 @@ def _query_xai_for_reasonableness(title, category, season, price_usd, api_key, b
         # Default to reasonable on any API error
         return True
 
+def _cached_reasonableness(check):
+    """The cached verdict for a check (see analyze_sales_performance), or None."""
+    cached_result = xai_cache.get(_reasonableness_cache_key(**check))
+    if cached_result is None:
+        return None
+    return cached_result.lower() == 'true'
+
+def _query_xai_for_reasonableness_batch(checks, api_key):
+    """
+    Verifies several prices in one XAI call. `checks` are dicts of the keyword
+    arguments of _query_xai_for_reasonableness (without `api_key`).
+
+    Returns a dict of check index -> verdict for the checks the response covered
+    (verdicts are cached), or None if the call failed, was not permitted or its
+    response was not a JSON array.
+    """
+    books = [
+        {"id": i, "title": c['title'], "category": c['category'], "peak_season": c['season'],
+         "peak_price": f"${c['price_usd']:.2f}", "binding": c.get('binding', 'N/A'),
+         "page_count": c.get('page_count', 'N/A'), "sales_rank_info": c.get('rank_info', 'N/A'),
+         "three_year_trend": c.get('trend_info', 'N/A'), "three_year_average_price": f"${c.get('avg_3yr_usd', 'N/A')}",
+         "image_url": c.get('image_url', 'N/A')}
+        for i, c in enumerate(checks)
+    ]
+    prompt = f"""
+    {REASONABLENESS_CONTEXT}
+
+    For each of the following books, is the peak selling price reasonable during its peak season?
+
+    **Books:**
+    {json.dumps(books, default=str)}
+
+    Respond with ONLY a JSON array containing one object per book: {{"id": <book id>, "reasonable": "Yes" or "No"}}.
+    """
+    payload = {
+        "messages": [{"role": "user", "content": prompt}],
+        "model": "grok-4-fast-reasoning", "temperature": 0.1, "max_tokens": 50 + 20 * len(checks)
+    }
+    headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    logging.info(f"XAI Reasonableness Batch Request for {len(checks)} prices (Cache MISS)")
+
+    try:
+        with xai_token_manager.call_slot(XAI_CLASS_REASONABLENESS) as permitted, httpx.Client(timeout=60.0) as client:
+            if not permitted:
+                logging.warning(f"XAI call limit reached. Cannot verify {len(checks)} prices. Defaulting to reasonable.")
+                return None
+            response = client.post("https://api.x.ai/v1/chat/completions", headers=headers, json=payload)
+            response.raise_for_status()
+            content = response.json()['choices'][0]['message']['content'].strip()
+    except (httpx.HTTPStatusError, httpx.RequestError, json.JSONDecodeError, KeyError, IndexError) as e:
+        logging.error(f"XAI batch reasonableness check for {len(checks)} prices failed: {e}")
+        return None
+
+    try:
+        answers = json.loads(re.sub(r'^```json\s*|\s*```$', '', content, flags=re.MULTILINE))
+    except json.JSONDecodeError:
+        answers = None
+    if not isinstance(answers, list):
+        # Unusable as a whole: a failed call, not prices left out of the response
+        logging.warning(f"XAI batch reasonableness response is not a JSON array: {content[:200]}")
+        return None
+
+    verdicts = {}
+    for answer in answers:
+        i = answer.get('id') if isinstance(answer, dict) else None
+        if not isinstance(i, int) or not 0 <= i < len(checks):
+            continue
+        check = checks[i]
+        is_reasonable = "yes" in str(answer.get('reasonable', '')).lower()
+        if not is_reasonable:
+            logging.warning(f"XAI REJECTED: Title='{check['title']}', Price=${check['price_usd']:.2f}, Category='{check['category']}', Season='{check['season']}', Rank='{check.get('rank_info')}', Trend='{check.get('trend_info')}', 3yrAvg='${check.get('avg_3yr_usd')}'")
+        xai_cache.set(_reasonableness_cache_key(**check), str(is_reasonable))
+        verdicts[i] = is_reasonable
+    logging.info(f"XAI verified {len(verdicts)} of {len(checks)} prices in one batch.")
+    return verdicts
+
+def verify_reasonableness_batch(checks, api_key):
+    """
+    Runs the XAI reasonableness check for many prices, REASONABLENESS_BATCH_SIZE per
+    call. Returns the verdict of each check, in input order. Like the single check,
+    anything that cannot be verified (no key, failed or denied call, unusable response)
+    counts as reasonable.
+    """
+    verdicts = [None] * len(checks)
+    pending = []
+    for position, check in enumerate(checks):
+        cached = _cached_reasonableness(check) if api_key else True
+        if cached is None:
+            pending.append(position)
+        else:
+            verdicts[position] = cached
+
+    for start in range(0, len(pending), REASONABLENESS_BATCH_SIZE):
+        positions = pending[start:start + REASONABLENESS_BATCH_SIZE]
+        answers = _query_xai_for_reasonableness_batch([checks[p] for p in positions], api_key)
+        for i, position in enumerate(positions):
+            if answers is None:
+                verdicts[position] = True
+            elif i in answers:
+                verdicts[position] = answers[i]
+            else:
+                # Left out of an otherwise usable response: check it on its own
+                verdicts[position] = _query_xai_for_reasonableness(api_key=api_key, **checks[position])
+    return verdicts
+
 # Percent Down 365 starts
 def percent_down_365(product):
     """
@@ -171,73 +288,89 @@ def _convert_ktm_to_datetime(df):
     df['timestamp'] = pd.to_datetime(numeric_timestamps, unit='m', origin=KEEPA_EPOCH)
     return df
 
-def infer_sale_events(product):
+def _offer_drop_times(offer_counts, window_start_minutes):
+    """Returns the Keepa-minute timestamps at which an offer count decreased."""
+    recent = offer_counts.since(window_start_minutes)
+    if len(recent) < 2:
+        return recent.times[:0]
+    return recent.times[1:][np.diff(recent.values) < 0]
+
+def _nearest_values(times, values, query_times):
+    """
+    Vectorised equivalent of pd.merge_asof(direction='nearest') for sorted `times`:
+    for each query, returns the value whose timestamp is closest. Ties (including
+    duplicate exact matches) resolve to the latest earlier-or-equal row, as
+    merge_asof does.
+    """
+    backward = np.searchsorted(times, query_times, side='right') - 1
+    forward = np.searchsorted(times, query_times, side='left')
+    last = times.size - 1
+    backward_dist = query_times - times[np.clip(backward, 0, last)]
+    forward_dist = times[np.clip(forward, 0, last)] - query_times
+    use_forward = (backward < 0) | ((forward <= last) & (forward_dist < backward_dist))
+    return values[np.where(use_forward, forward, backward)]
+
+def infer_sale_events(product, history=None):
     """
     Analyzes historical product data to infer sale events using a search-window logic.
     A sale is inferred when a drop in used or new offer count is followed by a drop
-    in sales rank within a defined time window.
+    in sales rank within a defined time window. Pass a decoded `history` to reuse it.
     """
     asin = product.get('asin', 'N/A')
     logger = logging.getLogger(__name__)
     logger.debug(f"ASIN {asin}: Starting sale event inference with search-window logic (New & Used).")
 
     try:
-        csv_data = product.get('csv', [])
-        if not isinstance(csv_data, list) or len(csv_data) < 13:
+        history = history or KeepaHistory.from_product(product)
+        if not history.is_complete:
             logger.debug(f"ASIN {asin}: 'csv' data is missing or too short.")
             return [], 0
 
-        # --- Robustly get all required history arrays ---
-        rank_history = csv_data[3] if isinstance(csv_data[3], list) and len(csv_data[3]) > 1 else None
-        used_price_history = csv_data[2] if isinstance(csv_data[2], list) and len(csv_data[2]) > 1 else None
-        new_price_history = csv_data[1] if isinstance(csv_data[1], list) and len(csv_data[1]) > 1 else None
-        used_offer_count_history = csv_data[12] if isinstance(csv_data[12], list) and len(csv_data[12]) > 1 else None
-        new_offer_count_history = csv_data[11] if len(csv_data) > 11 and isinstance(csv_data[11], list) and len(csv_data[11]) > 1 else None
+        # --- Robustly get all required history series (decoded once, sorted by time) ---
+        rank_series = history.sales_rank
+        used_price_series = history.used_price
+        new_price_series = history.new_price
+        used_offer_counts = history.used_offer_count
+        new_offer_counts = history.new_offer_count
 
-        if not rank_history or not (used_offer_count_history or new_offer_count_history):
+        if rank_series is None or (used_offer_counts is None and new_offer_counts is None):
             logger.debug(f"ASIN {asin}: Rank history or both offer count histories are missing.")
             return [], 0
 
-        # --- Create DataFrames ---
-        df_rank = pd.DataFrame(np.array(rank_history).reshape(-1, 2), columns=['timestamp', 'rank']).pipe(_convert_ktm_to_datetime)
-        df_used_price = pd.DataFrame(np.array(used_price_history).reshape(-1, 2), columns=['timestamp', 'price_cents']).pipe(_convert_ktm_to_datetime) if used_price_history else None
-        df_new_price = pd.DataFrame(np.array(new_price_history).reshape(-1, 2), columns=['timestamp', 'price_cents']).pipe(_convert_ktm_to_datetime) if new_price_history else None
-
+        # All window arithmetic below runs on integer Keepa minutes; datetimes are only
+        # materialised for the confirmed sales and for log lines.
         history_window_start = datetime.now() - timedelta(days=1095) # Extended to 3 years
-        df_rank = df_rank[df_rank['timestamp'] >= history_window_start]
+        window_start_minutes = datetime_to_keepa_minutes(history_window_start)
+        rank_window = rank_series.since(window_start_minutes)
+        rank_times, rank_values = rank_window.times, rank_window.values
 
         # --- Find all instances of offer drops (New and Used) ---
-        all_offer_drops_list = []
+        drop_time_parts = []
+        drop_is_new_parts = []
         total_offer_drops_count = 0
 
         # Process Used offers if they exist
-        if used_offer_count_history:
-            df_used_offers = pd.DataFrame(np.array(used_offer_count_history).reshape(-1, 2), columns=['timestamp', 'offer_count']).pipe(_convert_ktm_to_datetime)
-            df_used_offers = df_used_offers[df_used_offers['timestamp'] >= history_window_start]
-            df_used_offers['offer_diff'] = df_used_offers['offer_count'].diff()
-            used_drops = df_used_offers[df_used_offers['offer_diff'] < 0].copy()
-            if not used_drops.empty:
-                used_drops['offer_type'] = 'Used'
-                all_offer_drops_list.append(used_drops)
-                total_offer_drops_count += len(used_drops)
+        if used_offer_counts is not None:
+            used_drop_times = _offer_drop_times(used_offer_counts, window_start_minutes)
+            if used_drop_times.size:
+                drop_time_parts.append(used_drop_times)
+                drop_is_new_parts.append(np.zeros(used_drop_times.size, dtype=bool))
+                total_offer_drops_count += used_drop_times.size
 
         # Process New offers if they exist
-        if new_offer_count_history:
-            df_new_offers = pd.DataFrame(np.array(new_offer_count_history).reshape(-1, 2), columns=['timestamp', 'offer_count']).pipe(_convert_ktm_to_datetime)
-            df_new_offers = df_new_offers[df_new_offers['timestamp'] >= history_window_start]
-            df_new_offers['offer_diff'] = df_new_offers['offer_count'].diff()
-            new_drops = df_new_offers[df_new_offers['offer_diff'] < 0].copy()
-            if not new_drops.empty:
-                new_drops['offer_type'] = 'New'
-                all_offer_drops_list.append(new_drops)
-                total_offer_drops_count += len(new_drops)
-
-        if not all_offer_drops_list:
+        if new_offer_counts is not None:
+            new_drop_times = _offer_drop_times(new_offer_counts, window_start_minutes)
+            if new_drop_times.size:
+                drop_time_parts.append(new_drop_times)
+                drop_is_new_parts.append(np.ones(new_drop_times.size, dtype=bool))
+                total_offer_drops_count += new_drop_times.size
+
+        if not drop_time_parts:
             logger.info(f"ASIN {asin}: No instances of any offer count decreasing were found.")
 
             # --- XAI Rescue Attempt (Hidden Sales / Stock Depth) ---
             try:
-                xai_sales = infer_sales_with_xai(product)
+                xai_sales = infer_sales_with_xai(product, history)
                 if xai_sales:
                     logger.info(f"ASIN {asin}: XAI rescued {len(xai_sales)} sale events (Hidden Sales)!")
                     return xai_sales, 0
@@ -246,77 +379,97 @@ def infer_sale_events(product):
 
             return [], 0
 
-        offer_drops = pd.concat(all_offer_drops_list).sort_values('timestamp').reset_index(drop=True)
-        logger.debug(f"ASIN {asin}: Found {len(offer_drops)} potential sale trigger points (New & Used drops).")
+        drop_times = np.concatenate(drop_time_parts)
+        drop_is_new = np.concatenate(drop_is_new_parts)
+        drop_order = np.argsort(drop_times, kind='stable')
+        drop_times = drop_times[drop_order]
+        drop_is_new = drop_is_new[drop_order]
+        logger.debug(f"ASIN {asin}: Found {len(drop_times)} potential sale trigger points (New & Used drops).")
+
+        # --- Search for subsequent signals (batched over all drops) ---
+        search_window = 240 * 60 # Expanded to 10 days based on "Near Miss" analysis
+        lookahead_limit = 30 * 1440
+        near_miss_window = 72 * 60
+
+        # rank_drop_prefix[k] = number of rank decreases among rank rows [0, k). The first
+        # row has no predecessor, so it can never count as a decrease.
+        rank_drops = np.zeros(rank_times.size, dtype=bool)
+        if rank_times.size > 1:
+            rank_drops[1:] = np.diff(rank_values) < 0
+        rank_drop_prefix = np.concatenate(([0], np.cumsum(rank_drops)))
+
+        end_times = drop_times + search_window
+        window_lo = np.searchsorted(rank_times, drop_times, side='left')
+        window_hi = np.searchsorted(rank_times, end_times, side='right')
+        has_rank_drop = (rank_drop_prefix[window_hi] - rank_drop_prefix[window_lo]) > 0
+
+        # Sparse Data Fallback Logic: compare the last rank at/before the offer drop with
+        # the first rank recorded after it (looking up to 30 days ahead).
+        after_idx = np.searchsorted(rank_times, drop_times, side='right')
+        before_idx = after_idx - 1
+        has_before = before_idx >= 0
+        has_after = after_idx < rank_times.size
+        if rank_times.size:
+            has_after &= rank_times[np.minimum(after_idx, rank_times.size - 1)] <= drop_times + lookahead_limit
+        sparse_candidates = ~has_rank_drop & has_before & has_after
+        for i in np.flatnonzero(sparse_candidates):
+            last_rank_val = rank_values[before_idx[i]]
+            next_rank_val = rank_values[after_idx[i]]
+            # If the next rank is lower (better) than the last rank before the drop,
+            # implies a sale happened sometime in the gap.
+            if next_rank_val < last_rank_val:
+                gap_days = (rank_times[after_idx[i]] - drop_times[i]) / 1440
+                has_rank_drop[i] = True
+                logger.info(f"ASIN {asin}: Sparse Data Fallback - Inferred sale from rank drop {last_rank_val}->{next_rank_val} over {gap_days:.1f} days (Offer Drop at {keepa_minutes_to_datetime(drop_times[i])}).")
+
+        # Near Miss Logging (Only if still False)
+        near_lo = window_hi
+        near_hi = np.searchsorted(rank_times, end_times + near_miss_window, side='right')
+        near_miss = ~has_rank_drop & ((rank_drop_prefix[near_hi] - rank_drop_prefix[near_lo]) > 0)
+        for i in np.flatnonzero(near_miss):
+            first_miss_idx = np.searchsorted(rank_drop_prefix, rank_drop_prefix[near_lo[i]] + 1, side='left') - 1
+            hours_missed_by = (rank_times[first_miss_idx] - end_times[i]) / 60
+            logger.info(f"ASIN {asin}: Near Miss - A rank drop occurred {hours_missed_by:.2f} hours after the window for an offer drop at {keepa_minutes_to_datetime(drop_times[i])}.")
+
+        # --- Price at sale time (nearest price point, per offer type) ---
+        confirmed_idx = np.flatnonzero(has_rank_drop)
+        sale_prices = [None] * confirmed_idx.size
+        for is_new, offer_type in ((False, 'Used'), (True, 'New')):
+            positions = np.flatnonzero(drop_is_new[confirmed_idx] == is_new)
+            if not positions.size:
+                continue
+            price_series = new_price_series if is_new and new_price_series is not None else used_price_series
+            if price_series is None:
+                for _ in positions:
+                    logger.warning(f"ASIN {asin}: No suitable price data for offer type {offer_type}.")
+                continue
+            nearest_prices = _nearest_values(price_series.times, price_series.values, drop_times[confirmed_idx[positions]])
+            for pos, price in zip(positions, nearest_prices):
+                sale_prices[pos] = price
 
-        # --- Search for subsequent signals ---
         confirmed_sales = []
-        search_window = timedelta(hours=240) # Expanded to 10 days based on "Near Miss" analysis
-        df_rank = df_rank.sort_values('timestamp').reset_index(drop=True)
-        df_rank['rank_diff'] = df_rank['rank'].diff()
-        
-        for _, drop in offer_drops.iterrows():
-            start_time = drop['timestamp']
-            end_time = start_time + search_window
-            
-            rank_changes_in_window = df_rank[(df_rank['timestamp'] >= start_time) & (df_rank['timestamp'] <= end_time)]
-            has_rank_drop = not rank_changes_in_window.empty and (rank_changes_in_window['rank_diff'] < 0).any()
-
-            # Sparse Data Fallback Logic
-            if not has_rank_drop:
-                # Find the last rank recorded *before* the offer drop
-                rank_before_slice = df_rank[df_rank['timestamp'] <= start_time]
-
-                # Find the first rank recorded *after* the offer drop (looking up to 30 days ahead)
-                lookahead_limit = start_time + timedelta(days=30)
-                rank_after_slice = df_rank[(df_rank['timestamp'] > start_time) & (df_rank['timestamp'] <= lookahead_limit)]
-
-                if not rank_before_slice.empty and not rank_after_slice.empty:
-                    last_rank_val = rank_before_slice.iloc[-1]['rank']
-                    next_rank_val = rank_after_slice.iloc[0]['rank']
-                    next_rank_ts = rank_after_slice.iloc[0]['timestamp']
-
-                    # If the next rank is lower (better) than the last rank before the drop,
-                    # implies a sale happened sometime in the gap.
-                    if next_rank_val < last_rank_val:
-                        gap_days = (next_rank_ts - start_time).total_seconds() / 86400
-                        has_rank_drop = True
-                        logger.info(f"ASIN {asin}: Sparse Data Fallback - Inferred sale from rank drop {last_rank_val}->{next_rank_val} over {gap_days:.1f} days (Offer Drop at {start_time}).")
-
-            # Near Miss Logging (Only if still False)
-            if not has_rank_drop:
-                near_miss_window_end = end_time + timedelta(hours=72)
-                near_miss_rank_changes = df_rank[(df_rank['timestamp'] > end_time) & (df_rank['timestamp'] <= near_miss_window_end)]
-                has_near_miss_rank_drop = not near_miss_rank_changes.empty and (near_miss_rank_changes['rank_diff'] < 0).any()
-                if has_near_miss_rank_drop:
-                    first_miss_time = near_miss_rank_changes[near_miss_rank_changes['rank_diff'] < 0].iloc[0]['timestamp']
-                    hours_missed_by = (first_miss_time - end_time).total_seconds() / 3600
-                    logger.info(f"ASIN {asin}: Near Miss - A rank drop occurred {hours_missed_by:.2f} hours after the window for an offer drop at {start_time}.")
-
-            if has_rank_drop:
-                price_df_to_use = df_new_price if drop['offer_type'] == 'New' and df_new_price is not None else df_used_price
-                if price_df_to_use is None:
-                    logger.warning(f"ASIN {asin}: No suitable price data for offer type {drop['offer_type']}.")
-                    continue
-
-                price_at_sale_time = pd.merge_asof(pd.DataFrame([drop]), price_df_to_use, on='timestamp', direction='nearest')['price_cents'].iloc[0]
-
-                if price_at_sale_time <= 0:
-                    logger.debug(f"ASIN {asin}: Ignoring inferred sale at {start_time} because its associated price was invalid ({price_at_sale_time}).")
-                    continue
-                
-                confirmed_sales.append({
-                    'event_timestamp': start_time,
-                    'inferred_sale_price_cents': price_at_sale_time,
-                })
-        
+        event_times = keepa_minutes_to_datetime(drop_times[confirmed_idx])
+        for pos, price_at_sale_time in enumerate(sale_prices):
+            if price_at_sale_time is None:
+                continue
+            start_time = event_times[pos]
+
+            if price_at_sale_time <= 0:
+                logger.debug(f"ASIN {asin}: Ignoring inferred sale at {start_time} because its associated price was invalid ({price_at_sale_time}).")
+                continue
+
+            confirmed_sales.append({
+                'event_timestamp': start_time,
+                'inferred_sale_price_cents': int(price_at_sale_time),
+            })
+
         if not confirmed_sales:
             logger.info(f"ASIN {asin}: Found 0 confirmed sale events out of {total_offer_drops_count} offer drops.")
 
             # --- XAI Rescue Attempt ---
             # Try to infer sales using XAI if algorithmic approach failed completely
             try:
-                xai_sales = infer_sales_with_xai(product)
+                xai_sales = infer_sales_with_xai(product, history)
                 if xai_sales:
                     logger.info(f"ASIN {asin}: XAI rescued {len(xai_sales)} sale events!")
                     return xai_sales, total_offer_drops_count
@@ -346,12 +499,85 @@ def infer_sale_events(product):
         logger.error(f"ASIN {asin}: Error during sale event inference: {e}", exc_info=True)
         return [], 0
 
+class ProductAnalysisContext:
+    """
+    Per-product holder for the results of sale-event inference and sales analysis.
+
+    `infer_sale_events` scans three years of history and may fire an XAI rescue, so
+    it must run at most once per product. The decoded KeepaHistory is shared too. Every consumer (1yr Avg,
+    Recent Inferred Sale Price, Deal Trust, Peak/Trough/List at) reads from the same
+    context instead of re-running inference. Results are computed lazily on first use.
+
+    With `defer_reasonableness`, the analysis leaves an uncached XAI price check
+    pending instead of making it (see analyze_sales_performance).
+    """
+    def __init__(self, product, defer_reasonableness=False):
+        self.product = product
+        self.defer_reasonableness = defer_reasonableness
+        self._history = None
+        self._inference = None
+        self._analysis = None
+
+    def _infer(self):
+        if self._inference is None:
+            self._inference = infer_sale_events(self.product, self.history)
+        return self._inference
+
+    @property
+    def history(self):
+        if self._history is None:
+            self._history = KeepaHistory.from_product(self.product)
+        return self._history
+
+    @property
+    def sale_events(self):
+        return self._infer()[0]
+
+    @property
+    def total_offer_drops(self):
+        return self._infer()[1]
+
+    @property
+    def analysis(self):
+        if self._analysis is None:
+            self._analysis = analyze_sales_performance(self.product, self.sale_events,
+                                                       defer_reasonableness=self.defer_reasonableness)
+        return self._analysis
+
+_active_context = threading.local()
+
+@contextmanager
+def activate_analysis_context(context):
+    """
+    Makes `context` visible to the FUNCTION_LIST wrappers (which only receive the
+    product dict) for the duration of the block. Restores the previous one on exit.
+    """
+    previous = getattr(_active_context, 'context', None)
+    _active_context.context = context
+    try:
+        yield context
+    finally:
+        _active_context.context = previous
+
+def _current_context(product):
+    """Returns the active context if it belongs to this exact product object, else None."""
+    context = getattr(_active_context, 'context', None)
+    if context is not None and context.product is product:
+        return context
+    return None
+
+def get_analysis_context(product):
+    """
+    Returns the active context for `product`, or a fresh (unshared) one when the
+    caller is running outside `activate_analysis_context` (e.g. scripts and tests).
+    """
+    return _current_context(product) or ProductAnalysisContext(product)
+
 def recent_inferred_sale_price(product):
     """
     Gets the most recent inferred sale price.
     """
-    logger = logging.getLogger(__name__)
-    sale_events, _ = infer_sale_events(product)
+    sale_events = get_analysis_context(product).sale_events
     if not sale_events:
         return {'Recent Inferred Sale Price': '-'}
     
@@ -400,11 +626,16 @@ def calculate_3yr_avg(sale_events):
     prices = [s['inferred_sale_price_cents'] for s in sale_events]
     return sum(prices) / len(prices)
 
-def analyze_sales_performance(product, sale_events):
+def analyze_sales_performance(product, sale_events, defer_reasonableness=False):
     """
     Analyzes inferred sale events to determine peak/trough seasons and calculate
     the mode of peak season prices, with an XAI verification step. This replaces
     the previous `analyze_seasonality` function.
+
+    With `defer_reasonableness`, a price whose verdict is not cached is returned as
+    provisional, with the check to make under 'reasonableness_check' (the keyword
+    arguments of _query_xai_for_reasonableness). The caller verifies it later, with
+    others, through verify_reasonableness_batch.
     """
     logger = logging.getLogger(__name__)
     asin = product.get('asin', 'N/A')
@@ -591,6 +822,23 @@ def analyze_sales_performance(product, sale_events):
     elif (price_source == 'Keepa Stats Fallback' or price_source == 'Inferred Sales (Sparse)') and not is_suspiciously_high:
         logger.info(f"ASIN {asin}: Price Source is '{price_source}'. Skipping AI Reasonableness Check to prevent false negatives due to insufficient context.")
         is_reasonable = True
+    elif defer_reasonableness and xai_api_key:
+        reasonableness_check = {
+            'title': title, 'category': category, 'season': peak_season_str,
+            'price_usd': peak_price_mode_cents / 100.0, 'binding': binding, 'page_count': page_count,
+            'image_url': image_url, 'rank_info': rank_info, 'trend_info': trend_info, 'avg_3yr_usd': avg_3yr_usd,
+        }
+        is_reasonable = _cached_reasonableness(reasonableness_check)
+        if is_reasonable is None:
+            logger.info(f"ASIN {asin}: XAI check deferred. Price ${peak_price_mode_cents/100:.2f} is provisional.")
+            return {
+                'peak_price_mode_cents': peak_price_mode_cents,
+                'peak_season': peak_season_str,
+                'trough_season': trough_season_str,
+                'expected_trough_price_cents': expected_trough_price_cents,
+                'price_source': price_source,
+                'reasonableness_check': reasonableness_check,
+            }
     else:
         is_reasonable = _query_xai_for_reasonableness(
             title, category, peak_season_str, peak_price_mode_cents / 100.0, xai_api_key,
@@ -628,6 +876,10 @@ def _get_analysis(product):
     Helper to get or compute sales performance analysis, caching the result.
     Uses the new analyze_sales_performance function.
     """
+    context = _current_context(product)
+    if context is not None:
+        return context.analysis
+
     asin = product.get('asin')
     if asin and asin in _analysis_cache:
         return _analysis_cache[asin]
@@ -677,7 +929,8 @@ def get_expected_trough_price(product):
 
 def deal_trust(product):
     """Calculates a confidence score based on how many offer drops correlate with a rank drop."""
-    sale_events, total_offer_drops = infer_sale_events(product)
+    context = get_analysis_context(product)
+    sale_events, total_offer_drops = context.sale_events, context.total_offer_drops
     if total_offer_drops == 0:
         return {'Deal Trust': '-'}
     
@@ -2,6 +2,7 @@ import time
 import math
 import logging
 import os
+import uuid
 import redis
 from dotenv import load_dotenv
 
@@ -9,6 +10,240 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Use the server-side Lua token bucket when connected to a real Redis (set to 0 to
+# force the legacy multi-round-trip reservation path).
+KEEPA_LUA_TOKEN_BUCKET = os.getenv('KEEPA_LUA_TOKEN_BUCKET', '1') == '1'
+
+# --- Priority Classes ---
+# Every Keepa call is charged to a class. Listed highest priority first, each with its
+# reserved share of the refill rate (override with KEEPA_PRIORITY_SHARES, e.g.
+# "debug:0.05,stale_rescue:0.3,light_update:0.25,commit:0.25,peek:0.15").
+PRIORITY_DEBUG = 'debug'                # Interactive debug endpoint
+PRIORITY_STALE_RESCUE = 'stale_rescue'  # Saving existing deals from the Janitor
+PRIORITY_LIGHT_UPDATE = 'light_update'  # Refreshing existing deals
+PRIORITY_COMMIT = 'commit'              # Full fetch of new deals (and their sellers)
+PRIORITY_PEEK = 'peek'                  # Exploratory peeks at new ASINs
+
+DEFAULT_PRIORITY_SHARES = [
+    (PRIORITY_DEBUG, 0.05),
+    (PRIORITY_STALE_RESCUE, 0.30),
+    (PRIORITY_LIGHT_UPDATE, 0.25),
+    (PRIORITY_COMMIT, 0.25),
+    (PRIORITY_PEEK, 0.15),
+]
+
+# Interactive classes skip the wait queue and recharge mode (deficit limits still apply).
+INTERACTIVE_PRIORITIES = {PRIORITY_DEBUG}
+
+# A class's reserved credit is only protected from borrowers while the class has
+# asked for tokens within this window; idle classes lend everything.
+PRIORITY_ACTIVE_WINDOW_SECONDS = int(os.getenv('KEEPA_PRIORITY_ACTIVE_WINDOW', 300))
+
+def _load_priority_shares():
+    spec = os.getenv('KEEPA_PRIORITY_SHARES')
+    if not spec:
+        return list(DEFAULT_PRIORITY_SHARES)
+    try:
+        return [(name.strip(), float(share)) for name, share in
+                (item.split(':') for item in spec.split(',') if item.strip())]
+    except ValueError:
+        logger.error(f"Invalid KEEPA_PRIORITY_SHARES '{spec}'. Using defaults.")
+        return list(DEFAULT_PRIORITY_SHARES)
+
+PRIORITY_SHARES = _load_priority_shares()
+
+# Atomic token bucket: refill projection, recharge mode, soft floor, deficit limits,
+# priority-class credits, reservation and a cross-process FIFO of waiting callers in one
+# EVALSHA. Mirrors the rules of the legacy path in request_permission_for_call.
+#
+# Each class accrues credit at its share of the refill rate (capped at its share of
+# max_tokens). A call paid from its own credit only has to pass the usual rules. A call
+# that borrows must leave the positive credit of every other active class untouched,
+# and may not borrow while a higher-priority class is waiting.
+#
+# KEYS: 1 tokens, 2 refill rate, 3 token timestamp, 4 recharge mode, 5 recharge start,
+#       6 wait queue (zset "class|ticket" -> arrival), 7 queue liveness (zset -> last poll),
+#       8 class credits (hash class -> credit, "_ts" -> last accrual),
+#       9 class activity (hash class -> last request)
+# ARGV: 1 cost, 2 now, 3 ticket, 4 min threshold, 5 max deficit, 6 burst threshold,
+#       7 soft floor, 8 max tokens, 9 recharge timeout, 10 queue stale after,
+#       11 fallback refill rate, 12 fallback tokens, 13 class,
+#       14 classes ("name:share,..." highest priority first), 15 active window,
+#       16 interactive (0/1)
+# Returns {granted (0/1), tokens (string), wait seconds (string), reason}
+TOKEN_BUCKET_LUA = """
+local cost = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local ticket = ARGV[3]
+local min_threshold = tonumber(ARGV[4])
+local max_deficit = tonumber(ARGV[5])
+local burst = tonumber(ARGV[6])
+local soft_floor = tonumber(ARGV[7])
+local max_tokens = tonumber(ARGV[8])
+local recharge_timeout = tonumber(ARGV[9])
+local stale_after = tonumber(ARGV[10])
+local cls = ARGV[13]
+local active_window = tonumber(ARGV[15])
+local interactive = ARGV[16] == '1'
+
+local rate = tonumber(redis.call('GET', KEYS[2]) or ARGV[11]) or tonumber(ARGV[11])
+local tokens = tonumber(redis.call('GET', KEYS[1]) or ARGV[12]) or tonumber(ARGV[12])
+local ts = tonumber(redis.call('GET', KEYS[3]) or '') or now
+
+-- Refill projection since the last authoritative value
+if tokens < max_tokens and now > ts then
+    tokens = math.min(tokens + (now - ts) / 60 * rate, max_tokens)
+end
+local calc_rate = rate
+if calc_rate <= 0 then calc_rate = 1 end
+
+-- Class credits accrue at each class's share of the refill rate
+local shares, rank, order = {}, {}, {}
+for name, share in string.gmatch(ARGV[14], '([^:,]+):([^,]+)') do
+    order[#order + 1] = name
+    shares[name] = tonumber(share)
+    rank[name] = #order
+end
+if not shares[cls] then
+    order[#order + 1] = cls
+    shares[cls] = 0
+    rank[cls] = #order
+end
+local credit_ts = tonumber(redis.call('HGET', KEYS[8], '_ts') or '') or now
+local accrued = 0
+if now > credit_ts then accrued = (now - credit_ts) / 60 * rate end
+local credit = {}
+for _, name in ipairs(order) do
+    local c = tonumber(redis.call('HGET', KEYS[8], name) or '') or 0
+    credit[name] = math.min(c + accrued * shares[name], shares[name] * max_tokens)
+    redis.call('HSET', KEYS[8], name, tostring(credit[name]))
+end
+redis.call('HSET', KEYS[8], '_ts', tostring(now))
+redis.call('HSET', KEYS[9], cls, tostring(now))
+
+-- A class pays from its own credit once that covers the cost (or is full, for calls
+-- larger than the class's cap; the difference becomes debt)
+local own_target = math.min(cost, shares[cls] * max_tokens)
+local own = shares[cls] > 0 and credit[cls] >= own_target
+local protected = 0
+for _, name in ipairs(order) do
+    if name ~= cls and credit[name] > 0 then
+        local seen = tonumber(redis.call('HGET', KEYS[9], name) or '')
+        if seen and (now - seen) <= active_window then
+            protected = protected + credit[name]
+        end
+    end
+end
+
+local function wait_for(target, balance, per_minute)
+    local needed = target - balance
+    if needed <= 0 then return 0 end
+    if per_minute <= 0 then per_minute = 1 end
+    return math.ceil(needed / per_minute * 60)
+end
+
+local function deny(reason, wait)
+    redis.call('ZADD', KEYS[6], 'NX', now, ticket)
+    redis.call('ZADD', KEYS[7], now, ticket)
+    return {0, tostring(tokens), tostring(wait), reason}
+end
+
+-- Drop waiters that stopped polling (crashed or gave up)
+local stale = redis.call('ZRANGEBYSCORE', KEYS[7], '-inf', now - stale_after)
+for _, t in ipairs(stale) do
+    redis.call('ZREM', KEYS[6], t)
+    redis.call('ZREM', KEYS[7], t)
+end
+
+-- Fair FIFO within a class: nobody overtakes an earlier waiter of the same class.
+-- Borrowing is also closed while a higher-priority class is waiting.
+local higher_waiting = false
+if not interactive then
+    local prefix = cls .. '|'
+    for _, t in ipairs(redis.call('ZRANGE', KEYS[6], 0, -1)) do
+        local t_cls = string.match(t, '^([^|]*)|')
+        if t_cls == cls then
+            if t ~= ticket then return deny('queued', 2) end
+            break
+        end
+        if t_cls and rank[t_cls] and rank[t_cls] < rank[cls] then
+            higher_waiting = true
+        end
+    end
+end
+
+-- Recharge mode: hold until the burst threshold (or a buffer for low-cost calls)
+if not interactive then
+    if redis.call('GET', KEYS[4]) == '1' then
+        local start = tonumber(redis.call('GET', KEYS[5]) or '')
+        if not start then
+            start = now
+            redis.call('SET', KEYS[5], tostring(now))
+        end
+        if (now - start) > recharge_timeout or tokens >= burst or (cost <= 10 and tokens >= 20) then
+            redis.call('DEL', KEYS[4], KEYS[5])
+        else
+            return deny('recharge', math.max(wait_for(burst, tokens, calc_rate), 5))
+        end
+    elseif tokens < soft_floor then
+        -- Soft floor: this call is still evaluated, but the next one waits for a recharge
+        redis.call('SET', KEYS[4], '1')
+        redis.call('SET', KEYS[5], tostring(now))
+    end
+end
+
+-- Borrowers only see the balance left after other active classes' reserved credit
+local available = tokens
+if not own and not interactive then
+    available = tokens - protected
+end
+
+local new_balance = tokens - cost
+local granted = false
+if rate < 10 and tokens < min_threshold and not interactive then
+    redis.call('SET', KEYS[4], '1')
+    redis.call('SET', KEYS[5], tostring(now))
+    return deny('recharge', math.max(wait_for(burst, tokens, calc_rate), 5))
+elseif not own and higher_waiting then
+    granted = false
+elseif available >= min_threshold then
+    -- Controlled deficit: a healthy starting balance may go negative, down to max_deficit
+    granted = new_balance >= max_deficit
+elseif cost <= 10 and available - cost >= 0 and rate >= 10 then
+    -- Priority pass for small calls
+    granted = true
+end
+
+if granted then
+    -- Borrowed tokens put the class in debt, repaid from its own future accrual
+    credit[cls] = math.max(credit[cls] - cost, -shares[cls] * max_tokens)
+    redis.call('HSET', KEYS[8], cls, tostring(credit[cls]))
+    redis.call('SET', KEYS[1], tostring(new_balance))
+    redis.call('SET', KEYS[3], tostring(now))
+    redis.call('ZREM', KEYS[6], ticket)
+    redis.call('ZREM', KEYS[7], ticket)
+    return {1, tostring(new_balance), '0', 'granted'}
+end
+
+-- Wait for whichever comes first: our own credit, or enough unreserved balance to borrow
+local target = math.max(min_threshold, cost + max_deficit)
+if cost <= 10 and rate >= 10 then target = 0 end
+local recovery = 10
+if available > 0 then
+    recovery = target
+    if rate >= 10 then recovery = target + 5 end
+end
+local wait = wait_for(recovery, available, calc_rate)
+if higher_waiting then wait = math.huge end
+if shares[cls] > 0 then
+    wait = math.min(wait, wait_for(own_target, credit[cls], rate * shares[cls]))
+end
+if wait == math.huge then wait = 60 end
+local reason = 'insufficient'
+if not own and protected > 0 then reason = 'reserved' end
+return deny(reason, math.max(wait, 1))
+"""
+
 class TokenRechargeError(Exception):
     """Raised when the system must pause for a long recharge duration."""
     pass
@@ -23,9 +258,18 @@ class TokenManager:
     REDIS_KEY_RECHARGE_MODE = "keepa_recharge_mode_active"
     REDIS_KEY_TIMESTAMP = "keepa_token_timestamp"
     REDIS_KEY_LAST_SYNC_TIMESTAMP = "keepa_last_sync_timestamp"
-
-    def __init__(self, api_key):
+    REDIS_KEY_RECHARGE_START = "keepa_recharge_start_time"
+    REDIS_KEY_QUEUE = "keepa_token_queue"
+    REDIS_KEY_QUEUE_SEEN = "keepa_token_queue_seen"
+    REDIS_KEY_CLASS_CREDIT = "keepa_token_class_credit"
+    REDIS_KEY_CLASS_SEEN = "keepa_token_class_seen"
+    RECHARGE_TIMEOUT_SECONDS = 3600
+    QUEUE_STALE_SECONDS = 180
+
+    def __init__(self, api_key, priority=PRIORITY_COMMIT):
         self.api_key = api_key
+        # Priority class charged for calls that do not name one
+        self.priority = priority
 
         # Constants
         self.REFILL_RATE_PER_MINUTE = 5.0 # Default, will be updated from Redis/API
@@ -54,6 +298,9 @@ class TokenManager:
         self.max_tokens = 300
         self.last_api_call_timestamp = time.time() - self.MIN_TIME_BETWEEN_CALLS_SECONDS
         self.last_refill_timestamp = 0
+        self.last_response_received_at = 0  # arrival time of the last response applied
+
+        self._bucket_script = None
 
         # Redis Setup
         redis_url = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
@@ -189,10 +436,13 @@ class TokenManager:
 
         return self.tokens >= estimated_cost
 
-    def request_permission_for_call(self, estimated_cost):
+    def request_permission_for_call(self, estimated_cost, priority=None):
         """
         Checks if an API call can be made and waits if necessary.
-        Uses optimistic atomic reservation (decrby) to handle concurrency.
+        Uses the atomic Lua token bucket when available, otherwise optimistic
+        atomic reservation (decrby) to handle concurrency.
+        `priority` names the priority class charged (default: self.priority); classes
+        are only enforced by the Lua bucket.
         """
         # --- High Frequency Monitor (Phantom Process Trap) ---
         now = time.time()
@@ -209,6 +459,13 @@ class TokenManager:
 
         cost_int = math.ceil(estimated_cost)
 
+        bucket = self._get_bucket_script()
+        if bucket is not None:
+            try:
+                return self._request_permission_atomic(bucket, cost_int, priority or self.priority)
+            except redis.RedisError as e:
+                logger.error(f"Redis error in atomic token bucket: {e}. Falling back to legacy reservation.")
+
         # Soft Floor Check
         # If tokens are running low (below 20), we allow THIS call to proceed (Graceful Stop),
         # but we trigger Recharge Mode so the NEXT call will wait.
@@ -452,6 +709,99 @@ class TokenManager:
                 self.tokens -= cost_int
                 return
 
+    def _get_bucket_script(self):
+        """
+        Returns the registered Lua token bucket for the current Redis client, or None
+        when it cannot be used (disabled, no Redis, or a non-Redis test double).
+        """
+        if not KEEPA_LUA_TOKEN_BUCKET or not isinstance(self.redis_client, redis.Redis):
+            return None
+        if self._bucket_script is None or self._bucket_script.registered_client is not self.redis_client:
+            self._bucket_script = self.redis_client.register_script(TOKEN_BUCKET_LUA)
+        return self._bucket_script
+
+    def _new_ticket(self, priority):
+        return f"{priority}|{self.process_pid}:{uuid.uuid4().hex}"
+
+    def _eval_bucket(self, bucket, cost_int, ticket, priority):
+        keys = [self.REDIS_KEY_TOKENS, self.REDIS_KEY_RATE, self.REDIS_KEY_TIMESTAMP,
+                self.REDIS_KEY_RECHARGE_MODE, self.REDIS_KEY_RECHARGE_START,
+                self.REDIS_KEY_QUEUE, self.REDIS_KEY_QUEUE_SEEN,
+                self.REDIS_KEY_CLASS_CREDIT, self.REDIS_KEY_CLASS_SEEN]
+        args = [cost_int, time.time(), ticket, self.MIN_TOKEN_THRESHOLD, self.MAX_DEFICIT,
+                self.BURST_THRESHOLD, self.SOFT_BUFFER_FLOOR, self.max_tokens,
+                self.RECHARGE_TIMEOUT_SECONDS, self.QUEUE_STALE_SECONDS,
+                self.REFILL_RATE_PER_MINUTE, self.tokens, priority,
+                ','.join(f"{name}:{share}" for name, share in PRIORITY_SHARES),
+                PRIORITY_ACTIVE_WINDOW_SECONDS, int(priority in INTERACTIVE_PRIORITIES)]
+        granted, tokens, wait, reason = bucket(keys=keys, args=args)
+        if isinstance(reason, bytes):
+            reason = reason.decode()
+        self.tokens = float(tokens)
+        return bool(granted), float(wait), reason
+
+    def try_reserve(self, estimated_cost, priority=None):
+        """
+        Non-blocking reservation: one atomic attempt that never waits or queues.
+        Returns True if the tokens were reserved. Without the Lua bucket this
+        only checks has_enough_tokens and reserves nothing.
+        """
+        bucket = self._get_bucket_script()
+        if bucket is None:
+            return self.has_enough_tokens(estimated_cost)
+        priority = priority or self.priority
+        ticket = self._new_ticket(priority)
+        granted, _, _ = self._eval_bucket(bucket, math.ceil(estimated_cost), ticket, priority)
+        if not granted:
+            self._leave_queue(ticket)
+        return granted
+
+    def _leave_queue(self, ticket):
+        try:
+            self.redis_client.zrem(self.REDIS_KEY_QUEUE, ticket)
+            self.redis_client.zrem(self.REDIS_KEY_QUEUE_SEEN, ticket)
+        except Exception as e:
+            logger.warning(f"Could not remove token queue ticket {ticket}: {e}")
+
+    def _request_permission_atomic(self, bucket, cost_int, priority):
+        """
+        Blocking reservation against the Lua bucket. Waiting callers hold a ticket in
+        a Redis FIFO, so across processes each priority class is served in arrival order.
+        Waits over 60s raise TokenRechargeError (after one forced sync) so the task
+        can release its worker.
+        """
+        ticket = self._new_ticket(priority)
+        force_synced = False
+        granted = False
+        try:
+            while True:
+                # Rate Limit Sleep (Local) - Prevent spamming API even if tokens exist
+                time_since_last = time.time() - self.last_api_call_timestamp
+                if time_since_last < self.MIN_TIME_BETWEEN_CALLS_SECONDS:
+                    time.sleep(self.MIN_TIME_BETWEEN_CALLS_SECONDS - time_since_last)
+
+                granted, wait, reason = self._eval_bucket(bucket, cost_int, ticket, priority)
+                if granted:
+                    return
+
+                if wait > 60:
+                    if not force_synced:
+                        # Our shared state may be stale; verify once before giving up.
+                        logger.warning(f"Token bucket ({reason}): tokens {self.tokens:.2f}, required wait {wait:.0f}s. Executing FORCE SYNC to verify state.")
+                        self.sync_tokens(force=True)
+                        force_synced = True
+                        continue
+                    logger.warning(f"Token bucket ({reason}): tokens {self.tokens:.2f}, required wait {wait:.0f}s > 60s. Exiting task.")
+                    raise TokenRechargeError(f"Recharge needed: {wait:.0f}s")
+
+                if reason != 'queued':
+                    logger.info(f"Token bucket ({reason}): {priority} tokens {self.tokens:.2f}, cost {cost_int}. Waiting {wait:.0f}s.")
+                self.emit_heartbeat()
+                time.sleep(wait)
+        finally:
+            if not granted:
+                self._leave_queue(ticket)
+
     def _wait_for_tokens(self, initial_wait, target):
         """
         Sleeps for the calculated duration to allow refill.
@@ -559,9 +909,18 @@ class TokenManager:
         # Update Redis with authoritative value
         self._set_shared_tokens(self.tokens, self.REFILL_RATE_PER_MINUTE)
 
-    def update_after_call(self, tokens_left_from_api):
+    def update_after_call(self, tokens_left_from_api, received_at=None):
         """
         Updates the token count and timestamp after an API call using the authoritative response.
+        `received_at` is when the response arrived (default: now). Responses of overlapping
+        calls can be applied out of order; one that arrived before the last applied response
+        is ignored, as that newer balance already includes its spend.
         """
-        self.last_api_call_timestamp = time.time()
+        now = time.time()
+        received_at = now if received_at is None else received_at
+        self.last_api_call_timestamp = now
+        if received_at < self.last_response_received_at:
+            logger.info(f"Ignoring out-of-order token balance {tokens_left_from_api} (a newer response was already applied).")
+            return
+        self.last_response_received_at = received_at
         self._sync_tokens_from_response(tokens_left_from_api)
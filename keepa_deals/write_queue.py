@@ -0,0 +1,156 @@
+# keepa_deals/write_queue.py
+# Single-writer queue for database mutations.
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .db_utils import get_db_connection
+from . import db_utils
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# With the queue disabled, writes run inline on the caller's own connection.
+WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', '1') == '1'
+# A group transaction holds at most this many writes...
+WRITE_BATCH_MAX_OPS = int(os.getenv('WRITE_BATCH_MAX_OPS', '256'))
+# ...and waits at most this long after the first one for others to join it. With 0,
+# a group is whatever queued up while the previous one was committing, which suits
+# callers that block on their result (a linger would only add to their latency).
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv('WRITE_BATCH_MAX_DELAY_MS', '0'))
+# A writer thread with nothing to do for this long exits (restarted on demand).
+WRITE_QUEUE_IDLE_SECONDS = float(os.getenv('WRITE_QUEUE_IDLE_SECONDS', '30'))
+
+_queues = {}  # db_path -> WriteQueue (this process only)
+_queues_pid = None
+_queues_lock = threading.Lock()
+
+
+class WriteQueue:
+    """
+    Funnels the writes of every thread in this process through one writer thread per
+    database. Writes waiting together are committed in one `BEGIN IMMEDIATE`
+    transaction, each under its own savepoint: a failing write is rolled back and
+    reported to its caller without affecting the others in the group.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, fn):
+        """
+        Queues `fn(conn)` and returns a Future for its result. `fn` runs on the writer
+        thread inside the group transaction, so it must not commit or roll back itself.
+        Await it with `future.result()` (or `asyncio.wrap_future(future)`); side effects
+        that need the data committed (data version bumps, follow-up tasks) go after that.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("A queued write cannot wait on another queued write")
+        future = Future()
+        self._queue.put((fn, future))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'write-queue:{os.path.basename(self.db_path)}',
+                                                daemon=True)
+                self._thread.start()
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=WRITE_QUEUE_IDLE_SECONDS)
+            except queue.Empty:
+                with self._lock:
+                    # submit() queues before it checks for a running writer
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + WRITE_BATCH_MAX_DELAY_MS / 1000.0
+            while len(batch) < WRITE_BATCH_MAX_OPS:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        outcomes = []  # (future, result, error)
+        conn = None
+        try:
+            conn = get_db_connection(self.db_path)
+            conn.isolation_level = None  # transactions are managed explicitly below
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO queued_write")
+                    conn.execute("RELEASE queued_write")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE queued_write")
+                    outcomes.append((future, result, None))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Write queue: group transaction of {len(batch)} writes failed: {e}", exc_info=True)
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if conn is not None:
+                conn.close()
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _write_queue(db_path):
+    global _queues_pid
+    with _queues_lock:
+        # Writer threads do not survive a fork; the child starts its own
+        if _queues_pid != os.getpid():
+            _queues.clear()
+            _queues_pid = os.getpid()
+        write_queue = _queues.get(db_path)
+        if write_queue is None:
+            write_queue = _queues[db_path] = WriteQueue(db_path)
+        return write_queue
+
+
+def submit_write(fn, db_path=None):
+    """Queues `fn(conn)` for the writer of `db_path` (default: the deals database). Returns a Future."""
+    path = db_path if db_path is not None else db_utils.DB_PATH
+    if not WRITE_QUEUE_ENABLED:
+        future = Future()
+        try:
+            with get_db_connection(path) as conn:
+                future.set_result(fn(conn))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return _write_queue(path).submit(fn)
+
+
+def run_write(fn, db_path=None, timeout=None):
+    """Queues `fn(conn)` and waits until it is committed. Returns its result or raises its error."""
+    return submit_write(fn, db_path).result(timeout)
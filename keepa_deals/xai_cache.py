@@ -1,55 +1,159 @@
+# keepa_deals/xai_cache.py
+# Shared SQLite cache for xAI responses, so no process pays twice for the same LLM answer.
+
 import json
 import os
+import sqlite3
+import time
 from logging import getLogger
 
+from .db_utils import get_db_connection
+
 logger = getLogger(__name__)
 
+# --- Configuration ---
+XAI_CACHE_PATH = os.getenv('XAI_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'xai_cache.db'))
+# The JSON file the cache used to live in; its entries are imported on first use.
+XAI_CACHE_LEGACY_JSON = os.getenv('XAI_CACHE_LEGACY_JSON', 'xai_cache.json')
+# Upper bound on cached entries; least recently used entries are evicted first.
+XAI_CACHE_MAX_ENTRIES = int(os.getenv('XAI_CACHE_MAX_ENTRIES', '50000'))
+# TTLs (seconds) per namespace (the key prefix before ':'). Seasonality depends only on
+# the book; a reasonableness verdict is for one price and goes stale with the market.
+XAI_CACHE_TTL_DEFAULT = int(os.getenv('XAI_CACHE_TTL_DEFAULT', str(30 * 86400)))
+XAI_CACHE_TTLS = {
+    'seasonality': int(os.getenv('XAI_CACHE_TTL_SEASONALITY', str(180 * 86400))),
+    'reasonableness': int(os.getenv('XAI_CACHE_TTL_REASONABLENESS', str(7 * 86400))),
+}
+# Hits refresh an entry's LRU position at most this often, so reads rarely write.
+XAI_CACHE_TOUCH_INTERVAL = 3600
+# Size bound enforced every this many writes per process.
+XAI_CACHE_EVICT_EVERY = 100
+
+TABLE_NAME = 'xai_cache'
+
 class XaiCache:
     """
-    A simple persistent JSON-based cache for XAI API responses to avoid redundant calls.
+    Persistent cache for xAI API responses to avoid redundant calls.
+
+    Entries live in a WAL-mode SQLite table shared by every process, and each get/set
+    touches only its own row. Values are JSON-encoded. All failures are logged and
+    treated as misses: the cache never blocks a call.
     """
-    def __init__(self, cache_path='xai_cache.json'):
-        self.cache_path = cache_path
-        self.cache = self._load_cache()
-
-    def _load_cache(self):
-        """Loads the cache from a JSON file."""
-        if not os.path.exists(self.cache_path):
-            logger.info("XAI cache file not found. Starting with an empty cache.")
-            return {}
+    def __init__(self, db_path=None, max_entries=None, legacy_json_path=None):
+        self.db_path = db_path or XAI_CACHE_PATH
+        self.max_entries = XAI_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.legacy_json_path = XAI_CACHE_LEGACY_JSON if legacy_json_path is None else legacy_json_path
+        self._ready = False
+        self._writes = 0
+
+    def _ensure_table(self):
+        if self._ready:
+            return
+        conn = get_db_connection(self.db_path)
         try:
-            with open(self.cache_path, 'r') as f:
-                cache = json.load(f)
-            logger.info(f"Successfully loaded {len(cache)} items from XAI cache.")
-            return cache
-        except (IOError, json.JSONDecodeError):
-            logger.warning(f"Could not read or parse '{self.cache_path}'. Starting with an empty cache.")
-            return {}
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE_NAME}_last_access ON {TABLE_NAME} (last_access)")
+            conn.commit()
+            self._migrate_json(conn)
+        finally:
+            conn.close()
+        self._ready = True
 
-    def _save_cache(self):
-        """Saves the in-memory cache to the JSON file."""
+    def _migrate_json(self, conn):
+        """Imports the legacy JSON cache once, then renames the file out of the way."""
+        if not self.legacy_json_path or not os.path.exists(self.legacy_json_path):
+            return
         try:
-            with open(self.cache_path, 'w') as f:
-                json.dump(self.cache, f, indent=4)
-        except IOError as e:
-            logger.error(f"Could not save XAI cache to '{self.cache_path}': {e}")
+            with open(self.legacy_json_path, 'r') as f:
+                legacy = json.load(f)
+        except (IOError, json.JSONDecodeError):
+            logger.warning(f"Could not read or parse '{self.legacy_json_path}'. Skipping XAI cache migration.")
+            return
+        now = time.time()
+        rows = [(key, json.dumps(value), now + self.ttl_for(key), now) for key, value in legacy.items()]
+        # OR IGNORE: another process may have migrated (and refreshed) the same keys
+        conn.executemany(f"INSERT OR IGNORE INTO {TABLE_NAME} VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+        try:
+            os.replace(self.legacy_json_path, self.legacy_json_path + '.migrated')
+        except OSError:
+            pass
+        logger.info(f"Migrated {len(rows)} items from '{self.legacy_json_path}' to the XAI cache.")
+
+    @staticmethod
+    def ttl_for(key):
+        return XAI_CACHE_TTLS.get(str(key).split(':', 1)[0], XAI_CACHE_TTL_DEFAULT)
 
-    def get(self, key):
+    def get(self, key, now=None):
         """
         Retrieves a value from the cache.
-        Returns the cached value or None if the key is not found.
+        Returns the cached value or None if the key is not found or has expired.
         """
-        result = self.cache.get(key)
+        now = now or time.time()
+        try:
+            self._ensure_table()
+            conn = get_db_connection(self.db_path)
+            try:
+                row = conn.execute(f"SELECT value, last_access FROM {TABLE_NAME} WHERE key = ? AND expires_at > ?",
+                                   (key, now)).fetchone()
+                if row and now - row[1] > XAI_CACHE_TOUCH_INTERVAL:
+                    conn.execute(f"UPDATE {TABLE_NAME} SET last_access = ? WHERE key = ?", (now, key))
+                    conn.commit()
+            finally:
+                conn.close()
+            result = json.loads(row[0]) if row else None
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"XAI cache lookup failed, treating as miss: {e}")
+            return None
         if result:
             logger.debug(f"XAI Cache HIT for key: '{key}'")
         else:
             logger.debug(f"XAI Cache MISS for key: '{key}'")
         return result
 
-    def set(self, key, value):
+    def set(self, key, value, now=None):
         """
-        Adds a key-value pair to the cache and saves it to disk.
+        Adds a key-value pair to the cache, with the TTL of its namespace.
         """
         logger.debug(f"XAI Cache SET for key: '{key}'")
-        self.cache[key] = value
-        self._save_cache()
+        now = now or time.time()
+        try:
+            self._ensure_table()
+            conn = get_db_connection(self.db_path)
+            try:
+                conn.execute(f"INSERT OR REPLACE INTO {TABLE_NAME} VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value), now + self.ttl_for(key), now))
+                self._writes += 1
+                if self._writes % XAI_CACHE_EVICT_EVERY == 0:
+                    self._evict(conn, now)
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, TypeError) as e:
+            logger.error(f"Could not save XAI cache entry '{key}': {e}")
+
+    def _evict(self, conn, now):
+        conn.execute(f"DELETE FROM {TABLE_NAME} WHERE expires_at <= ?", (now,))
+        overflow = conn.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            conn.execute(f"""
+                DELETE FROM {TABLE_NAME} WHERE rowid IN (
+                    SELECT rowid FROM {TABLE_NAME} ORDER BY last_access ASC LIMIT ?
+                )
+            """, (overflow,))
+
+_cache = None
+
+def get_xai_cache():
+    """Returns the process-wide XAI cache."""
+    global _cache
+    if _cache is None:
+        _cache = XaiCache()
+    return _cache
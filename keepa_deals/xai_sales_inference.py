@@ -1,118 +1,61 @@
 import logging
-import pandas as pd
 import numpy as np
 import os
 import json
 import httpx
 from datetime import datetime, timedelta
-from .xai_token_manager import XaiTokenManager
-from .xai_cache import XaiCache
+from .xai_token_manager import get_xai_token_manager, XAI_CLASS_INFERENCE
+from .xai_cache import get_xai_cache
+from .keepa_history import KeepaHistory, KEEPA_EPOCH, datetime_to_keepa_minutes
 
 # Initialize token manager
-xai_token_manager = XaiTokenManager()
+xai_token_manager = get_xai_token_manager()
 # Initialize cache (though we might not use it heavily yet)
-xai_cache = XaiCache()
+xai_cache = get_xai_cache()
 
 logger = logging.getLogger(__name__)
 
-# Keepa epoch is minutes from 2011-01-01
-KEEPA_EPOCH = datetime(2011, 1, 1)
-
-def _convert_ktm_to_datetime(df):
-    """Converts a DataFrame's timestamp column from Keepa Time Minutes to datetime objects."""
-    # Coerce to numeric, turning any non-numeric strings into NaN (which becomes NaT)
-    numeric_timestamps = pd.to_numeric(df['timestamp'], errors='coerce')
-    df['timestamp'] = pd.to_datetime(numeric_timestamps, unit='m', origin=KEEPA_EPOCH).astype('datetime64[ns]')
-    return df
-
-def format_history_for_xai(product, days=100):
+def format_history_for_xai(product, days=100, history=None):
     """
     Extracts relevant history (Rank, Used Price, Used Offer Count) for the last n days
     and formats it as a compact time-series text for the LLM.
     Ensures initial state (at start of window) is captured.
+    Pass a decoded `history` (KeepaHistory) to reuse it.
     """
-    asin = product.get('asin')
-    csv_data = product.get('csv', [])
-
-    if not isinstance(csv_data, list) or len(csv_data) < 13:
+    history = history or KeepaHistory.from_product(product)
+    if not history.is_complete:
         return None
 
-    # Extract history arrays
-    rank_history = csv_data[3]
-    used_price_history = csv_data[2]
-    used_offer_count_history = csv_data[12] # Used offer count
+    rank_series = history.sales_rank
+    price_series = history.used_price
+    offers_series = history.used_offer_count # Used offer count
 
-    if not rank_history or not used_price_history:
-        return None
-
-    # Convert to DataFrames
-    def to_df(hist, col_name):
-        if not hist or len(hist) < 2: return None
-        # Keepa history is [time, val, time, val...]. Reshape to (N, 2)
-        try:
-            arr = np.array(hist)
-            # Ensure even length
-            if len(arr) % 2 != 0:
-                arr = arr[:-1]
-            df = pd.DataFrame(arr.reshape(-1, 2), columns=['timestamp', col_name])
-            return _convert_ktm_to_datetime(df)
-        except Exception as e:
-            logger.warning(f"Error converting history to DF for {asin}: {e}")
-            return None
-
-    df_rank = to_df(rank_history, 'Rank')
-    df_price = to_df(used_price_history, 'Price')
-    df_offers = to_df(used_offer_count_history, 'Offers')
-
-    if df_rank is None or df_price is None:
+    if not rank_series or not price_series:
         return None
 
     start_date = datetime.now() - timedelta(days=days)
-
-    # Filter timestamps for the target window, but KEEP the source DFs full
-    # so merge_asof can find the 'previous' value from before the window (Initial State).
-
-    ts_rank = df_rank[df_rank['timestamp'] >= start_date]['timestamp']
-    ts_price = df_price[df_price['timestamp'] >= start_date]['timestamp']
-
-    timestamps_list = [ts_rank, ts_price]
-
-    if df_offers is not None:
-        ts_offers = df_offers[df_offers['timestamp'] >= start_date]['timestamp']
-        timestamps_list.append(ts_offers)
-
-    # Ensure start_date is compatible (datetime64[ns])
-    start_date_ts = pd.Timestamp(start_date)
-
-    if not timestamps_list or all(ts.empty for ts in timestamps_list):
-        # No data in the window? Maybe just one initial state?
-        # Create at least one point at start_date
-        timestamps = pd.Series([start_date_ts])
+    start_minutes = datetime_to_keepa_minutes(start_date)
+
+    # Sample at every change inside the window, but look values up in the FULL series
+    # so the 'previous' value from before the window (Initial State) is found.
+    window_times = [s.since(start_minutes).times for s in (rank_series, price_series, offers_series) if s is not None]
+    sample_times = np.unique(np.concatenate(window_times)).astype(np.float64)
+
+    # Ensure start_date is included to capture initial state if not present
+    if sample_times.size == 0 or sample_times[0] > start_minutes:
+        sample_times = np.concatenate(([start_minutes], sample_times))
+
+    # Backward as-of lookup: the last known value at or before each sample time
+    ranks, has_rank = rank_series.value_at(sample_times)
+    prices, has_price = price_series.value_at(sample_times)
+    if offers_series is not None:
+        offers, has_offers = offers_series.value_at(sample_times)
     else:
-        timestamps = pd.concat(timestamps_list).sort_values().drop_duplicates().reset_index(drop=True)
-        # Ensure start_date is included to capture initial state if not present
-        if timestamps.iloc[0] > start_date_ts:
-            timestamps = pd.concat([pd.Series([start_date_ts]), timestamps]).sort_values().reset_index(drop=True)
+        offers, has_offers = None, np.zeros(sample_times.size, dtype=bool)
 
-    df_merged = pd.DataFrame({'timestamp': timestamps})
-
-    # Merge AsOf to get the state at each timestamp
-    # direction='backward' finds the last known value at or before the timestamp
-    try:
-        df_merged = pd.merge_asof(df_merged, df_rank, on='timestamp', direction='backward')
-        df_merged = pd.merge_asof(df_merged, df_price, on='timestamp', direction='backward')
-        if df_offers is not None:
-            df_merged = pd.merge_asof(df_merged, df_offers, on='timestamp', direction='backward')
-        else:
-            df_merged['Offers'] = 'N/A'
-    except Exception as e:
-        logger.error(f"Error during merge_asof for {asin}: {e}")
-        return None
-
-    # Drop rows where critical data is NaN (e.g. before history started)
-    df_merged = df_merged.dropna(subset=['Rank', 'Price'])
-
-    if df_merged.empty:
+    # Drop rows where critical data is missing (e.g. before history started)
+    rows = np.flatnonzero(has_rank & has_price)
+    if rows.size == 0:
         return None
 
     lines = []
@@ -122,17 +65,17 @@ def format_history_for_xai(product, days=100):
     last_row_vals = None
     count = 0
 
-    for _, row in df_merged.iterrows():
-        ts_str = row['timestamp'].strftime('%Y-%m-%d %H:%M')
-        rank = int(row['Rank']) if not pd.isna(row['Rank']) else '-'
-        price = f"${row['Price']/100:.2f}" if not pd.isna(row['Price']) else '-'
-        offers = int(row['Offers']) if not pd.isna(row['Offers']) and row['Offers'] != 'N/A' else '-'
+    for i in rows:
+        ts_str = (KEEPA_EPOCH + timedelta(minutes=float(sample_times[i]))).strftime('%Y-%m-%d %H:%M')
+        rank = int(ranks[i])
+        price = f"${prices[i]/100:.2f}"
+        offers_val = int(offers[i]) if has_offers[i] else '-'
 
-        current_vals = (rank, price, offers)
+        current_vals = (rank, price, offers_val)
 
         # Output if values changed, or if it's the first row (Initial State)
         if current_vals != last_row_vals:
-            lines.append(f"{ts_str} | {rank} | {price} | {offers}")
+            lines.append(f"{ts_str} | {rank} | {price} | {offers_val}")
             last_row_vals = current_vals
             count += 1
             if count > 150: # Token limit safety
@@ -154,10 +97,6 @@ def query_xai_sales_inference(history_text, product):
     cat_tree = product.get('categoryTree', [])
     category = cat_tree[-1]['name'] if cat_tree else 'Unknown'
 
-    if not xai_token_manager.request_permission():
-        logger.warning(f"XAI daily limit reached. Cannot perform sales inference for '{title}'.")
-        return None
-
     # Double braces {{ }} to escape JSON structure in f-string
     prompt = f"""
     You are an expert Amazon Arbitrage Analyst.
@@ -195,7 +134,10 @@ def query_xai_sales_inference(history_text, product):
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
 
     try:
-        with httpx.Client(timeout=60.0) as client:
+        with xai_token_manager.call_slot(XAI_CLASS_INFERENCE) as permitted, httpx.Client(timeout=60.0) as client:
+            if not permitted:
+                logger.warning(f"XAI call limit reached. Cannot perform sales inference for '{title}'.")
+                return None
             response = client.post("https://api.x.ai/v1/chat/completions", headers=headers, json=payload)
             response.raise_for_status()
             content = response.json()['choices'][0]['message']['content']
@@ -218,7 +160,7 @@ def query_xai_sales_inference(history_text, product):
         logger.error(f"XAI Error during sales inference: {e}")
         return None
 
-def infer_sales_with_xai(product):
+def infer_sales_with_xai(product, history=None):
     """
     Wrapper to call XAI inference if eligible.
     Returns a list of sale events (dicts) or None.
@@ -232,7 +174,11 @@ def infer_sales_with_xai(product):
     if current_rank and current_rank > 2000000:
         return None
 
-    history_text = format_history_for_xai(product, days=100)
+    # Fast check before formatting the history: skip if no call would be permitted now
+    if not xai_token_manager.may_call(XAI_CLASS_INFERENCE):
+        return None
+
+    history_text = format_history_for_xai(product, days=100, history=history)
     if not history_text:
         return None
 
@@ -1,19 +1,145 @@
 import json
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import date
 from logging import getLogger
 
+import redis
+
 logger = getLogger(__name__)
 
+# --- Caller Classes ---
+# Every xAI call is charged to a class, each with its share of the daily limit and its
+# own cap on concurrent calls. Together, the batch (non-interactive) classes are also
+# held below XAI_INTERACTIVE_RESERVE of the limit, so they can never use up the calls
+# that the user-triggered ones need. Override with XAI_CALLER_LIMITS, e.g.
+# "inference:0.5:4,seasonality:0.4:4" (class:share:max in flight).
+XAI_CLASS_INFERENCE = 'inference'            # Sales inference during ingestion
+XAI_CLASS_SEASONALITY = 'seasonality'        # Seasonality classification
+XAI_CLASS_REASONABLENESS = 'reasonableness'  # "List at" price reasonableness check
+XAI_CLASS_HOMOGENIZATION = 'homogenization'  # Intelligence clean-up task
+XAI_CLASS_PRIME_PICKS = 'prime_picks'        # Prime Picks selection pass
+XAI_CLASS_AVA_ADVICE = 'ava_advice'          # "Advice from Ava"
+XAI_CLASS_MENTOR_CHAT = 'mentor_chat'        # Mentor chat
+XAI_CLASS_TOOLTIPS = 'tooltips'              # Dashboard advice tooltips
+XAI_CLASS_LEARN = 'learn'                    # Guided Learning extraction
+XAI_CLASS_DEFAULT = 'other'
+
+DEFAULT_CALLER_LIMITS = {
+    XAI_CLASS_INFERENCE: (0.5, 4),
+    XAI_CLASS_SEASONALITY: (0.4, 4),
+    XAI_CLASS_REASONABLENESS: (0.4, 4),
+    XAI_CLASS_HOMOGENIZATION: (0.1, 1),
+    XAI_CLASS_PRIME_PICKS: (0.1, 1),
+    XAI_CLASS_AVA_ADVICE: (1.0, 4),
+    XAI_CLASS_MENTOR_CHAT: (1.0, 4),
+    XAI_CLASS_TOOLTIPS: (1.0, 8),
+    XAI_CLASS_LEARN: (1.0, 2),
+    XAI_CLASS_DEFAULT: (0.2, 2),
+}
+
+def _load_caller_limits():
+    spec = os.getenv('XAI_CALLER_LIMITS')
+    limits = dict(DEFAULT_CALLER_LIMITS)
+    if not spec:
+        return limits
+    try:
+        for item in spec.split(','):
+            if item.strip():
+                name, share, in_flight = item.split(':')
+                limits[name.strip()] = (float(share), int(in_flight))
+    except ValueError:
+        logger.error(f"Invalid XAI_CALLER_LIMITS '{spec}'. Using defaults.")
+        return dict(DEFAULT_CALLER_LIMITS)
+    return limits
+
+CALLER_LIMITS = _load_caller_limits()
+
+# User-triggered classes. Every other class (including unknown ones) is a batch class.
+XAI_INTERACTIVE_CLASSES = frozenset({
+    XAI_CLASS_AVA_ADVICE, XAI_CLASS_MENTOR_CHAT, XAI_CLASS_TOOLTIPS, XAI_CLASS_LEARN,
+})
+# Share of the daily limit that only the interactive classes may use.
+XAI_INTERACTIVE_RESERVE = float(os.getenv('XAI_INTERACTIVE_RESERVE', '0.3'))
+
+# Calls in flight at once across all classes and processes.
+XAI_MAX_IN_FLIGHT = int(os.getenv('XAI_MAX_IN_FLIGHT', '8'))
+# A call slot is given back after this long even if its holder never released it
+# (e.g. the process died mid-call). Covers query_xai_api's retries.
+XAI_SLOT_LEASE_SECONDS = int(os.getenv('XAI_SLOT_LEASE_SECONDS', '900'))
+# A call refused only because too many are in flight waits up to this long for a slot.
+# Quota refusals are never waited on.
+XAI_SLOT_WAIT_SECONDS = float(os.getenv('XAI_SLOT_WAIT_SECONDS', '60'))
+XAI_SLOT_POLL_SECONDS = 0.25
+
+REDIS_KEY_CALLS = 'xai_calls'          # hash per day: "_total", "_batch" and class -> calls
+REDIS_KEY_IN_FLIGHT = 'xai_in_flight'  # zset (and one per class): slot -> lease expiry
+
+# Atomic admission: daily limit, class share, batch classes' combined share, global and
+# class concurrency, then the reservation, in one EVALSHA.
+# KEYS: 1 day's call counts, 2 slots in flight, 3 class slots in flight
+# ARGV: 1 now, 2 lease expiry, 3 slot id, 4 class, 5 daily limit, 6 class daily limit,
+#       7 max in flight, 8 class max in flight, 9 day key TTL, 10 reserve (0 = check only),
+#       11 batch daily limit (-1 for an interactive class)
+# Returns {granted (0/1), reason}
+ADMIT_LUA = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+if tonumber(redis.call('HGET', KEYS[1], '_total') or '0') >= tonumber(ARGV[5]) then
+    return {0, 'daily_limit'}
+end
+if tonumber(redis.call('HGET', KEYS[1], ARGV[4]) or '0') >= tonumber(ARGV[6]) then
+    return {0, 'class_limit'}
+end
+local batch_limit = tonumber(ARGV[11])
+if batch_limit >= 0 and tonumber(redis.call('HGET', KEYS[1], '_batch') or '0') >= batch_limit then
+    return {0, 'batch_limit'}
+end
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[7]) then
+    return {0, 'in_flight'}
+end
+if redis.call('ZCARD', KEYS[3]) >= tonumber(ARGV[8]) then
+    return {0, 'class_in_flight'}
+end
+if ARGV[10] == '1' then
+    redis.call('HINCRBY', KEYS[1], '_total', 1)
+    redis.call('HINCRBY', KEYS[1], ARGV[4], 1)
+    if batch_limit >= 0 then
+        redis.call('HINCRBY', KEYS[1], '_batch', 1)
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[9])
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+    redis.call('ZADD', KEYS[3], ARGV[2], ARGV[3])
+end
+return {1, 'ok'}
+"""
+
 class XaiTokenManager:
     """
-    Manages the daily call quota for the XAI API to prevent rate-limiting and control costs.
+    Manages the daily call quota and concurrency of the XAI API to prevent
+    rate-limiting and control costs.
+
+    Counters live in Redis and are shared by the web process, the Celery workers and
+    beat tasks; every admission is one atomic script, so parallel callers can never
+    overshoot the limits. Counts roll over with the local date. Without Redis, each
+    process falls back to enforcing the same limits on its own calls.
     """
-    def __init__(self, settings_path='settings.json', state_path='xai_token_state.json'):
-        self.state_path = state_path
+    def __init__(self, settings_path='settings.json'):
         self.daily_limit = self._load_daily_limit(settings_path)
-        self.state = self._load_state()
-        self._check_and_reset_daily_count()
+        self._admit_script = None
+        self._exhausted_day = None  # set once the daily limit is hit: no more round trips
+        self._local_lock = threading.Lock()
+        self._local_day = None
+        self._local_calls = {}
+        self._local_in_flight = {}
+
+        redis_url = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+        self.redis_client = redis.Redis.from_url(redis_url, decode_responses=True,
+                                                 socket_timeout=0.5, socket_connect_timeout=0.5)
 
     def _load_daily_limit(self, settings_path):
         """Loads the max_xai_calls_per_day from the main settings.json file."""
@@ -27,49 +153,139 @@ class XaiTokenManager:
             logger.warning(f"Could not load '{settings_path}'. Using default daily limit of 1000.")
             return 1000
 
-    def _load_state(self):
-        """Loads the usage state from a file."""
+    def _limits(self, caller):
+        """(class daily limit, class max in flight, batch daily limit or -1 if interactive)."""
+        share, in_flight = CALLER_LIMITS.get(caller, CALLER_LIMITS[XAI_CLASS_DEFAULT])
+        batch_limit = -1
+        if caller not in XAI_INTERACTIVE_CLASSES:
+            batch_limit = int(self.daily_limit * (1 - XAI_INTERACTIVE_RESERVE))
+        return int(self.daily_limit * share), in_flight, batch_limit
+
+    def _admit(self, caller, slot, reserve):
+        """Runs the admission script. Returns (granted, reason)."""
+        today = str(date.today())
+        if self._exhausted_day == today:
+            return False, 'daily_limit'
+        class_daily_limit, class_in_flight, batch_limit = self._limits(caller)
+        now = time.time()
         try:
-            with open(self.state_path, 'r') as f:
-                state = json.load(f)
-            logger.info(f"Loaded XAI token state: {state}")
-            return state
-        except (FileNotFoundError, json.JSONDecodeError):
-            logger.warning("XAI token state file not found or invalid. Initializing fresh state.")
-            return {'last_reset_date': '1970-01-01', 'calls_today': 0}
+            if self._admit_script is None:
+                self._admit_script = self.redis_client.register_script(ADMIT_LUA)
+            granted, reason = self._admit_script(
+                keys=[f"{REDIS_KEY_CALLS}:{today}", REDIS_KEY_IN_FLIGHT, f"{REDIS_KEY_IN_FLIGHT}:{caller}"],
+                args=[now, now + XAI_SLOT_LEASE_SECONDS, slot, caller, self.daily_limit, class_daily_limit,
+                      XAI_MAX_IN_FLIGHT, class_in_flight, 2 * 86400, int(reserve), batch_limit])
+        except redis.RedisError as e:
+            logger.warning(f"XAI governor could not reach Redis ({e}). Enforcing limits for this process only.")
+            granted, reason = self._admit_local(today, caller, slot, reserve, class_daily_limit, class_in_flight, batch_limit)
+        if isinstance(reason, bytes):
+            reason = reason.decode()
+        if reason == 'daily_limit':
+            self._exhausted_day = today
+        return bool(granted), reason
+
+    def _admit_local(self, today, caller, slot, reserve, class_daily_limit, class_in_flight, batch_limit):
+        with self._local_lock:
+            if self._local_day != today:
+                self._local_day = today
+                self._local_calls = {}
+            callers = list(self._local_in_flight.values())
+            if self._local_calls.get('_total', 0) >= self.daily_limit:
+                return 0, 'daily_limit'
+            if self._local_calls.get(caller, 0) >= class_daily_limit:
+                return 0, 'class_limit'
+            if batch_limit >= 0 and self._local_calls.get('_batch', 0) >= batch_limit:
+                return 0, 'batch_limit'
+            if len(callers) >= XAI_MAX_IN_FLIGHT:
+                return 0, 'in_flight'
+            if callers.count(caller) >= class_in_flight:
+                return 0, 'class_in_flight'
+            if reserve:
+                self._local_calls['_total'] = self._local_calls.get('_total', 0) + 1
+                self._local_calls[caller] = self._local_calls.get(caller, 0) + 1
+                if batch_limit >= 0:
+                    self._local_calls['_batch'] = self._local_calls.get('_batch', 0) + 1
+                self._local_in_flight[slot] = caller
+            return 1, 'ok'
 
-    def _save_state(self):
-        """Saves the current usage state to a file."""
+    def may_call(self, caller=XAI_CLASS_DEFAULT):
+        """
+        Non-blocking check: True if a call by `caller` would be admitted right now.
+        Reserves nothing, so use it to skip building a request, not to make one.
+        """
+        granted, _ = self._admit(caller, '', reserve=False)
+        return granted
+
+    def acquire(self, caller=XAI_CLASS_DEFAULT, wait=None):
+        """
+        Counts one call against the daily limit and takes a concurrency slot for it.
+        Returns the slot id (pass it to release() when the call is done), or None if the
+        call is denied. A call refused only because too many are in flight waits up to
+        `wait` seconds (default XAI_SLOT_WAIT_SECONDS) for a slot; quota refusals return
+        at once.
+        """
+        slot = f"{caller}|{os.getpid()}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + (XAI_SLOT_WAIT_SECONDS if wait is None else wait)
+        while True:
+            granted, reason = self._admit(caller, slot, reserve=True)
+            if granted:
+                return slot
+            if reason not in ('in_flight', 'class_in_flight') or time.monotonic() >= deadline:
+                logger.warning(f"XAI call denied for '{caller}' ({reason}).")
+                return None
+            time.sleep(XAI_SLOT_POLL_SECONDS)
+
+    def release(self, slot):
+        """Gives back the concurrency slot of a finished call. The call stays counted."""
+        if not slot:
+            return
+        caller = slot.split('|', 1)[0]
+        with self._local_lock:
+            if self._local_in_flight.pop(slot, None) is not None:
+                return
+        try:
+            pipe = self.redis_client.pipeline()
+            pipe.zrem(REDIS_KEY_IN_FLIGHT, slot)
+            pipe.zrem(f"{REDIS_KEY_IN_FLIGHT}:{caller}", slot)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Could not release XAI call slot (it expires on its own): {e}")
+
+    @contextmanager
+    def call_slot(self, caller=XAI_CLASS_DEFAULT, wait=None):
+        """
+        `with manager.call_slot(caller) as permitted:` holds a slot for the duration
+        of the block when `permitted` is True (see acquire() for `wait`).
+        """
+        slot = self.acquire(caller, wait=wait)
+        try:
+            yield slot is not None
+        finally:
+            self.release(slot)
+
+    def calls_today(self, caller=None):
+        """Calls counted today, in total or for one class (0 if Redis is unavailable)."""
         try:
-            with open(self.state_path, 'w') as f:
-                json.dump(self.state, f, indent=4)
-        except IOError as e:
-            logger.error(f"Could not save XAI token state to '{self.state_path}': {e}")
-
-    def _check_and_reset_daily_count(self):
-        """Resets the daily call count if the date has changed."""
-        today_str = str(date.today())
-        if self.state.get('last_reset_date') != today_str:
-            logger.info(f"New day detected. Resetting XAI daily call count from {self.state['calls_today']} to 0.")
-            self.state['last_reset_date'] = today_str
-            self.state['calls_today'] = 0
-            self._save_state()
-
-    def request_permission(self):
+            return int(self.redis_client.hget(f"{REDIS_KEY_CALLS}:{date.today()}", caller or '_total') or 0)
+        except redis.RedisError:
+            return 0
+
+    def request_permission(self, caller=XAI_CLASS_DEFAULT):
         """
-        Checks if an XAI API call can be made. If yes, increments the count.
-        Returns True if the call is permitted, False otherwise.
+        Checks if an XAI API call can be made. If yes, counts it (without holding a
+        concurrency slot). Returns True if the call is permitted, False otherwise.
         """
-        self._check_and_reset_daily_count() # Ensure state is fresh before checking
-
-        if self.state['calls_today'] < self.daily_limit:
-            self.state['calls_today'] += 1
-            self._save_state()
-            logger.info(f"XAI call permitted. Usage today: {self.state['calls_today']}/{self.daily_limit}")
-            return True
-        else:
-            logger.warning(
-                f"XAI daily call limit reached ({self.daily_limit}). Call denied. "
-                "No further XAI calls will be made today."
-            )
-            return False
+        slot = self.acquire(caller)
+        self.release(slot)
+        return slot is not None
+
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_xai_token_manager():
+    """Returns the process-wide XAI token manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = XaiTokenManager()
+        return _manager
@@ -25,9 +25,13 @@ monitor_and_restart() {
     WORKER_LOG_FILE="$APP_DIR/celery_worker.log"
     BEAT_LOG_FILE="$APP_DIR/celery_beat.log"
     MONITOR_LOG_FILE="$APP_DIR/celery_monitor.log"
-    WORKER_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app worker --loglevel=INFO --concurrency=2"
+    AVA_WORKER_LOG_FILE="$APP_DIR/celery_ava_worker.log"
+    WORKER_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app worker -Q celery -n main@%h --loglevel=INFO --concurrency=2"
+    # Tooltips, Advice from Ava and Mentor Chat (keepa_deals.ava_jobs). The tasks mostly
+    # wait on xAI, so threads are enough and cost no extra RAM.
+    AVA_WORKER_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app worker -Q ava -n ava@%h --pool=threads --loglevel=INFO --concurrency=4"
     BEAT_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app beat --loglevel=INFO"
-    PURGE_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app purge -f"
+    PURGE_COMMAND="$VENV_PYTHON -m celery -A worker.celery_app purge -f -Q celery,ava"
     ENV_SETUP="set -a && source $APP_DIR/.env && set +a"
 
     # Ensure Redis is running
@@ -58,13 +62,14 @@ monitor_and_restart() {
     bash -c "$ENV_SETUP && $PURGE_COMMAND"
     sudo rm -f "$APP_DIR/celerybeat-schedule"
     sudo rm -f "$APP_DIR/celerybeat.pid" # Ensure stale PID doesn't block startup
-    touch "$WORKER_LOG_FILE" "$BEAT_LOG_FILE" "$APP_DIR/deals.db"
+    touch "$WORKER_LOG_FILE" "$AVA_WORKER_LOG_FILE" "$BEAT_LOG_FILE" "$APP_DIR/deals.db"
     # chown www-data:www-data "$WORKER_LOG_FILE" "$BEAT_LOG_FILE" "$APP_DIR/deals.db"
 
     # Start the daemons using the 'su' command for reliability in this environment
     # The inner 'nohup' is removed as the parent monitor is already nohup'd.
     echo "Starting Celery worker and beat scheduler daemons..." >> "$MONITOR_LOG_FILE"
     bash -c "cd $APP_DIR && $ENV_SETUP && $WORKER_COMMAND >> $WORKER_LOG_FILE 2>&1 &"
+    bash -c "cd $APP_DIR && $ENV_SETUP && $AVA_WORKER_COMMAND >> $AVA_WORKER_LOG_FILE 2>&1 &"
     bash -c "cd $APP_DIR && $ENV_SETUP && $BEAT_COMMAND >> $BEAT_LOG_FILE 2>&1 &"
 
     echo "Services started. Entering monitoring loop..." >> "$MONITOR_LOG_FILE"
@@ -74,11 +79,17 @@ monitor_and_restart() {
         sleep 60
 
         # Check Worker (Strict grep to avoid catching 'tail -f' logs)
-        if ! pgrep -f "celery.*-A.*worker" > /dev/null; then
+        if ! pgrep -f "celery.*-A.*worker.*-Q celery" > /dev/null; then
             echo "$(date): Celery Worker died. Restarting..." >> "$MONITOR_LOG_FILE"
             bash -c "cd $APP_DIR && $ENV_SETUP && $WORKER_COMMAND >> $WORKER_LOG_FILE 2>&1 &"
         fi
 
+        # Check Ava Worker
+        if ! pgrep -f "celery.*-A.*worker.*-Q ava" > /dev/null; then
+            echo "$(date): Celery Ava Worker died. Restarting..." >> "$MONITOR_LOG_FILE"
+            bash -c "cd $APP_DIR && $ENV_SETUP && $AVA_WORKER_COMMAND >> $AVA_WORKER_LOG_FILE 2>&1 &"
+        fi
+
         # Check Beat (Strict grep to avoid catching 'tail -f' logs)
         if ! pgrep -f "celery.*-A.*beat" > /dev/null; then
             echo "$(date): Celery Beat died. Restarting..." >> "$MONITOR_LOG_FILE"
@@ -126,4 +137,5 @@ echo "You can now safely close this terminal. To see the monitor's logs, run:"
 echo "tail -f $MONITOR_LOG_FILE"
 echo "To see worker/beat logs, run:"
 echo "tail -f $(pwd)/celery_worker.log"
+echo "tail -f $(pwd)/celery_ava_worker.log"
 echo "tail -f $(pwd)/celery_beat.log"
@@ -0,0 +1,23 @@
+// Tooltips, Advice from Ava and Mentor Chat are answered by a background worker.
+// Their endpoints reply 202 with a job id; this polls /api/ava-jobs/<job_id> until
+// the answer arrives and resolves to that response, as if the endpoint had waited.
+const AVA_JOB_TIMEOUT_MS = 300000;
+
+async function fetchAvaAnswer(url, options = {}) {
+    let response = await fetch(url, options);
+    if (response.status !== 202) {
+        return response;
+    }
+    const { job_id: jobId } = await response.json();
+    const deadline = Date.now() + AVA_JOB_TIMEOUT_MS;
+    let delay = 500;
+    while (Date.now() < deadline) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        response = await fetch(`/api/ava-jobs/${jobId}`);
+        if (response.status !== 202) {
+            return response;
+        }
+        delay = Math.min(delay * 1.5, 3000);
+    }
+    throw new Error('Timed out waiting for an answer');
+}
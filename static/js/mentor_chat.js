@@ -146,7 +146,7 @@ document.addEventListener('DOMContentLoaded', function() {
         const bubbleText = loadingMsg.querySelector('.chat-bubble');
 
         try {
-            const response = await fetch('/api/mentor-chat', {
+            const response = await fetchAvaAnswer('/api/mentor-chat', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -0,0 +1,57 @@
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.stable_calculations import (
+    ProductAnalysisContext,
+    activate_analysis_context,
+    recent_inferred_sale_price,
+    deal_trust,
+    get_peak_season,
+    get_list_at_price,
+)
+from keepa_deals.new_analytics import get_1yr_avg_sale_price
+
+class TestProductAnalysisContext(unittest.TestCase):
+    def setUp(self):
+        now = datetime.now()
+        self.events = [
+            {'event_timestamp': now, 'inferred_sale_price_cents': 2000},
+            {'event_timestamp': now, 'inferred_sale_price_cents': 2200},
+        ]
+        self.product = {'asin': 'CTXTEST01', 'title': 'Context Test', 'stats': {}}
+
+    def test_inference_runs_once_per_product(self):
+        """All analytics consumers in one context share a single inference pass."""
+        with patch('keepa_deals.stable_calculations.infer_sale_events', return_value=(self.events, 4)) as mock_infer, \
+             patch('keepa_deals.stable_calculations._query_xai_for_reasonableness', return_value=True):
+            context = ProductAnalysisContext(self.product)
+            with activate_analysis_context(context):
+                self.assertEqual(recent_inferred_sale_price(self.product), {'Recent Inferred Sale Price': '$22.00'})
+                self.assertEqual(deal_trust(self.product), {'Deal Trust': '50%'})
+                self.assertEqual(get_1yr_avg_sale_price(self.product), {'1yr. Avg.': 21.0})
+                get_peak_season(self.product)
+                get_list_at_price(self.product)
+                self.assertIs(context.analysis, context.analysis)
+
+            self.assertEqual(mock_infer.call_count, 1)
+
+    def test_context_is_not_shared_with_other_products(self):
+        """A different product object never reads another product's cached events."""
+        other = {'asin': 'CTXTEST02'}
+        with patch('keepa_deals.stable_calculations.infer_sale_events', return_value=(self.events, 4)) as mock_infer:
+            with activate_analysis_context(ProductAnalysisContext(self.product)):
+                recent_inferred_sale_price(self.product)
+                recent_inferred_sale_price(other)
+            # Outside any context every call computes its own inference.
+            recent_inferred_sale_price(self.product)
+
+            self.assertEqual(mock_infer.call_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os
+import sys
+import time
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from wsgi_handler import app
+from keepa_deals import ava_jobs
+
+try:
+    import fakeredis
+    HAS_FAKEREDIS = True
+except ImportError:
+    HAS_FAKEREDIS = False
+
+@unittest.skipUnless(HAS_FAKEREDIS, "fakeredis not installed")
+class TestAvaJobs(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.sent = []  # args of the queued run_ava_job tasks
+        for patcher in (patch.object(ava_jobs, '_redis_client', self.redis),
+                        patch.object(ava_jobs.celery, 'send_task',
+                                     side_effect=lambda name, args: self.sent.append(args)),
+                        patch.object(ava_jobs, 'generate_mentor_reply',
+                                     side_effect=lambda message, mentor: {'reply': f'{mentor}: {message}'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _client(self, username='tim'):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+            sess['username'] = username
+        return client
+
+    def _ask(self, client, message='Hi'):
+        return client.post('/api/mentor-chat', json={'message': message, 'mentor': 'joel'})
+
+    def test_questions_are_queued_and_answered_through_polling(self):
+        client = self._client()
+        response = self._ask(client)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.get_json()['job_id']
+        self.assertEqual(self.sent, [[job_id, ava_jobs.JOB_MENTOR_CHAT, 'tim', {'message': 'Hi', 'mentor': 'joel'}]])
+
+        response = client.get(f'/api/ava-jobs/{job_id}')
+        self.assertEqual((response.status_code, response.get_json()), (202, {'status': 'queued'}))
+
+        ava_jobs.run_ava_job(*self.sent[0])
+        response = client.get(f'/api/ava-jobs/{job_id}')
+        self.assertEqual((response.status_code, response.get_json()), (200, {'reply': 'joel: Hi'}))
+        # Only the asker may read the answer
+        self.assertEqual(self._client('someone').get(f'/api/ava-jobs/{job_id}').status_code, 404)
+
+    def test_in_flight_jobs_are_limited_per_user(self):
+        client = self._client()
+        for _ in range(ava_jobs.AVA_MAX_JOBS_PER_USER):
+            self.assertEqual(self._ask(client).status_code, 202)
+        self.assertEqual(self._ask(client).status_code, 429)
+        self.assertEqual(self._ask(self._client('someone')).status_code, 202)
+
+        # A finished job frees its slot, as does one whose worker died once its lease is up
+        ava_jobs.run_ava_job(*self.sent[0])
+        self.assertEqual(self._ask(client).status_code, 202)
+        self.assertEqual(self._ask(client).status_code, 429)
+        later = time.time() + ava_jobs.AVA_JOB_LEASE_SECONDS + 1
+        with patch.object(ava_jobs.time, 'time', return_value=later):
+            self.assertEqual(self._ask(client).status_code, 202)
+
+    def test_failures_are_reported_to_the_poller(self):
+        client = self._client()
+        job_id = self._ask(client).get_json()['job_id']
+        with patch.object(ava_jobs, 'generate_mentor_reply', side_effect=RuntimeError('boom')):
+            ava_jobs.run_ava_job(*self.sent[0])
+
+        response = client.get(f'/api/ava-jobs/{job_id}')
+        self.assertEqual((response.status_code, response.get_json()), (500, {'error': 'boom'}))
+        self.assertEqual(self.redis.zcard('ava_jobs_in_flight:tim'), 0)
+
+    def test_answers_inline_without_a_queue(self):
+        client = self._client()
+        with patch.object(ava_jobs.celery, 'send_task', side_effect=redis.ConnectionError('down')):
+            response = self._ask(client)
+        self.assertEqual((response.status_code, response.get_json()), (200, {'reply': 'joel: Hi'}))
+        self.assertEqual(self.redis.zcard('ava_jobs_in_flight:tim'), 0)
+
+        # Cached tooltips need no job at all
+        with patch('wsgi_handler.load_tooltip_cache', return_value={'Profit': 'Estimated profit'}):
+            response = client.get('/api/tooltip/Profit')
+        self.assertEqual((response.status_code, response.get_json()), (200, {'tooltip': 'Estimated profit'}))
+        self.assertEqual(self.sent, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,7 +8,7 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from wsgi_handler import app
-from keepa_deals.db_utils import get_db_connection
+from keepa_deals.db_utils import get_db_connection, ensure_numeric_shadow_columns
 
 # Create a temporary DB
 TEST_DB = 'test_deals.db'
@@ -76,6 +76,9 @@ class TestApiFiltering(unittest.TestCase):
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, deals)
 
+        # Migration adds and backfills the numeric shadow columns the filters use
+        ensure_numeric_shadow_columns(cursor)
+
         conn.commit()
         conn.close()
 
@@ -110,5 +113,32 @@ class TestApiFiltering(unittest.TestCase):
             self.assertNotIn('BAD006', asins, "Zero string Avg should be filtered")
             self.assertNotIn('BAD007', asins, "Zero number string Avg should be filtered")
 
+    def test_columnar_projection_matches_full_rows(self):
+        import gzip
+        import wsgi_handler
+        from unittest.mock import patch
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+
+            full = client.get('/api/deals').get_json()['deals']
+            with patch.object(wsgi_handler, 'RESPONSE_COMPRESS_MIN_BYTES', 0):
+                response = client.get('/api/deals?columns=dashboard&format=columnar',
+                                      headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+            data = json.loads(gzip.decompress(response.data))
+
+            self.assertNotIn('deals', data)
+            self.assertIn('Title', data['columns'])
+            # Columns outside the set (and missing from the table) are not sent
+            self.assertNotIn('Profit_Confidence', data['columns'])
+            self.assertNotIn('Drops', data['columns'])
+            rows = [dict(zip(data['columns'], row)) for row in data['rows']]
+            self.assertEqual(rows, [{c: deal[c] for c in data['columns']} for deal in full])
+
+            response = client.get('/api/deals?columns=everything')
+            self.assertEqual(response.status_code, 400)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keepa_deals import db_utils
+from keepa_deals.db_utils import get_db_connection
+
+class TestDbConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.addCleanup(db_utils.close_db_connections)
+        self.db_path = os.path.join(self.tmpdir, 'deals.db')
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('CREATE TABLE t (v INTEGER)')
+
+    def test_connections_are_reused_with_their_pragmas(self):
+        with get_db_connection(self.db_path) as conn:
+            first = conn
+        second = get_db_connection(self.db_path)
+        self.assertIs(second, first)
+        self.assertEqual(second.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(second.execute('PRAGMA cache_size').fetchone()[0], -db_utils.SQLITE_CACHE_SIZE_KB)
+        self.assertEqual(second.execute('PRAGMA recursive_triggers').fetchone()[0], 1)
+
+        # Nested checkouts on one thread never share a connection
+        nested = get_db_connection(self.db_path)
+        self.assertIsNot(nested, second)
+        nested.close()
+        second.close()
+
+    def test_release_resets_caller_state(self):
+        conn = get_db_connection(self.db_path)
+        conn.row_factory = sqlite3.Row
+        conn.set_trace_callback(lambda sql: None)
+        conn.execute('INSERT INTO t VALUES (1)')
+        conn.close()
+        conn.close()  # a second close is harmless
+
+        conn = get_db_connection(self.db_path)
+        self.assertIsNone(conn.row_factory)
+        # Uncommitted work is discarded, as closing a plain connection would
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone(), (0,))
+        conn.close()
+
+    def test_threads_and_forked_processes_get_their_own_connections(self):
+        with get_db_connection(self.db_path) as conn:
+            mine = conn
+
+        theirs = []
+        def worker():
+            with get_db_connection(self.db_path) as conn:
+                theirs.append(conn)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertIsNot(theirs[0], mine)
+
+        with patch.object(db_utils.os, 'getpid', return_value=os.getpid() + 1):
+            child = get_db_connection(self.db_path)
+            self.assertIsNot(child, mine)
+            child.close()
+        self.assertIn(mine, db_utils._inherited_connections)
+
+    def test_recreated_database_file_is_not_served_by_a_stale_connection(self):
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('INSERT INTO t VALUES (1)')
+            stale = conn
+        os.rename(self.db_path, self.db_path + '.old')
+        with sqlite3.connect(self.db_path) as fresh:
+            fresh.execute('CREATE TABLE t (v INTEGER)')
+        fresh.close()
+
+        conn = get_db_connection(self.db_path)
+        self.assertIsNot(conn, stale)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM t').fetchone(), (0,))
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
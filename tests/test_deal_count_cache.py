@@ -0,0 +1,104 @@
+import unittest
+import os
+import sys
+import shutil
+import tempfile
+from datetime import datetime, timezone, timedelta
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wsgi_handler
+from wsgi_handler import app
+from keepa_deals import data_version, db_utils, janitor
+from keepa_deals.db_utils import get_db_connection
+
+try:
+    import fakeredis
+    HAS_FAKEREDIS = True
+except ImportError:
+    HAS_FAKEREDIS = False
+
+@unittest.skipUnless(HAS_FAKEREDIS, "fakeredis not installed")
+class TestDealCountCache(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = patch.object(data_version, '_redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        data_version.clear_count_cache()
+        self.addCleanup(data_version.clear_count_cache)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.db_path = os.path.join(self.tmpdir, 'deals.db')
+        for module in (wsgi_handler, janitor, db_utils):
+            patcher = patch.object(module, 'DB_PATH', self.db_path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        db_utils.recreate_deals_table()
+
+        self.statements = []
+        def traced_connection(db_path=None, timeout=5.0):
+            conn = get_db_connection(self.db_path, timeout)
+            conn.set_trace_callback(self.statements.append)
+            return conn
+        patcher = patch.object(wsgi_handler, 'get_db_connection', side_effect=traced_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _insert(self, asin, last_seen):
+        columns, rows = db_utils.with_numeric_shadows(
+            ['ASIN', 'Profit', 'List_at', '1yr_Avg', 'last_seen_utc'], [(asin, 10.0, 30.0, '$25.00', last_seen)])
+        cols_str = ', '.join(f'"{c}"' for c in columns)
+        vals_str = ', '.join(['?'] * len(columns))
+        with get_db_connection(self.db_path) as conn:
+            conn.execute(f"INSERT INTO deals ({cols_str}) VALUES ({vals_str})", rows[0])
+            conn.commit()
+
+    def _count(self, client, query=''):
+        response = client.get(f'/api/deal-count?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()['count']
+
+    def test_unchanged_table_is_answered_from_cache(self):
+        now = datetime.now(timezone.utc)
+        self._insert('A1', now.isoformat())
+        self._insert('A2', (now - timedelta(days=10)).isoformat())
+        data_version.bump_data_version()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+            self.assertEqual(self._count(client), 2)
+            self.statements.clear()
+            self.assertEqual(self._count(client), 2)
+            self.assertEqual(self.statements, [], "cache hit must not touch SQLite")
+            # Other filter values are cached separately
+            self.assertEqual(self._count(client, 'profit_gte=20'), 0)
+
+            # A writer bumps the version: the next poll recomputes
+            self.assertEqual(janitor._clean_stale_deals_logic(grace_period_hours=72), 1)
+            self.assertEqual(self._count(client), 1)
+
+            response = client.get('/api/deals')
+            self.assertEqual(response.get_json()['pagination']['total_db_records'], 1)
+
+    def test_without_redis_every_call_computes(self):
+        calls = []
+        with patch.object(data_version, 'data_version', return_value=None):
+            for _ in range(2):
+                data_version.cached_count('k', lambda: calls.append(1) or len(calls))
+        self.assertEqual(len(calls), 2)
+
+    def test_entries_expire_after_the_ttl(self):
+        calls = []
+        compute = lambda: calls.append(1) or len(calls)
+        with patch.object(data_version.time, 'monotonic', side_effect=[0, 10, data_version.DEAL_COUNT_CACHE_TTL_SECONDS + 1]):
+            self.assertEqual(data_version.cached_count('k', compute), 1)
+            self.assertEqual(data_version.cached_count('k', compute), 1)
+            self.assertEqual(data_version.cached_count('k', compute), 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import json
+import os
+import sys
+import threading
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wsgi_handler
+from wsgi_handler import app
+from keepa_deals import data_version
+
+try:
+    import fakeredis
+    HAS_FAKEREDIS = True
+except ImportError:
+    HAS_FAKEREDIS = False
+
+def _parse_sse(chunks):
+    """[(event, data)] from raw SSE chunks (comments and retry lines skipped)."""
+    events = []
+    for chunk in chunks:
+        chunk = chunk.decode('utf-8')
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if ': ' in line and not line.startswith(':'))
+        if 'event' in fields:
+            events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+@unittest.skipUnless(HAS_FAKEREDIS, "fakeredis not installed")
+class TestDealEvents(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = patch.object(data_version, '_redis_client', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _client(self):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        return client
+
+    def test_writes_are_published_with_the_new_version(self):
+        pubsub = data_version.subscribe_events()
+        self.addCleanup(pubsub.close)
+
+        version = data_version.bump_data_version('ingestor', asins=['A1', None, 'A2'])
+        # The first read consumes the (ignored) subscribe confirmation
+        message = pubsub.get_message(timeout=1) or pubsub.get_message(timeout=1)
+        self.assertEqual(json.loads(message['data']),
+                         {'event': 'deals', 'version': version, 'source': 'ingestor', 'count': 2, 'asins': ['A1', 'A2']})
+
+    def test_stream_relays_events_and_frees_its_slot(self):
+        data_version.bump_data_version('janitor', count=3)
+        response = self._client().get('/api/events', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+
+        data_version.publish_event('recalc', {'status': 'Running', 'processed_deals': 50})
+        chunks = response.response
+        # retry, hello, keepalive for the subscribe confirmation, recalc
+        events = _parse_sse([next(chunks) for _ in range(4)])
+        response.close()
+
+        self.assertEqual(events, [('hello', {'version': 1}), ('recalc', {'status': 'Running', 'processed_deals': 50})])
+        self.assertEqual(self.redis.pubsub_numsub(data_version.EVENTS_CHANNEL)[0][1], 0)
+        self.assertTrue(wsgi_handler._sse_slots.acquire(blocking=False))
+        wsgi_handler._sse_slots.release()
+
+    def test_streams_beyond_the_limit_are_refused(self):
+        with patch.object(wsgi_handler, '_sse_slots', threading.BoundedSemaphore(1)):
+            first = self._client().get('/api/events', buffered=False)
+            second = self._client().get('/api/events', buffered=False)
+            self.assertEqual(second.status_code, 503)
+            first.close()
+            third = self._client().get('/api/events', buffered=False)
+            self.assertEqual(third.status_code, 200)
+            third.close()
+
+    def test_requires_login(self):
+        self.assertEqual(app.test_client().get('/api/events').status_code, 401)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+import sqlite3
+import sys
+import os
+import tempfile
+import shutil
+
+from werkzeug.datastructures import MultiDict
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals import deal_filters, db_utils
+
+class TestDealFilters(unittest.TestCase):
+    def setUp(self):
+        deal_filters.clear_caches()
+
+    def test_equivalent_args_share_one_canonical_filter_dict(self):
+        a = deal_filters.parse_filters(MultiDict({
+            'excluded_conditions': 'U-Good,New,Bogus', 'roi_gte': '0', 'profit_gte': 'abc', 'keyword': '',
+            'hide_amz': '1', 'hide_gated': '0', 'agents_choice': 'false',
+        }))
+        b = deal_filters.parse_filters(MultiDict({'hide_amz': '1', 'excluded_conditions': 'New,U-Good'}))
+        self.assertEqual(a, b)
+        self.assertEqual(a, {'hide_amz': True, 'excluded_conditions': ('New', 'U-Good')})
+        # 0 is a real bound for the sales rank filter
+        self.assertEqual(deal_filters.parse_filters(MultiDict({'sales_rank_current_lte': '0'})),
+                         {'sales_rank_current_lte': 0})
+
+    def test_statements_are_compiled_once_per_shape(self):
+        sql_a, params_a = deal_filters.count_query({'deal_trust_gte': 60, 'keyword': 'lego'})
+        sql_b, params_b = deal_filters.count_query({'deal_trust_gte': 75, 'keyword': 'duplo'})
+
+        self.assertIs(sql_a, sql_b)
+        self.assertEqual(deal_filters._compile_count.cache_info().hits, 1)
+        self.assertEqual(params_a, ['%lego%'] * 6 + [60])
+        self.assertEqual(params_b, ['%duplo%'] * 6 + [75])
+
+    def test_count_and_page_share_the_where_clause(self):
+        filters = {'profit_gte': 15.0, 'seller_trust_gte': 8, 'hide_gated': True}
+        where_sql, _ = deal_filters.where_clause(filters, restrictions_joined=True)
+        count_sql, count_params = deal_filters.count_query(filters, user_id='user-1')
+        page_sql, page_params = deal_filters.page_query(filters, 'deals."id"', 'asc', 'user-1')
+
+        for sql in (count_sql, page_sql):
+            self.assertIn(where_sql, sql)
+        self.assertEqual(count_params, ['user-1', 7.5 / 10.0, 15.0])
+        self.assertEqual(page_params, count_params)
+        self.assertNotIn('"Profit_num" > 0', where_sql)
+
+        # Without a connected user, hide_gated is ignored (no 'ur' alias to filter on)
+        count_sql, count_params = deal_filters.count_query(filters)
+        self.assertNotIn('ur.', count_sql)
+        self.assertEqual(count_params, [0.75, 15.0])
+
+    def test_filters_match_the_expected_rows(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE deals (id INTEGER PRIMARY KEY, ASIN TEXT, Title TEXT, Condition TEXT, AMZ TEXT, '
+                     'Profit_num REAL, List_at_num REAL, "1yr_Avg_num" REAL, All_in_Cost_num REAL)')
+        conn.executemany('INSERT INTO deals (ASIN, Title, Condition, AMZ, Profit_num, List_at_num, "1yr_Avg_num", All_in_Cost_num) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+                             ('A1', 'Lego Set', 'New', None, 20.0, 50.0, 45.0, 10.0),
+                             ('A2', 'Lego Set', '2', '⚠️', 20.0, 50.0, 45.0, 10.0),
+                             ('A3', 'Lego Set', '2', None, -5.0, 50.0, 45.0, 10.0),
+                             ('A4', 'Novel', '2', None, 20.0, 50.0, None, 10.0),
+                             ('A5', 'Lego Book', '2', None, 20.0, 50.0, 45.0, 10.0),
+                         ])
+        filters = deal_filters.parse_filters(MultiDict({'keyword': 'Lego', 'excluded_conditions': 'New', 'hide_amz': '1'}))
+        sql, params = deal_filters.count_query(filters)
+        self.assertEqual(conn.execute(sql, params).fetchone(), (1, 5))
+        conn.close()
+
+    def _walk(self, conn, sort_by, order, page_size=3, between_pages=None):
+        columns = deal_filters.deal_columns(conn, ':memory:')
+        sort_sql = deal_filters.sort_clause(sort_by, columns)
+        seen, after = [], None
+        while True:
+            rows = []
+            for sql, params in deal_filters.keyset_page_queries({}, sort_sql, order, after=after):
+                rows += conn.execute(sql, params + [page_size + 1 - len(rows)]).fetchall()
+            seen.extend(row[1] for row in rows[:page_size])
+            if len(rows) <= page_size:
+                return seen
+            token = deal_filters.encode_cursor(sort_by, order, rows[page_size - 1][-1], rows[page_size - 1][1])
+            after = deal_filters.decode_cursor(token, sort_by, order)
+            if between_pages:
+                between_pages()
+
+    def test_keyset_pages_cover_every_row_once_for_each_sort(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE deals (id INTEGER PRIMARY KEY, ASIN TEXT UNIQUE, Title TEXT, '
+                     'Profit_num REAL, List_at_num REAL, "1yr_Avg_num" REAL, All_in_Cost_num REAL)')
+        rows = [(f'A{i:02d}', f'T{i % 4}', float(i % 3 + 1), 50.0, 40.0, None if i % 5 == 0 else float(i % 4 + 1))
+                for i in range(20)]
+        conn.executemany('INSERT INTO deals (ASIN, Title, Profit_num, List_at_num, "1yr_Avg_num", All_in_Cost_num) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+        for sort_by in ('id', 'Profit', 'Title', 'ROI', 'All_in_Cost_num', 'unknown'):
+            for order in ('asc', 'desc'):
+                columns = deal_filters.deal_columns(conn, ':memory:')
+                sort_sql = deal_filters.sort_clause(sort_by, columns)
+                expected = [r[0] for r in conn.execute(
+                    f'SELECT ASIN FROM deals ORDER BY {sort_sql} {order}, ASIN {order}')]
+                self.assertEqual(self._walk(conn, sort_by, order), expected, (sort_by, order))
+
+        # Rows inserted while paging never shift the remaining pages
+        inserted = iter(range(100, 200))
+        def insert_low_profit():
+            conn.execute('INSERT INTO deals (ASIN, Profit_num, List_at_num, "1yr_Avg_num") VALUES (?, 0.5, 50, 40)',
+                         (f'Z{next(inserted)}',))
+        walked = self._walk(conn, 'Profit', 'desc', between_pages=insert_low_profit)
+        self.assertEqual(len(walked), len(set(walked)))
+        self.assertEqual(walked[:20], [r[0] for r in conn.execute(
+            'SELECT ASIN FROM deals WHERE Profit_num >= 1 ORDER BY Profit_num DESC, ASIN DESC')])
+        conn.close()
+
+    def test_cursor_is_bound_to_its_sort(self):
+        token = deal_filters.encode_cursor('Profit', 'desc', 12.5, 'B000001')
+        self.assertEqual(deal_filters.decode_cursor(token, 'Profit', 'desc'), (12.5, 'B000001'))
+        with self.assertRaises(ValueError):
+            deal_filters.decode_cursor(token, 'Profit', 'asc')
+        with self.assertRaises(ValueError):
+            deal_filters.decode_cursor('not-a-cursor', 'Profit', 'desc')
+
+    def test_keyword_index_matches_the_substring_filter(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute('PRAGMA recursive_triggers=ON')
+        cols = ', '.join(f'"{c}" TEXT' for c in deal_filters.KEYWORD_COLUMNS)
+        conn.execute(f'CREATE TABLE deals (id INTEGER PRIMARY KEY AUTOINCREMENT, ASIN TEXT UNIQUE, {cols}, '
+                     'Profit_num REAL, List_at_num REAL, "1yr_Avg_num" REAL)')
+        corpus = [
+            ('The LEGO Movie: Official Guide', 'Children\'s Books', 'Year-round', 'DK', 'Hugo, Simon', 'BookSeller'),
+            ('Star Wars Lego Visual Dictionary', 'Toys', 'Christmas', None, 'Dowsett, Elizabeth', None),
+            ('Chemistry: The Central Science', 'Textbooks', 'Back to School', 'Pearson', 'Brown', 'Campus Books'),
+            ('Organic Chemistry "Study Guide"', 'Textbooks', 'Back to School', 'Wiley', 'Klein', 'Textbook Co'),
+            ('Café Cookbook', 'Cooking', None, 'Phaidon', 'Müller', 'Kitchen Reads'),
+            ('Knitting 101', 'Crafts', 'Winter', 'Storey', None, 'Yarn Barn'),
+        ]
+        insert = (f'INSERT INTO deals (ASIN, {", ".join(deal_filters.KEYWORD_COLUMNS)}, Profit_num, List_at_num, "1yr_Avg_num") '
+                  'VALUES (?, ?, ?, ?, ?, ?, ?, 5, 20, 20)')
+        # Half the rows are backfilled by the migration, half indexed by the insert trigger
+        conn.executemany(insert, [(f'A{i}',) + row for i, row in enumerate(corpus[:3])])
+        db_utils.ensure_keyword_search_index(conn.cursor())
+        conn.executemany(insert, [(f'A{i}',) + row for i, row in enumerate(corpus[3:], start=3)])
+        # Replaced and updated rows leave no stale index entries
+        conn.execute(insert.replace('INSERT', 'INSERT OR REPLACE'), ('A5',) + corpus[5])
+        conn.execute('UPDATE deals SET Title = ? WHERE ASIN = ?', ('LEGO Technic Ideas', 'A1'))
+
+        keywords = ['lego', 'LEGO', 'ego Tech', 'chemistry', 'study guide"', '"Study', 'back to', 'Books',
+                    'Year-round', 'hugo, s', 'Café', 'ller', 'Barn', '101', 'missing', 'go', 'K']
+        for keyword in keywords:
+            filters = {'keyword': keyword}
+            like_sql, like_params = deal_filters.where_clause(filters)
+            fts_sql, fts_params = deal_filters.where_clause(filters, keyword_index=True)
+            if len(keyword) >= 3:
+                self.assertIn('deals_fts', fts_sql)
+            expected = conn.execute(f'SELECT ASIN FROM deals{like_sql} ORDER BY ASIN', like_params).fetchall()
+            self.assertEqual(conn.execute(f'SELECT ASIN FROM deals{fts_sql} ORDER BY ASIN', fts_params).fetchall(),
+                             expected, keyword)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM deals_fts').fetchone()[0], len(corpus))
+        conn.close()
+
+    def test_column_metadata_is_cached_until_the_schema_changes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        db_path = os.path.join(tmpdir, 'deals.db')
+        conn = sqlite3.connect(db_path)
+        self.assertEqual(deal_filters.deal_columns(conn, db_path), frozenset())
+
+        conn.execute('CREATE TABLE deals (id INTEGER PRIMARY KEY, ASIN TEXT)')
+        self.assertEqual(deal_filters.deal_columns(conn, db_path), {'id', 'ASIN'})
+
+        statements = []
+        conn.set_trace_callback(statements.append)
+        deal_filters.deal_columns(conn, db_path)
+        self.assertEqual(statements, ['PRAGMA schema_version'])
+
+        conn.execute('ALTER TABLE deals ADD COLUMN Profit_num REAL')
+        self.assertIn('Profit_num', deal_filters.deal_columns(conn, db_path))
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
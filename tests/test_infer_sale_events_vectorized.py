@@ -0,0 +1,90 @@
+import unittest
+import sys
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.stable_calculations import infer_sale_events, _nearest_values, KEEPA_EPOCH
+
+def _recent_minutes(days_ago):
+    return int((datetime.now() - KEEPA_EPOCH).total_seconds() / 60) - days_ago * 1440
+
+def _product(rank, used_offers, used_price, new_offers=None, new_price=None):
+    csv = [None] * 13
+    csv[1] = new_price
+    csv[2] = used_price
+    csv[3] = rank
+    csv[11] = new_offers
+    csv[12] = used_offers
+    return {'asin': 'VECTEST', 'csv': csv}
+
+class TestNearestValues(unittest.TestCase):
+    def test_matches_merge_asof_nearest(self):
+        """Ties and duplicate exact matches resolve exactly like merge_asof(direction='nearest')."""
+        times = np.array([0, 10, 10, 20, 40])
+        values = np.array([1, 2, 3, 4, 5])
+        queries = np.array([-5, 0, 5, 10, 15, 30, 41, 100])
+
+        right = pd.DataFrame({'t': times, 'v': values})
+        expected = pd.merge_asof(pd.DataFrame({'t': queries}), right, on='t', direction='nearest')['v'].tolist()
+
+        self.assertEqual(_nearest_values(times, values, queries).tolist(), expected)
+
+class TestVectorizedInference(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('keepa_deals.stable_calculations.infer_sales_with_xai', return_value=[])
+        self.mock_xai = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rank_drop_inside_and_outside_window(self):
+        t0 = _recent_minutes(100)
+        # Offer drop at t0+60; rank drops 5 days later (inside 240h window).
+        # Second offer drop at t0+30d; the rank goes UP 20 days later (so the sparse
+        # fallback must not fire) and only drops again 25 days later, outside the window.
+        rank = [t0, 500000, t0 + 60 + 5 * 1440, 100000,
+                t0 + 30 * 1440, 200000, t0 + 50 * 1440, 300000, t0 + 55 * 1440, 250000]
+        used_offers = [t0, 5, t0 + 60, 4, t0 + 30 * 1440 + 60, 3]
+        used_price = [t0, 2500, t0 + 30 * 1440, 3000]
+
+        sales, drop_count = infer_sale_events(_product(rank, used_offers, used_price))
+
+        self.assertEqual(drop_count, 2)
+        self.assertEqual(len(sales), 1)
+        self.assertEqual(sales[0]['inferred_sale_price_cents'], 2500)
+        self.assertEqual(sales[0]['event_timestamp'], pd.to_datetime(t0 + 60, unit='m', origin=KEEPA_EPOCH))
+        self.mock_xai.assert_not_called()
+
+    def test_sparse_fallback_uses_first_rank_within_30_days(self):
+        t0 = _recent_minutes(100)
+        # No rank rows inside the 240h window, but the next rank (20 days later) is better
+        # than the last rank before the offer drop.
+        rank = [t0, 400000, t0 + 20 * 1440, 90000]
+        used_offers = [t0 + 60, 6, t0 + 120, 5]
+        used_price = [t0, 1800]
+
+        sales, drop_count = infer_sale_events(_product(rank, used_offers, used_price))
+
+        self.assertEqual(drop_count, 1)
+        self.assertEqual([s['inferred_sale_price_cents'] for s in sales], [1800])
+
+    def test_new_offer_drop_prefers_new_price_history(self):
+        t0 = _recent_minutes(100)
+        rank = [t0, 500000, t0 + 1440, 100000]
+        new_offers = [t0, 3, t0 + 1440, 2]
+        used_offers = [t0, 3, t0 + 5, 3]
+        new_price = [t0, 9900]
+        used_price = [t0, 1500]
+
+        sales, drop_count = infer_sale_events(_product(rank, used_offers, used_price, new_offers, new_price))
+
+        self.assertEqual(drop_count, 1)
+        self.assertEqual([s['inferred_sale_price_cents'] for s in sales], [9900])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest.mock import patch, MagicMock
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.keepa_cache import KeepaProductCache, KeepaSellerCache
+from keepa_deals import keepa_api
+from keepa_deals.seller_info import prefetch_seller_info
+
+class TestKeepaProductCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = KeepaProductCache(db_path=os.path.join(self.tmpdir.name, 'cache.db'),
+                                       max_entries=3, ttl_history=3600, ttl_stats=600)
+
+    def test_ttl_per_query_shape(self):
+        self.cache.put_many([{'asin': 'A1', 'csv': [1]}], days=365, offers=20, history=1, now=1000)
+        self.cache.put_many([{'asin': 'A2'}], days=365, offers=20, history=0, now=1000)
+
+        # 20 minutes later: the stats row is expired, the history row is not.
+        self.assertEqual(set(self.cache.get_many(['A1', 'A2'], 365, 20, history=1, now=2200)), {'A1'})
+        self.assertEqual(set(self.cache.get_many(['A2'], 365, 20, history=0, now=2200)), set())
+
+    def test_history_row_serves_stats_lookup_but_not_reverse(self):
+        self.cache.put_many([{'asin': 'A1', 'csv': [1]}], days=365, offers=20, history=1, now=1000)
+        self.cache.put_many([{'asin': 'A2'}], days=365, offers=20, history=0, now=1000)
+
+        self.assertEqual(self.cache.get_many(['A1'], 365, 20, history=0, now=1100)['A1']['csv'], [1])
+        self.assertEqual(self.cache.get_many(['A2'], 365, 20, history=1, now=1100), {})
+        # A different stats window is a different shape.
+        self.assertEqual(self.cache.get_many(['A1'], 180, 20, history=0, now=1100), {})
+
+    def test_lru_eviction_bounds_size(self):
+        self.cache.put_many([{'asin': 'A1'}, {'asin': 'A2'}, {'asin': 'A3'}], 180, 20, now=1000)
+        self.cache.get_many(['A1'], 180, 20, now=1010)
+        self.cache.put_many([{'asin': 'A4'}], 180, 20, now=1020)
+
+        self.assertEqual(set(self.cache.get_many(['A1', 'A2', 'A3', 'A4'], 180, 20, now=1030)), {'A1', 'A3', 'A4'})
+
+    def test_invalidate_updated(self):
+        self.cache.put_many([{'asin': 'A1', 'lastUpdate': 500}, {'asin': 'A2', 'lastUpdate': 900}], 180, 20, now=1000)
+        self.cache.invalidate_updated({'A1': 600, 'A2': 600})
+
+        self.assertEqual(set(self.cache.get_many(['A1', 'A2'], 180, 20, now=1010)), {'A2'})
+
+class TestFetchUsesCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        cache = KeepaProductCache(db_path=os.path.join(self.tmpdir.name, 'cache.db'))
+        patcher = patch('keepa_deals.keepa_api.get_keepa_cache', return_value=cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def _response(asins):
+        response = MagicMock()
+        response.json.return_value = {'products': [{'asin': a} for a in asins], 'tokensConsumed': len(asins), 'tokensLeft': 50}
+        return response
+
+    @patch('keepa_deals.keepa_api._session.get')
+    def test_only_missing_asins_are_requested(self, mock_get):
+        mock_get.side_effect = lambda url, **kwargs: self._response(url.split('asin=')[1].split('&')[0].split(','))
+
+        keepa_api.fetch_product_batch('key', ['ASIN000001', 'ASIN000002'], history=1)
+        data, api_info, consumed, tokens_left = keepa_api.fetch_product_batch('key', ['ASIN000003', 'ASIN000001'], history=1)
+
+        self.assertIn('asin=ASIN000003&', mock_get.call_args[0][0])
+        self.assertEqual([p['asin'] for p in data['products']], ['ASIN000003', 'ASIN000001'])
+        self.assertEqual(consumed, 1)
+
+        # A history=1 response also serves a later history=0 request without a call.
+        data, api_info, consumed, tokens_left = keepa_api.fetch_product_batch('key', ['ASIN000001'], history=0)
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(data['products'][0]['asin'], 'ASIN000001')
+        self.assertIsNone(api_info['error_status_code'])
+        self.assertIsNone(tokens_left)
+
+    @patch('keepa_deals.keepa_api._session.get')
+    def test_fetch_uses_the_split_the_reservation_was_sized_from(self, mock_get):
+        mock_get.side_effect = lambda url, **kwargs: self._response(url.split('asin=')[1].split('&')[0].split(','))
+        keepa_api.fetch_current_stats_batch('key', ['ASIN000001'])
+
+        cached, to_fetch = keepa_api.split_cached(['ASIN000001', 'ASIN000002'], days=180, offers=20)
+        self.assertEqual(to_fetch, ['ASIN000002'])
+        # The entry expires before the fetch: it must not be requested unreserved
+        keepa_api.get_keepa_cache().invalidate_updated({'ASIN000001': 10 ** 9})
+        data, _, consumed, _ = keepa_api.fetch_current_stats_batch('key', ['ASIN000001', 'ASIN000002'], cached=cached)
+
+        self.assertIn('asin=ASIN000002&', mock_get.call_args[0][0])
+        self.assertEqual(consumed, len(to_fetch))
+        self.assertEqual([p['asin'] for p in data['products']], ['ASIN000001', 'ASIN000002'])
+
+class TestSellerCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.cache = KeepaSellerCache(db_path=os.path.join(self.tmpdir.name, 'cache.db'), ttl=100, miss_ttl=10)
+
+    def test_per_seller_ttl_and_negative_entries(self):
+        self.cache.put_many({'S1': {'sellerName': 'One'}}, requested_ids=['S1', 'S2'], now=1000)
+
+        self.assertEqual(self.cache.get_many(['S1', 'S2'], now=1005), {'S1': {'sellerName': 'One'}, 'S2': None})
+        self.assertEqual(self.cache.get_many(['S1', 'S2'], now=1050), {'S1': {'sellerName': 'One'}})
+        self.assertEqual(self.cache.get_many(['S1', 'S2'], now=1200), {})
+
+    @patch('keepa_deals.seller_info.get_used_product_info')
+    @patch('keepa_deals.seller_info.fetch_seller_data')
+    def test_prefetch_batches_unique_sellers_once(self, mock_fetch, mock_used_info):
+        sellers = {'S1': {'sellerName': 'One'}, 'S2': {'sellerName': 'Two'}}
+        mock_fetch.side_effect = lambda key, ids: ({'sellers': {i: sellers[i] for i in ids if i in sellers}}, None, len(ids), 40)
+        seller_of = {'A1': 'S1', 'A2': 'S1', 'A3': 'S2', 'A4': 'S3', 'A5': None}
+        mock_used_info.side_effect = lambda p: (1000, seller_of[p['asin']], False, 4)
+        token_manager = MagicMock()
+        products = [{'asin': a} for a in seller_of]
+
+        with patch('keepa_deals.seller_info.get_seller_cache', return_value=self.cache):
+            first = prefetch_seller_info(products, 'key', token_manager)
+            second = prefetch_seller_info(products, 'key', token_manager)
+
+        self.assertEqual(mock_fetch.call_count, 1)
+        self.assertEqual(sorted(mock_fetch.call_args[0][1]), ['S1', 'S2', 'S3'])
+        token_manager.request_permission_for_call.assert_called_once_with(3)
+        self.assertEqual(first, second)
+        self.assertEqual(first['A2'], {'S1': {'sellerName': 'One'}})
+        self.assertEqual(first['A4'], {})
+        self.assertNotIn('A5', first)
+
+if __name__ == '__main__':
+    unittest.main()
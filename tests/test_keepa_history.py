@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.keepa_history import KeepaHistory, HistorySeries, datetime_to_keepa_minutes, SALES_RANK, USED_PRICE
+
+class TestHistorySeries(unittest.TestCase):
+    def test_decode_to_sorted_int32_pairs(self):
+        # Out-of-order rows are sorted; a trailing unpaired element is ignored.
+        series = HistorySeries.from_flat([300, 7, 100, 5, 200, 6, 999])
+
+        self.assertEqual(series.times.dtype, np.int32)
+        self.assertEqual(series.values.dtype, np.int32)
+        self.assertEqual(series.times.tolist(), [100, 200, 300])
+        self.assertEqual(series.values.tolist(), [5, 6, 7])
+
+    def test_non_numeric_entries(self):
+        # Rows with a bad timestamp are dropped; a bad value becomes Keepa's -1 sentinel.
+        series = HistorySeries.from_flat([100, 5, None, 6, 300, None])
+
+        self.assertEqual(series.times.tolist(), [100, 300])
+        self.assertEqual(series.values.tolist(), [5, -1])
+
+    def test_windows_and_change_points(self):
+        now = datetime(2026, 1, 31)
+        t = int(datetime_to_keepa_minutes(now))
+        series = HistorySeries.from_flat([t - 20 * 1440, 1, t - 10 * 1440, 1, t - 5 * 1440, 2, t - 1440, 2, t, 3])
+
+        self.assertEqual(len(series.last_days(7, now=now)), 3)
+        self.assertEqual(series.since(t - 10 * 1440).values.tolist(), [1, 2, 2, 3])
+        self.assertEqual(series.since_datetime(now - timedelta(days=2)).values.tolist(), [2, 3])
+        self.assertEqual(series.change_points().values.tolist(), [1, 2, 3])
+        self.assertEqual(series.change_points().times.tolist(), [t - 20 * 1440, t - 5 * 1440, t])
+
+    def test_value_at_is_backward_asof(self):
+        series = HistorySeries.from_flat([100, 5, 200, 6, 200, 7])
+        values, found = series.value_at(np.array([50, 100, 150, 200, 500]))
+
+        self.assertEqual(found.tolist(), [False, True, True, True, True])
+        self.assertEqual(values[found].tolist(), [5, 5, 7, 7])
+
+class TestKeepaHistory(unittest.TestCase):
+    def test_series_decoded_once_and_missing_indices(self):
+        csv = [None] * 13
+        csv[SALES_RANK] = [100, 5000, 200, 4000]
+        csv[USED_PRICE] = [100]
+        history = KeepaHistory(csv)
+
+        self.assertTrue(history.is_complete)
+        self.assertIs(history.sales_rank, history.sales_rank)
+        self.assertIsNone(history.used_price)
+        self.assertIsNone(history.used_offer_count)
+        self.assertFalse(KeepaHistory(csv[:5]).is_complete)
+
+if __name__ == '__main__':
+    unittest.main()
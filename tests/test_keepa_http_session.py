@@ -0,0 +1,31 @@
+import unittest
+import sys
+import os
+from unittest.mock import patch, MagicMock
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals import keepa_api
+
+class TestKeepaHttpSession(unittest.TestCase):
+    def test_all_keepa_calls_share_the_pooled_session(self):
+        response = MagicMock()
+        response.json.return_value = {'sellers': {}, 'tokensLeft': 10}
+        with patch.object(keepa_api._session, 'get', return_value=response) as mock_get:
+            keepa_api.get_token_status('key')
+            keepa_api.fetch_seller_data('key', ['S1'])
+
+        self.assertEqual(mock_get.call_count, 2)
+
+    def test_session_is_pooled_and_recreated_after_fork(self):
+        original = keepa_api._session
+        adapter = original.get_adapter('https://api.keepa.com/product')
+        self.assertEqual(adapter._pool_maxsize, keepa_api.KEEPA_HTTP_POOL_SIZE)
+
+        keepa_api._reset_session_after_fork()
+        self.addCleanup(setattr, keepa_api, '_session', original)
+        self.assertIsNot(keepa_api._session, original)
+
+if __name__ == '__main__':
+    unittest.main()
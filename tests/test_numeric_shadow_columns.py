@@ -0,0 +1,61 @@
+import unittest
+import sqlite3
+import sys
+import os
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.db_utils import (
+    parse_numeric, numeric_shadows, with_numeric_shadows, ensure_numeric_shadow_columns,
+    migrate_profit_confidence_to_deal_trust,
+)
+
+class TestNumericShadowColumns(unittest.TestCase):
+    def test_parse_display_values(self):
+        self.assertEqual(parse_numeric("$1,234.56"), 1234.56)
+        self.assertEqual(parse_numeric(" 45% "), 45.0)
+        self.assertEqual(parse_numeric(12), 12.0)
+        self.assertEqual(parse_numeric("45.7%", integer=True), 45)
+        for placeholder in ('-', 'N/A', '', None, 'nan'):
+            self.assertIsNone(parse_numeric(placeholder))
+
+    def test_shadows_follow_the_written_columns(self):
+        self.assertEqual(numeric_shadows({'ASIN': 'A1', 'Profit': '$5.00', 'Percent_Down': '20%'}),
+                         {'Profit_num': 5.0, 'Percent_Down_num': 20})
+
+        columns, rows = with_numeric_shadows(['ASIN', 'Deal_Trust', 'source'], [('A1', '75%', 'x'), ('A2', '-', 'x')])
+        self.assertEqual(columns, ['ASIN', 'Deal_Trust', 'source', 'Deal_Trust_num'])
+        self.assertEqual(rows, [('A1', '75%', 'x', 75.0), ('A2', '-', 'x', None)])
+
+    def test_migration_backfills_once(self):
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE deals (id INTEGER PRIMARY KEY, ASIN TEXT, Profit REAL, "1yr_Avg" TEXT)')
+        cursor.executemany('INSERT INTO deals (ASIN, Profit, "1yr_Avg") VALUES (?, ?, ?)',
+                           [('A1', '$12.50', '$40.00'), ('A2', 3.0, 'N/A')])
+
+        ensure_numeric_shadow_columns(cursor)
+        ensure_numeric_shadow_columns(cursor)  # Idempotent
+
+        rows = cursor.execute('SELECT ASIN, Profit_num, "1yr_Avg_num", Deal_Trust_num FROM deals ORDER BY ASIN').fetchall()
+        self.assertEqual(rows, [('A1', 12.5, 40.0, None), ('A2', 3.0, None, None)])
+        conn.close()
+
+    def test_deal_trust_migration_fills_the_shadow_column(self):
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        cursor.execute('CREATE TABLE deals (id INTEGER PRIMARY KEY, ASIN TEXT, Profit_Confidence TEXT, Deal_Trust TEXT)')
+        cursor.executemany('INSERT INTO deals (ASIN, Profit_Confidence, Deal_Trust) VALUES (?, ?, ?)',
+                           [('A1', '65%', None), ('A2', '30%', '80%'), ('A3', None, None)])
+        ensure_numeric_shadow_columns(cursor)
+
+        self.assertEqual(migrate_profit_confidence_to_deal_trust(cursor), 1)
+        self.assertEqual(migrate_profit_confidence_to_deal_trust(cursor), 0)  # Idempotent
+
+        rows = cursor.execute('SELECT ASIN, Deal_Trust, Deal_Trust_num FROM deals ORDER BY ASIN').fetchall()
+        self.assertEqual(rows, [('A1', '65%', 65.0), ('A2', '80%', 80.0), ('A3', None, None)])
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,217 @@
+import unittest
+import sqlite3
+import os
+import re
+import sys
+import shutil
+import tempfile
+import random
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import wsgi_handler
+from wsgi_handler import app
+from keepa_deals import db_utils, janitor, smart_ingestor, prime_picks_task, write_queue
+from keepa_deals.db_utils import get_db_connection
+
+SEED_ROWS = 50000
+
+# Tables that grow with the deal feed; a plain "SCAN <table>" on them is a regression.
+GUARDED_TABLES = ('deals', 'user_restrictions')
+# Statements that read the whole table by design (and need no index)
+FULL_READ_ALLOWLIST = (
+    re.compile(r'^SELECT COUNT\(\*\) FROM deals$'),
+)
+
+class TestQueryPlans(unittest.TestCase):
+    """
+    Runs the dashboard endpoints and task queries against a seeded 50k-row
+    database, records every statement they emit and fails if EXPLAIN QUERY PLAN
+    shows a full table scan of a guarded table.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.db_path = os.path.join(cls.tmpdir, 'deals.db')
+        with patch.object(db_utils, 'DB_PATH', cls.db_path):
+            db_utils.recreate_deals_table()
+            db_utils.create_user_restrictions_table_if_not_exists()
+            db_utils.create_prime_picks_table_if_not_exists()
+        cls._seed()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    @classmethod
+    def _seed(cls):
+        rng = random.Random(42)
+        now = datetime.now(timezone.utc)
+        conditions = ['New', 'Used - Like New', 'Used - Very Good', 'Used - Good', '2', '4']
+        rows = []
+        for i in range(SEED_ROWS):
+            profit = round(rng.uniform(-20, 80), 2)
+            cost = round(rng.uniform(2, 60), 2)
+            rows.append((
+                f'B{i:09d}', f'Title {i}', rng.choice(conditions), profit, cost,
+                round(rng.uniform(5, 200), 2), f'${rng.uniform(5, 90):.2f}',
+                f'{rng.randint(0, 100)}%', str(rng.randint(0, 90)), rng.randint(1, 2000000),
+                rng.randint(0, 60), round(rng.random(), 2), rng.choice([None, '⚠️']),
+                (now - timedelta(hours=rng.uniform(0, 120))).isoformat(),
+            ))
+        columns = ['ASIN', 'Title', 'Condition', 'Profit', 'All_in_Cost', 'List_at', '1yr_Avg',
+                   'Deal_Trust', 'Percent_Down', 'Sales_Rank_Current', 'Sales_Rank_Drops_last_30_days',
+                   'Seller_Quality_Score', 'AMZ', 'last_seen_utc']
+        columns, rows = db_utils.with_numeric_shadows(columns, rows)
+        cols_str = ', '.join(f'"{c}"' for c in columns)
+        vals_str = ', '.join(['?'] * len(columns))
+        with get_db_connection(cls.db_path) as conn:
+            conn.executemany(f"INSERT INTO deals ({cols_str}) VALUES ({vals_str})", rows)
+            conn.executemany("INSERT INTO user_restrictions (user_id, asin, is_restricted) VALUES (?, ?, ?)",
+                             [('user-1', f'B{i:09d}', i % 2) for i in range(0, SEED_ROWS, 5)])
+            conn.executemany("INSERT INTO prime_picks (asin, rank, score, generated_at) VALUES (?, ?, ?, ?)",
+                             [(f'B{i:09d}', i, 1.0, now.isoformat()) for i in range(20)])
+            conn.execute("ANALYZE")
+            conn.commit()
+
+    def setUp(self):
+        self.statements = []
+
+        def traced_connection(db_path=None, timeout=5.0):
+            conn = get_db_connection(self.db_path, timeout)
+            conn.set_trace_callback(self.statements.append)
+            return conn
+
+        for module in (wsgi_handler, janitor, smart_ingestor, prime_picks_task, write_queue):
+            patcher = patch.object(module, 'get_db_connection', side_effect=traced_connection)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for module in (wsgi_handler, janitor, smart_ingestor, prime_picks_task, db_utils):
+            patcher = patch.object(module, 'DB_PATH', self.db_path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _table_scans(self):
+        """(statement, plan detail) for every full scan of a guarded table."""
+        scans = []
+        with get_db_connection(self.db_path) as conn:
+            aliases = {}
+            for sql in self.statements:
+                statement = ' '.join(sql.split())
+                if not re.match(r'^(SELECT|UPDATE|DELETE|WITH)\b', statement, re.I) or 'sqlite_master' in statement:
+                    continue
+                if any(p.match(statement) for p in FULL_READ_ALLOWLIST):
+                    continue
+                # Map aliases (e.g. "user_restrictions AS ur") back to their tables
+                for table, alias in re.findall(r'\b(\w+) AS (\w+)\b', statement):
+                    aliases[alias] = table
+                plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+                # A LIMITed scan that already yields rows in ORDER BY order (no temp b-tree)
+                # stops after the page: a bounded read, not a table-scan fallback.
+                bounded = re.search(r'\bLIMIT\b', statement) and not any('TEMP B-TREE' in d for d in plan)
+                for detail in plan:
+                    match = re.match(r'^SCAN (\w+)(.*)$', detail)
+                    if match and 'USING' not in match.group(2) and not bounded:
+                        table = aliases.get(match.group(1), match.group(1))
+                        if table in GUARDED_TABLES:
+                            scans.append((statement, detail))
+        return scans
+
+    def assertNoTableScans(self):
+        self.assertTrue(self.statements, "No statements were captured")
+        scans = self._table_scans()
+        self.assertEqual(scans, [], "Queries fell back to a full table scan:\n" +
+                         "\n".join(f"  {detail}: {sql[:300]}" for sql, detail in scans))
+
+    def _get(self, client, url):
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.data[:500])
+
+    def test_dashboard_queries_use_indexes(self):
+        filter_sets = [
+            '',
+            'sort=Profit&order=desc',
+            'sort=ROI&order=desc',
+            'sort=Sales_Rank_Current&order=asc',
+            'sort=last_seen_utc&order=desc',
+            'deal_trust_gte=60&percent_down_gte=30',
+            'roi_gte=25&drops_30_gte=5&sales_rank_current_lte=250000',
+            'profit_gte=15&seller_trust_gte=8&hide_amz=1',
+            'excluded_conditions=New,U-Good&keyword=Title',
+            'hide_gated=1',
+            'agents_choice=true',
+        ]
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+                sess['sp_api_connected'] = True
+                sess['sp_api_user_id'] = 'user-1'
+            for filters in filter_sets:
+                self._get(client, f'/api/deals?page=3&{filters}')
+                self._get(client, f'/api/deal-count?{filters}')
+
+        # The keyword filter runs through the search index
+        self.assertTrue(any('deals_fts MATCH' in sql for sql in self.statements))
+        self.assertNoTableScans()
+
+    def test_keyset_pages_use_indexes(self):
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+            for sort in ('sort=Profit&order=desc', 'sort=Percent_Down&order=asc', 'sort=last_seen_utc&order=desc'):
+                next_cursor, pages = '', 0
+                while next_cursor is not None and pages < 5:
+                    response = client.get(f'/api/deals?limit=100&{sort}&cursor={next_cursor}')
+                    self.assertEqual(response.status_code, 200, response.data[:500])
+                    next_cursor = response.get_json()['pagination']['next_cursor']
+                    pages += 1
+                self.assertEqual(pages, 5)
+
+        self.assertNoTableScans()
+
+    def test_task_queries_use_indexes(self):
+        janitor._clean_stale_deals_logic(grace_period_hours=96)
+        # The janitor's statements run on the write queue's connection
+        self.assertTrue(any('FROM deals WHERE last_seen_utc <' in sql for sql in self.statements))
+
+        token_manager = MagicMock()
+        token_manager.REFILL_RATE_PER_MINUTE = 20
+        with patch.object(smart_ingestor, 'split_cached', return_value=({}, [])), \
+             patch.object(smart_ingestor, 'fetch_current_stats_batch', return_value=(None, None, 0, None)):
+            smart_ingestor.rescue_stale_deals(token_manager, limit=20)
+
+        # Pass 1 only: stop before scoring and the xAI pass
+        with patch.object(prime_picks_task, 'logger') as mock_logger:
+            mock_logger.info.side_effect = [None, RuntimeError("stop after Pass 1")]
+            try:
+                prime_picks_task.generate_prime_picks()
+            except RuntimeError:
+                pass
+
+        self.assertNoTableScans()
+
+class TestDealsIndexMigration(unittest.TestCase):
+    def test_indexes_are_created_rebuilt_and_retired(self):
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        columns = {c for cols in db_utils.DEALS_INDEXES.values() for c in cols}
+        cols_sql = ', '.join(f'"{c}"' for c in sorted(columns))
+        cursor.execute(f"CREATE TABLE deals (id INTEGER PRIMARY KEY, {cols_sql})")
+        cursor.execute('CREATE INDEX "idx_deals_Profit_num" ON deals("Profit_num")')  # retired
+        cursor.execute('CREATE INDEX "idx_deals_last_seen_utc" ON deals("Profit_num")')  # changed
+
+        db_utils.ensure_deals_indexes(cursor)
+
+        cursor.execute("PRAGMA index_list('deals')")
+        indexes = {row[1] for row in cursor.fetchall()}
+        self.assertEqual(indexes, set(db_utils.DEALS_INDEXES))
+        cursor.execute("PRAGMA index_info('idx_deals_last_seen_utc')")
+        self.assertEqual([row[2] for row in cursor.fetchall()], ['last_seen_utc'])
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import os
+import sys
+import tempfile
+from contextlib import nullcontext
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keepa_deals import stable_calculations
+from keepa_deals.stable_calculations import analyze_sales_performance, verify_reasonableness_batch
+from keepa_deals.processing import resolve_pending_reasonableness, PENDING_REASONABLENESS_KEY
+from keepa_deals.xai_cache import XaiCache
+
+PRODUCT = {
+    'asin': 'TESTDEFER',
+    'title': 'Deferred Check',
+    'categoryTree': [{'name': 'Books'}],
+    'stats': {'current': [10000, 10000, 1000, 100]},
+}
+SALE_EVENTS = [
+    {'event_timestamp': datetime(2025, 5, day), 'inferred_sale_price_cents': 2000} for day in (1, 2, 3)
+]
+
+def _check(title, price_usd=20.0):
+    return {'title': title, 'category': 'Books', 'season': 'May', 'price_usd': price_usd,
+            'binding': 'Paperback', 'page_count': 200, 'image_url': 'N/A',
+            'rank_info': 'Current Rank: 100', 'trend_info': 'Stable', 'avg_3yr_usd': '18.00'}
+
+class TestReasonablenessBatch(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = XaiCache(db_path=os.path.join(tmpdir.name, 'xai_cache.db'), legacy_json_path='')
+
+        self.requests = []  # payloads sent to xAI
+        self.replies = []   # message contents returned, in order
+        def post(url, headers=None, json=None):
+            self.requests.append(json)
+            response = MagicMock()
+            response.json.return_value = {'choices': [{'message': {'content': self.replies.pop(0)}}]}
+            return response
+        client = MagicMock()
+        client.__enter__.return_value.post.side_effect = post
+
+        manager = MagicMock()
+        manager.call_slot.side_effect = lambda caller: nullcontext(True)
+        for patcher in (patch.object(stable_calculations, 'xai_cache', self.cache),
+                        patch.object(stable_calculations, 'xai_token_manager', manager),
+                        patch.object(stable_calculations.httpx, 'Client', return_value=client),
+                        patch.dict(os.environ, {'XAI_TOKEN': 'key'})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_deferred_analysis_returns_a_provisional_price_and_its_check(self):
+        result = analyze_sales_performance(PRODUCT, SALE_EVENTS, defer_reasonableness=True)
+
+        self.assertEqual(result['peak_price_mode_cents'], 2000)
+        self.assertEqual(result['reasonableness_check']['title'], 'Deferred Check')
+        self.assertEqual(result['reasonableness_check']['price_usd'], 20.0)
+        self.assertEqual(self.requests, [])
+
+        # A cached verdict is applied at once
+        self.cache.set(stable_calculations._reasonableness_cache_key(**result['reasonableness_check']), 'False')
+        result = analyze_sales_performance(PRODUCT, SALE_EVENTS, defer_reasonableness=True)
+        self.assertEqual(result['peak_price_mode_cents'], -1)
+        self.assertNotIn('reasonableness_check', result)
+
+    def test_checks_share_calls_with_partial_failure_fallback(self):
+        checks = [_check('One'), _check('Two'), _check('Three'), _check('Four')]
+        self.replies.append('```json\n[{"id": 0, "reasonable": "Yes"}, {"id": 1, "reasonable": "No"}]\n```')
+        self.replies.append('No')  # Three, asked about alone
+        self.replies.append('[{"id": 0, "reasonable": "No"}]')
+
+        with patch.object(stable_calculations, 'REASONABLENESS_BATCH_SIZE', 3):
+            verdicts = verify_reasonableness_batch(checks, 'key')
+
+        self.assertEqual(verdicts, [True, False, False, False])
+        self.assertEqual(len(self.requests), 3)
+        # Verdicts are cached per check
+        self.assertEqual(verify_reasonableness_batch(checks, 'key'), verdicts)
+        self.assertEqual(len(self.requests), 3)
+
+    def test_unverifiable_prices_count_as_reasonable(self):
+        stable_calculations.xai_token_manager.call_slot.side_effect = lambda caller: nullcontext(False)
+        self.assertEqual(verify_reasonableness_batch([_check('Denied'), _check('Also Denied')], 'key'), [True, True])
+        self.assertEqual(verify_reasonableness_batch([_check('No Key')], None), [True])
+        self.assertEqual(self.requests, [])
+        # Nothing was cached, so the prices are checked again next time
+        self.assertIsNone(stable_calculations._cached_reasonableness(_check('Denied')))
+
+    def test_unusable_reply_fails_the_whole_chunk(self):
+        self.replies.append('Sorry, I cannot help with that.')
+        self.assertEqual(verify_reasonableness_batch([_check('One'), _check('Two'), _check('Three')], 'key'),
+                         [True, True, True])
+        # No price is checked on its own, and nothing is cached
+        self.assertEqual(len(self.requests), 1)
+        self.assertIsNone(stable_calculations._cached_reasonableness(_check('One')))
+
+    def test_rejected_rows_lose_their_price_and_profit(self):
+        self.replies.append('[{"id": 0, "reasonable": "No"}, {"id": 1, "reasonable": "Yes"}]')
+        rejected = {'ASIN': 'A1', 'List at': 20.0, 'Total_AMZ_fees': 8.5, 'Profit': 1.5, 'Margin': 7.5,
+                    PENDING_REASONABLENESS_KEY: {'check': _check('One'), 'all_in_cost': 10.0, 'fba_fee': 5.5}}
+        accepted = {'ASIN': 'A2', 'List at': 20.0, 'Profit': 1.5,
+                    PENDING_REASONABLENESS_KEY: {'check': _check('Two'), 'all_in_cost': 10.0, 'fba_fee': 5.5}}
+        untouched = {'ASIN': 'A3', 'List at': 30.0}
+
+        resolve_pending_reasonableness([rejected, None, accepted, untouched], 'key')
+
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(rejected, {'ASIN': 'A1', 'List at': None, 'Total_AMZ_fees': 5.5, 'Profit': -15.5, 'Margin': 0})
+        self.assertEqual(accepted, {'ASIN': 'A2', 'List at': 20.0, 'Profit': 1.5})
+        self.assertEqual(untouched, {'ASIN': 'A3', 'List at': 30.0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import sys
+import os
+from unittest.mock import MagicMock
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals.request_scheduler import TokenCostModel, RequestScheduler, PEEK, COMMIT, LIGHT_UPDATE, DEFAULT_COST_PER_ASIN
+
+def _token_manager(projected, burst=50):
+    tm = MagicMock()
+    tm.get_projected_tokens.return_value = projected
+    tm.BURST_THRESHOLD = burst
+    tm.redis_client = None
+    return tm
+
+class TestTokenCostModel(unittest.TestCase):
+    def test_learns_from_tokens_consumed(self):
+        model = TokenCostModel()
+        for _ in range(20):
+            model.observe(PEEK, 50, 386)
+
+        self.assertAlmostEqual(model.cost_per_asin(PEEK), 7.72, places=1)
+        self.assertEqual(model.estimate(PEEK, 10), 78)
+        # Cache hits / errors (nothing fetched or nothing consumed) are ignored.
+        model.observe(COMMIT, 0, 100)
+        model.observe(COMMIT, 5, 0)
+        self.assertEqual(model.cost_per_asin(COMMIT), DEFAULT_COST_PER_ASIN[COMMIT])
+
+    def test_learned_costs_are_shared_through_redis(self):
+        redis_client = MagicMock()
+        redis_client.hgetall.return_value = {COMMIT: '12.5', 'unknown_shape': '1'}
+        model = TokenCostModel(redis_client)
+        self.assertEqual(model.cost_per_asin(COMMIT), 12.5)
+
+        model.observe(PEEK, 10, 50)
+        redis_client.hset.assert_called_once_with(TokenCostModel.REDIS_KEY, PEEK, str(model.cost_per_asin(PEEK)))
+
+class TestRequestScheduler(unittest.TestCase):
+    def test_batch_fits_projected_budget(self):
+        scheduler = RequestScheduler(_token_manager(projected=300))
+        self.assertEqual(scheduler.batch_size(COMMIT, 100, 10), 10)
+
+        scheduler = RequestScheduler(_token_manager(projected=100))
+        self.assertEqual(scheduler.batch_size(COMMIT, 100, 10), 5)
+        self.assertEqual(scheduler.batch_size(COMMIT, 3, 10), 3)
+
+    def test_low_balance_plans_for_burst_threshold_and_always_progresses(self):
+        scheduler = RequestScheduler(_token_manager(projected=-50, burst=40))
+        self.assertEqual(scheduler.budget(), 40)
+        self.assertEqual(scheduler.batch_size(COMMIT, 10, 10), 2)
+
+        scheduler.cost_model.costs[COMMIT] = 500
+        self.assertEqual(scheduler.batch_size(COMMIT, 10, 10), 1)
+
+    def test_scan_chunk_weights_peek_and_light_costs(self):
+        scheduler = RequestScheduler(_token_manager(projected=120))
+        scheduler.cost_model.costs.update({PEEK: 8, LIGHT_UPDATE: 2})
+        deals = [{'asin': f'A{i}'} for i in range(50)]
+
+        self.assertEqual(scheduler.scan_batch_size(deals, set(), 50), 15)
+        self.assertEqual(scheduler.scan_batch_size(deals, {d['asin'] for d in deals}, 50), 50)
+        self.assertEqual(scheduler.scan_batch_size(deals[:4], set(), 50), 4)
+
+if __name__ == '__main__':
+    unittest.main()
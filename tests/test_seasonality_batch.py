@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+from contextlib import nullcontext
+from unittest.mock import MagicMock, patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keepa_deals import seasonality_classifier
+from keepa_deals.seasonality_classifier import (
+    classify_seasonality_batch, resolve_pending_seasonality, PENDING_SEASONALITY_KEY,
+)
+from keepa_deals.xai_cache import XaiCache
+
+def _book(title, peak='-'):
+    return (title, 'Books', 'Small Press', peak, '-')
+
+class TestSeasonalityBatch(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = XaiCache(db_path=os.path.join(tmpdir.name, 'xai_cache.db'), legacy_json_path='')
+
+        self.requests = []  # payloads sent to xAI
+        self.replies = []   # message contents returned, in order
+        def post(url, headers=None, json=None):
+            self.requests.append(json)
+            response = MagicMock()
+            response.json.return_value = {'choices': [{'message': {'content': self.replies.pop(0)}}]}
+            return response
+        client = MagicMock()
+        client.__enter__.return_value.post.side_effect = post
+
+        manager = MagicMock()
+        manager.call_slot.side_effect = lambda caller: nullcontext(True)
+        for patcher in (patch.object(seasonality_classifier, 'xai_cache', self.cache),
+                        patch.object(seasonality_classifier, 'xai_token_manager', manager),
+                        patch.object(seasonality_classifier.httpx, 'Client', return_value=client)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_books_share_one_call_and_are_cached_individually(self):
+        items = [_book('Christmas Cookies'), _book('Pond Life', 'Apr'), _book('Ghost Stories', 'Oct'),
+                 _book('Pond Life', 'Apr')]
+        self.replies.append('```json\n[{"id": 0, "season": "Gardening"}, {"id": 1, "season": "Halloween"}]\n```')
+
+        seasons = classify_seasonality_batch(items, 'key')
+
+        # The heuristics place the first; the duplicate is asked about once
+        self.assertEqual(seasons, ['Christmas', 'Gardening', 'Halloween', 'Gardening'])
+        self.assertEqual(len(self.requests), 1)
+        self.assertIn('Ghost Stories', self.requests[0]['messages'][1]['content'])
+        self.assertEqual(self.cache.get('seasonality:Ghost Stories|Books|Small Press'), 'Halloween')
+
+        # Everything is cached or heuristic now: no further calls
+        self.assertEqual(classify_seasonality_batch(items, 'key'), seasons)
+        self.assertEqual(len(self.requests), 1)
+
+    def test_books_left_out_of_the_response_are_asked_about_alone(self):
+        items = [_book('Pond Life'), _book('Ghost Stories'), _book('Odd Volume')]
+        self.replies.append('[{"id": 0, "season": "Gardening"}, {"id": 1, "season": "Not A Season"}]')
+        self.replies.append('Tax Prep')
+
+        seasons = classify_seasonality_batch(items, 'key')
+
+        self.assertEqual(seasons, ['Gardening', 'Year-round', 'Tax Prep'])
+        self.assertEqual(len(self.requests), 2)
+        self.assertIn('Odd Volume', self.requests[1]['messages'][1]['content'])
+        # An invalid answer is not cached
+        self.assertIsNone(self.cache.get('seasonality:Ghost Stories|Books|Small Press'))
+
+    def test_batches_are_capped_and_failures_default_to_year_round(self):
+        items = [_book(f'Volume {i}') for i in range(5)]
+        self.replies.append(json.dumps([{'id': i, 'season': 'Travel'} for i in range(3)]))
+        self.replies.append('not json at all')
+
+        with patch.object(seasonality_classifier, 'SEASONALITY_BATCH_SIZE', 3):
+            seasons = classify_seasonality_batch(items, 'key')
+
+        # An unusable reply fails its whole chunk: no single-book calls
+        self.assertEqual(seasons, ['Travel'] * 3 + ['Year-round'] * 2)
+        self.assertEqual(len(self.requests), 2)
+        self.assertIsNone(self.cache.get('seasonality:Volume 3|Books|Small Press'))
+
+        self.assertEqual(classify_seasonality_batch([_book('No Key')], None), ['Year-round'])
+        self.assertEqual(len(self.requests), 2)
+
+    def test_resolve_pending_fills_only_marked_rows(self):
+        self.replies.append('[{"id": 0, "season": "Gardening"}]')
+        rows = [
+            {'ASIN': 'A1', 'Detailed_Seasonality': 'Year-round', 'Sells': 'All Year',
+             PENDING_SEASONALITY_KEY: _book('Pond Life')},
+            {'ASIN': 'A2', 'Detailed_Seasonality': 'Christmas', 'Sells': 'Nov - Dec'},
+            None,
+        ]
+
+        resolve_pending_seasonality(rows, 'key')
+
+        self.assertEqual(rows[0], {'ASIN': 'A1', 'Detailed_Seasonality': 'Gardening', 'Sells': 'Mar - Apr'})
+        self.assertEqual(rows[1]['Detailed_Seasonality'], 'Christmas')
+
+if __name__ == '__main__':
+    unittest.main()
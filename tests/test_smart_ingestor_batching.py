@@ -10,6 +10,7 @@ from keepa_deals import smart_ingestor
 from keepa_deals.token_manager import TokenRechargeError
 
 class TestSmartIngestorBatching(unittest.TestCase):
+    @patch('keepa_deals.smart_ingestor.run_write')
     @patch('keepa_deals.smart_ingestor.redis.Redis')
     @patch('keepa_deals.smart_ingestor.get_db_connection')
     @patch('keepa_deals.smart_ingestor.TokenManager')
@@ -21,7 +22,7 @@ class TestSmartIngestorBatching(unittest.TestCase):
     @patch('keepa_deals.smart_ingestor.save_watermark')
     @patch('keepa_deals.smart_ingestor.create_deals_table_if_not_exists')
     @patch('keepa_deals.smart_ingestor.requeue_stuck_restrictions')
-    @patch('keepa_deals.smart_ingestor.get_seller_info_for_single_deal')
+    @patch('keepa_deals.smart_ingestor.prefetch_seller_info')
     @patch('keepa_deals.smart_ingestor._process_single_deal')
     @patch('keepa_deals.smart_ingestor.celery') # Mock celery
     # smart_ingestor.run() returns early at "KEEPA_API_KEY not set. Aborting." before
@@ -33,7 +34,7 @@ class TestSmartIngestorBatching(unittest.TestCase):
     @patch.dict(os.environ, {'KEEPA_API_KEY': 'test_key_not_a_real_credential'})
     def test_batching_logic(self, mock_celery, mock_process_single, mock_get_seller, mock_requeue, mock_create_table, mock_save_wm, mock_load_wm,
                             mock_check_peek, mock_fetch_product, mock_fetch_stats, mock_fetch_deals,
-                            mock_token_manager_cls, mock_sqlite, mock_redis):
+                            mock_token_manager_cls, mock_sqlite, mock_redis, mock_run_write):
 
         # Setup Mocks
         mock_load_wm.return_value = "2023-01-01T00:00:00+00:00"
@@ -53,6 +54,11 @@ class TestSmartIngestorBatching(unittest.TestCase):
         type(mock_tm).REFILL_RATE_PER_MINUTE = unittest.mock.PropertyMock(return_value=20)
         # Ensure should_skip_sync is False for standard test
         mock_tm.should_skip_sync.return_value = False
+        # Scheduler budget: 100 projected tokens fits a 50-ASIN peek (2/ASIN) and
+        # 5-ASIN commits (20/ASIN) at the cold-start costs.
+        mock_tm.get_projected_tokens.return_value = 100
+        mock_tm.BURST_THRESHOLD = 50
+        mock_tm.redis_client = None
 
         mock_conn = mock_sqlite.connect.return_value
         mock_cursor = mock_conn.cursor.return_value
@@ -60,11 +66,11 @@ class TestSmartIngestorBatching(unittest.TestCase):
 
         mock_check_peek.return_value = True
 
-        def side_effect_peek(api_key, asins, days, offers):
+        def side_effect_peek(api_key, asins, days, offers, cached=None):
             return {'products': [{'asin': a, 'stats': {}} for a in asins]}, None, 0, 100
         mock_fetch_stats.side_effect = side_effect_peek
 
-        def side_effect_commit(api_key, asins, days=365, offers=20, rating=1, history=0):
+        def side_effect_commit(api_key, asins, days=365, offers=20, rating=1, history=0, cached=None):
              return {'products': [{'asin': a} for a in asins]}, None, 0, 100
         mock_fetch_product.side_effect = side_effect_commit
 
@@ -0,0 +1,89 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import sys
+import os
+
+# Add repo root to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keepa_deals import smart_ingestor
+
+def _commit_from_daemonic_parent(queue):
+    """Runs in a daemonic process, like a prefork Celery task child."""
+    items = [({'asin': 'A1'}, {}), ({'asin': 'A2'}, {})]
+    with patch.object(smart_ingestor, 'COMMIT_POOL_WORKERS', 2), patch('os.cpu_count', return_value=4):
+        created = smart_ingestor._create_commit_pool()
+    pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    # Only an in-process call sees this patch
+    with patch('keepa_deals.smart_ingestor._process_single_deal', side_effect=lambda p, s, k, **kwargs: {'ASIN': p['asin']}):
+        rows = smart_ingestor._process_commit_batch(items, None, pool)
+    queue.put((created, rows))
+
+class TestCommitPool(unittest.TestCase):
+    def test_sequential_when_no_pool(self):
+        items = [({'asin': 'A1'}, {}), ({'asin': 'A2'}, {})]
+        with patch('keepa_deals.smart_ingestor._process_single_deal', side_effect=lambda p, s, k, **kwargs: {'ASIN': p['asin']}) as mock_process:
+            rows = smart_ingestor._process_commit_batch(items, 'xai-key')
+
+        self.assertEqual(rows, [{'ASIN': 'A1'}, {'ASIN': 'A2'}])
+        self.assertEqual(mock_process.call_count, 2)
+
+    def test_pool_results_keep_input_order(self):
+        items = [({'asin': f'A{i}'}, {}) for i in range(8)]
+
+        def slow_first(product, seller_cache, key, **kwargs):
+            if product['asin'] == 'A0':
+                import time
+                time.sleep(0.05)
+            return {'ASIN': product['asin']}
+
+        with patch('keepa_deals.smart_ingestor._process_single_deal', side_effect=slow_first), \
+             ThreadPoolExecutor(max_workers=4) as pool:
+            rows = smart_ingestor._process_commit_batch(items, None, pool)
+
+        self.assertEqual([r['ASIN'] for r in rows], [f'A{i}' for i in range(8)])
+
+    def test_broken_pool_falls_back_to_parent(self):
+        broken = Future()
+        broken.set_exception(BrokenProcessPool("worker died"))
+        ok = Future()
+        ok.set_result({'ASIN': 'A1'})
+        pool = MagicMock()
+        pool.submit.side_effect = [ok, broken]
+
+        items = [({'asin': 'A1'}, {}), ({'asin': 'A2'}, {})]
+        with patch('keepa_deals.smart_ingestor._process_single_deal', return_value={'ASIN': 'A2'}) as mock_process:
+            rows = smart_ingestor._process_commit_batch(items, None, pool)
+
+        self.assertEqual(rows, [{'ASIN': 'A1'}, {'ASIN': 'A2'}])
+        mock_process.assert_called_once()
+
+    def test_real_process_pool_round_trip(self):
+        # Products without an ASIN are rejected immediately, so this only exercises
+        # pickling and the spawn start method, not the analytics.
+        items = [({'title': 'no asin'}, {}), ({'title': 'no asin either'}, {})]
+        with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as pool:
+            rows = smart_ingestor._process_commit_batch(items, None, pool)
+
+        self.assertEqual(rows, [None, None])
+
+    def test_daemonic_parent_falls_back_to_sequential(self):
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        process = ctx.Process(target=_commit_from_daemonic_parent, args=(queue,), daemon=True)
+        process.start()
+        created, rows = queue.get(timeout=30)
+        process.join(timeout=30)
+
+        self.assertIsNone(created)
+        self.assertEqual(rows, [{'ASIN': 'A1'}, {'ASIN': 'A2'}])
+
+    @patch('keepa_deals.smart_ingestor.COMMIT_POOL_WORKERS', 0)
+    def test_pool_disabled_by_default(self):
+        self.assertIsNone(smart_ingestor._create_commit_pool())
+
+if __name__ == '__main__':
+    unittest.main()
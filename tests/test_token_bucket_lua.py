@@ -0,0 +1,176 @@
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import logging
+
+# Ensure the app can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from keepa_deals.token_manager import (
+    TokenManager, TokenRechargeError,
+    PRIORITY_DEBUG, PRIORITY_STALE_RESCUE, PRIORITY_PEEK, PRIORITY_ACTIVE_WINDOW_SECONDS,
+)
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 - fakeredis needs it to run Lua scripts
+    HAS_LUA_REDIS = True
+except ImportError:
+    HAS_LUA_REDIS = False
+
+logging.getLogger('keepa_deals.token_manager').setLevel(logging.CRITICAL)
+
+@unittest.skipUnless(HAS_LUA_REDIS, "fakeredis[lua] not installed")
+class TestLuaTokenBucket(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.redis = fakeredis.FakeRedis(server=self.server, decode_responses=True)
+        self.now = 1_000_000.0
+
+        patcher = patch('redis.Redis.from_url', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clock = patch('keepa_deals.token_manager.time.time', side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        sleep = patch('keepa_deals.token_manager.time.sleep', side_effect=self._sleep)
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _sleep(self, seconds):
+        self.now += seconds
+
+    def _manager(self, tokens, rate=20.0):
+        self.redis.set(TokenManager.REDIS_KEY_TOKENS, str(tokens))
+        self.redis.set(TokenManager.REDIS_KEY_RATE, str(rate))
+        self.redis.set(TokenManager.REDIS_KEY_TIMESTAMP, str(self.now))
+        tm = TokenManager("dummy_key")
+        tm.last_api_call_timestamp = 0
+        return tm
+
+    def _tokens(self):
+        return float(self.redis.get(TokenManager.REDIS_KEY_TOKENS))
+
+    def test_controlled_deficit_in_one_call(self):
+        tm = self._manager(tokens=25)
+        tm.request_permission_for_call(40)
+        self.assertEqual(self._tokens(), -15)
+        self.assertEqual(tm.tokens, -15)
+
+    def test_soft_floor_lets_call_through_and_starts_recharge(self):
+        tm = self._manager(tokens=15)
+        self.assertTrue(tm.try_reserve(5))
+        self.assertEqual(self.redis.get(TokenManager.REDIS_KEY_RECHARGE_MODE), "1")
+        self.assertFalse(tm.try_reserve(5))
+
+    def test_deficit_limit_is_never_crossed(self):
+        tm = self._manager(tokens=30)
+        self.assertFalse(tm.try_reserve(250))
+        self.assertEqual(self._tokens(), 30)
+        self.assertEqual(self.redis.zcard(TokenManager.REDIS_KEY_QUEUE), 0)
+
+    def test_refill_is_projected_before_reserving(self):
+        tm = self._manager(tokens=60)
+        self.now += 120  # 2 minutes at 20/min
+        self.assertTrue(tm.try_reserve(10))
+        self.assertEqual(self._tokens(), 90)
+
+    def test_recharge_mode_waits_for_burst_threshold(self):
+        tm = self._manager(tokens=40)
+        self.redis.set(TokenManager.REDIS_KEY_RECHARGE_MODE, "1")
+        self.redis.set(TokenManager.REDIS_KEY_RECHARGE_START, str(self.now))
+
+        start = self.now
+        tm.request_permission_for_call(30)
+
+        # 40 -> 50 tokens at 20/min takes 30s.
+        self.assertEqual(self.now - start, 30)
+        self.assertIsNone(self.redis.get(TokenManager.REDIS_KEY_RECHARGE_MODE))
+        self.assertEqual(self._tokens(), 20)
+
+    def test_long_wait_raises_after_forced_sync(self):
+        tm = self._manager(tokens=-150, rate=5.0)
+        with patch.object(tm, 'sync_tokens') as mock_sync:
+            with self.assertRaises(TokenRechargeError):
+                tm.request_permission_for_call(30)
+        mock_sync.assert_called_once_with(force=True)
+        self.assertEqual(self.redis.zcard(TokenManager.REDIS_KEY_QUEUE), 0)
+
+    def test_waiters_are_served_in_arrival_order(self):
+        tm = self._manager(tokens=-10)
+        first = tm._get_bucket_script()
+
+        granted, _, reason = tm._eval_bucket(first, 5, "commit|first", "commit")
+        self.assertFalse(granted)
+        self.now += 120  # 30 tokens: past the low-cost recharge buffer, enough for both
+        # A newcomer cannot overtake the waiting ticket...
+        granted, _, reason = tm._eval_bucket(first, 5, "commit|second", "commit")
+        self.assertEqual((granted, reason), (False, 'queued'))
+        # ...but is served as soon as the head has been.
+        self.assertTrue(tm._eval_bucket(first, 5, "commit|first", "commit")[0])
+        self.assertTrue(tm._eval_bucket(first, 5, "commit|second", "commit")[0])
+
+    def test_abandoned_tickets_expire(self):
+        tm = self._manager(tokens=-10)
+        tm._eval_bucket(tm._get_bucket_script(), 5, "commit|crashed", "commit")
+        self.now += TokenManager.QUEUE_STALE_SECONDS + 1
+        self.assertTrue(tm.try_reserve(5))
+
+    def _credits(self, **credits):
+        for name, credit in credits.items():
+            self.redis.hset(TokenManager.REDIS_KEY_CLASS_CREDIT, name, str(credit))
+            self.redis.hset(TokenManager.REDIS_KEY_CLASS_SEEN, name, str(self.now))
+        self.redis.hset(TokenManager.REDIS_KEY_CLASS_CREDIT, '_ts', str(self.now))
+
+    def test_peeks_cannot_borrow_the_rescue_reserve(self):
+        tm = self._manager(tokens=30, rate=5.0)
+        self._credits(stale_rescue=30, peek=0)
+
+        self.assertFalse(tm.try_reserve(10, priority=PRIORITY_PEEK))
+        self.assertTrue(tm.try_reserve(20, priority=PRIORITY_STALE_RESCUE))
+        self.assertEqual(self._tokens(), 10)
+
+    def test_rescue_cannot_borrow_the_peek_reserve(self):
+        tm = self._manager(tokens=30, rate=5.0)
+        self._credits(stale_rescue=0, peek=30)
+
+        self.assertFalse(tm.try_reserve(20, priority=PRIORITY_STALE_RESCUE))
+        self.assertTrue(tm.try_reserve(10, priority=PRIORITY_PEEK))
+
+    def test_idle_classes_lend_their_reserve(self):
+        tm = self._manager(tokens=30, rate=5.0)
+        self._credits(stale_rescue=30, peek=0)
+        self.now += PRIORITY_ACTIVE_WINDOW_SECONDS + 1
+        self.redis.set(TokenManager.REDIS_KEY_TIMESTAMP, str(self.now))
+
+        self.assertTrue(tm.try_reserve(10, priority=PRIORITY_PEEK))
+
+    def test_no_borrowing_while_a_higher_class_waits(self):
+        tm = self._manager(tokens=100)
+        self._credits(stale_rescue=0, peek=0)
+        self.redis.zadd(TokenManager.REDIS_KEY_QUEUE, {"stale_rescue|waiting": self.now})
+        self.redis.zadd(TokenManager.REDIS_KEY_QUEUE_SEEN, {"stale_rescue|waiting": self.now})
+
+        self.assertFalse(tm.try_reserve(10, priority=PRIORITY_PEEK))
+        self._credits(peek=10)
+        self.assertTrue(tm.try_reserve(10, priority=PRIORITY_PEEK))
+
+    def test_credit_accrues_at_the_class_share(self):
+        tm = self._manager(tokens=0, rate=10.0)
+        self._credits(peek=0)
+        self.now += 60
+        tm.try_reserve(0, priority=PRIORITY_PEEK)
+        credit = float(self.redis.hget(TokenManager.REDIS_KEY_CLASS_CREDIT, PRIORITY_PEEK))
+        self.assertAlmostEqual(credit, 10.0 * 0.15)
+
+    def test_debug_skips_recharge_mode(self):
+        tm = self._manager(tokens=15)
+        self.redis.set(TokenManager.REDIS_KEY_RECHARGE_MODE, "1")
+        self.redis.set(TokenManager.REDIS_KEY_RECHARGE_START, str(self.now))
+
+        self.assertFalse(tm.try_reserve(5))
+        self.assertTrue(tm.try_reserve(5, priority=PRIORITY_DEBUG))
+
+if __name__ == '__main__':
+    unittest.main()
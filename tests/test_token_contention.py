@@ -61,6 +61,21 @@ class TestTokenContention(unittest.TestCase):
     def tearDown(self):
         self.redis_patcher.stop()
 
+    def test_out_of_order_responses_never_raise_the_balance(self):
+        tm = TokenManager("fake_key")
+        # The overlapped light update arrives first but is collected after the commit
+        light_received_at = time.time()
+        time.sleep(0.01)
+        tm.update_after_call(40)            # commit response: the newer balance
+        tm.update_after_call(180, received_at=light_received_at)
+
+        self.assertEqual(tm.tokens, 40)
+        self.assertEqual(float(self.mock_redis.get('keepa_tokens_left')), 40)
+
+        # In order, the later response is applied as before
+        tm.update_after_call(35, received_at=time.time())
+        self.assertEqual(tm.tokens, 35)
+
     @patch('keepa_deals.keepa_api.get_token_status')
     def test_concurrent_access(self, mock_get_status):
         # Mock API return to reflect current Redis state (simulating consistent server state)
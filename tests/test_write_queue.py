@@ -0,0 +1,93 @@
+import unittest
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from keepa_deals import write_queue
+from keepa_deals.db_utils import get_db_connection
+from keepa_deals.write_queue import submit_write, run_write
+
+def _insert(value):
+    return lambda conn: conn.execute('INSERT INTO t (v) VALUES (?)', (value,)).lastrowid
+
+class TestWriteQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.db_path = os.path.join(self.tmpdir, 'deals.db')
+        with get_db_connection(self.db_path) as conn:
+            conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v INTEGER UNIQUE)')
+
+        self.statements = []
+        def traced_connection(db_path=None, timeout=5.0):
+            conn = get_db_connection(db_path, timeout)
+            conn.set_trace_callback(self.statements.append)
+            return conn
+        patcher = patch.object(write_queue, 'get_db_connection', side_effect=traced_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _values(self):
+        with get_db_connection(self.db_path) as conn:
+            return [row[0] for row in conn.execute('SELECT v FROM t ORDER BY v')]
+
+    def test_queued_writes_share_one_transaction(self):
+        started, release = threading.Event(), threading.Event()
+        def slow_write(conn):
+            started.set()
+            release.wait(5)
+            return _insert(0)(conn)
+
+        first = submit_write(slow_write, self.db_path)
+        self.assertTrue(started.wait(5))
+        # These queue up behind the running group and are committed together
+        futures = [submit_write(_insert(v), self.db_path) for v in range(1, 11)]
+        release.set()
+
+        self.assertEqual(first.result(5), 1)
+        self.assertEqual(sorted(f.result(5) for f in futures), list(range(2, 12)))
+        self.assertEqual(self._values(), list(range(11)))
+        self.assertEqual(self.statements.count('BEGIN IMMEDIATE'), 2)
+
+    def test_a_failing_write_does_not_affect_its_group(self):
+        started, release = threading.Event(), threading.Event()
+        def blocker(conn):
+            started.set()
+            release.wait(5)
+        submit_write(blocker, self.db_path)
+        self.assertTrue(started.wait(5))
+
+        def half_done(conn):
+            conn.execute('INSERT INTO t (v) VALUES (100)')
+            conn.execute('INSERT INTO t (v) VALUES (1)')  # duplicate: raises
+        ok_before = submit_write(_insert(1), self.db_path)
+        failing = submit_write(half_done, self.db_path)
+        ok_after = submit_write(_insert(2), self.db_path)
+        release.set()
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            failing.result(5)
+        ok_before.result(5)
+        ok_after.result(5)
+        # The failed write's first insert was rolled back with it
+        self.assertEqual(self._values(), [1, 2])
+
+    def test_writes_cannot_wait_on_the_writer_from_the_writer(self):
+        with self.assertRaises(RuntimeError):
+            run_write(lambda conn: run_write(_insert(1), self.db_path), self.db_path, timeout=5)
+
+    def test_disabled_queue_writes_inline(self):
+        with patch.object(write_queue, 'WRITE_QUEUE_ENABLED', False):
+            self.assertEqual(run_write(_insert(5), self.db_path), 1)
+        self.assertEqual(self._values(), [5])
+        self.assertNotIn('BEGIN IMMEDIATE', self.statements)
+
+if __name__ == '__main__':
+    unittest.main()
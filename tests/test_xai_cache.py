@@ -0,0 +1,77 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+import threading
+from unittest.mock import patch
+
+# Ensure local imports work
+sys.path.append(os.getcwd())
+
+from keepa_deals import xai_cache
+from keepa_deals.xai_cache import XaiCache
+
+class TestXaiCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.db_path = os.path.join(self.tmpdir.name, 'xai_cache.db')
+        self.json_path = os.path.join(self.tmpdir.name, 'xai_cache.json')
+
+    def _cache(self, **kwargs):
+        return XaiCache(db_path=self.db_path, legacy_json_path=self.json_path, **kwargs)
+
+    def test_legacy_json_is_migrated_once(self):
+        with open(self.json_path, 'w') as f:
+            json.dump({'seasonality:Book|Cat|Pub': 'Christmas', 'reasonableness:Book|x': 'True'}, f, indent=4)
+
+        cache = self._cache()
+        self.assertEqual(cache.get('seasonality:Book|Cat|Pub'), 'Christmas')
+        self.assertEqual(cache.get('reasonableness:Book|x'), 'True')
+        self.assertFalse(os.path.exists(self.json_path))
+        self.assertTrue(os.path.exists(self.json_path + '.migrated'))
+
+    def test_writes_are_shared_between_instances(self):
+        # Each Celery process holds its own instance; none may lose another's writes
+        caches = [self._cache() for _ in range(4)]
+        def writer(n, cache):
+            for i in range(25):
+                cache.set(f'seasonality:{n}-{i}', f'value {n}-{i}')
+        threads = [threading.Thread(target=writer, args=(n, cache)) for n, cache in enumerate(caches)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        fresh = self._cache()
+        for n in range(4):
+            for i in range(25):
+                self.assertEqual(fresh.get(f'seasonality:{n}-{i}'), f'value {n}-{i}')
+
+    def test_ttl_per_namespace(self):
+        cache = self._cache()
+        cache.set('seasonality:A', 'Christmas', now=1000)
+        cache.set('reasonableness:A', 'True', now=1000)
+        cache.set('other:A', {'n': 1}, now=1000)
+
+        later = 1000 + xai_cache.XAI_CACHE_TTLS['reasonableness'] + 1
+        self.assertEqual(cache.get('seasonality:A', now=later), 'Christmas')
+        self.assertIsNone(cache.get('reasonableness:A', now=later))
+        self.assertEqual(cache.get('other:A', now=later), {'n': 1})
+
+    def test_lru_eviction_bounds_size(self):
+        cache = self._cache(max_entries=2)
+        with patch.object(xai_cache, 'XAI_CACHE_EVICT_EVERY', 1), \
+             patch.object(xai_cache, 'XAI_CACHE_TOUCH_INTERVAL', 0):
+            cache.set('k:1', 'one', now=1000)
+            cache.set('k:2', 'two', now=1001)
+            cache.get('k:1', now=1002)  # k:2 is now least recently used
+            cache.set('k:3', 'three', now=1003)
+
+        self.assertEqual(cache.get('k:1', now=1004), 'one')
+        self.assertIsNone(cache.get('k:2', now=1004))
+        self.assertEqual(cache.get('k:3', now=1004), 'three')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+import os
+import sys
+import threading
+from datetime import date
+from unittest.mock import patch
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+from keepa_deals import xai_token_manager
+from keepa_deals.xai_token_manager import (
+    XaiTokenManager, XAI_CLASS_SEASONALITY, XAI_CLASS_MENTOR_CHAT, XAI_CLASS_HOMOGENIZATION,
+    XAI_CLASS_INFERENCE, XAI_CLASS_REASONABLENESS, XAI_CLASS_AVA_ADVICE,
+)
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401 - fakeredis needs it to run Lua scripts
+    HAS_LUA_REDIS = True
+except ImportError:
+    HAS_LUA_REDIS = False
+
+@unittest.skipUnless(HAS_LUA_REDIS, "fakeredis[lua] not installed")
+class TestXaiTokenManager(unittest.TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patcher = patch('redis.Redis.from_url',
+                        side_effect=lambda *a, **kw: fakeredis.FakeRedis(server=self.server, decode_responses=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _manager(self, daily_limit=10):
+        manager = XaiTokenManager(settings_path='does-not-exist.json')
+        manager.daily_limit = daily_limit
+        return manager
+
+    def test_parallel_processes_never_overshoot_the_daily_limit(self):
+        # One manager per process, all counting against the same Redis
+        managers = [self._manager(daily_limit=25) for _ in range(4)]
+        granted = []
+        def worker(manager):
+            for _ in range(20):
+                granted.append(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+        threads = [threading.Thread(target=worker, args=(m,)) for m in managers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(granted.count(True), 25)
+        self.assertEqual(managers[0].calls_today(), 25)
+        self.assertFalse(managers[0].may_call(XAI_CLASS_MENTOR_CHAT))
+
+    def test_batch_classes_leave_headroom_for_interactive_ones(self):
+        manager = self._manager(daily_limit=10)
+        share = xai_token_manager.CALLER_LIMITS[XAI_CLASS_HOMOGENIZATION][0]
+        allowed = sum(manager.request_permission(XAI_CLASS_HOMOGENIZATION) for _ in range(10))
+        self.assertEqual(allowed, int(10 * share))
+        self.assertFalse(manager.may_call(XAI_CLASS_HOMOGENIZATION))
+        self.assertTrue(manager.may_call(XAI_CLASS_MENTOR_CHAT))
+        self.assertEqual(manager.calls_today(XAI_CLASS_HOMOGENIZATION), allowed)
+
+    def test_batch_classes_together_cannot_exhaust_the_day(self):
+        manager = self._manager(daily_limit=10)
+        batch_limit = int(10 * (1 - xai_token_manager.XAI_INTERACTIVE_RESERVE))
+        # Each class alone could take 4-5 calls; together they stop at the batch cap
+        allowed = sum(manager.request_permission(caller) for caller in
+                      [XAI_CLASS_INFERENCE, XAI_CLASS_SEASONALITY, XAI_CLASS_REASONABLENESS] * 4)
+        self.assertEqual(allowed, batch_limit)
+        self.assertFalse(manager.may_call(XAI_CLASS_HOMOGENIZATION))
+
+        self.assertTrue(manager.request_permission(XAI_CLASS_AVA_ADVICE))
+        self.assertEqual(manager.calls_today(), batch_limit + 1)
+
+    def test_concurrency_slots_are_held_until_release(self):
+        manager = self._manager(daily_limit=100)
+        in_flight = xai_token_manager.CALLER_LIMITS[XAI_CLASS_SEASONALITY][1]
+        slots = [manager.acquire(XAI_CLASS_SEASONALITY) for _ in range(in_flight)]
+        self.assertTrue(all(slots))
+        self.assertIsNone(manager.acquire(XAI_CLASS_SEASONALITY, wait=0))
+        # The check reserves nothing
+        self.assertTrue(manager.may_call(XAI_CLASS_MENTOR_CHAT))
+
+        manager.release(slots[0])
+        with manager.call_slot(XAI_CLASS_SEASONALITY) as permitted:
+            self.assertTrue(permitted)
+            self.assertIsNone(manager.acquire(XAI_CLASS_SEASONALITY, wait=0))
+
+        # Slots of a caller that died are reclaimed once their lease expires
+        with patch.object(xai_token_manager, 'XAI_SLOT_LEASE_SECONDS', -1):
+            self.assertTrue(manager.request_permission(XAI_CLASS_SEASONALITY))
+
+    def test_in_flight_refusals_wait_for_a_slot_but_quota_refusals_do_not(self):
+        manager = self._manager(daily_limit=100)
+        in_flight = xai_token_manager.CALLER_LIMITS[XAI_CLASS_SEASONALITY][1]
+        slots = [manager.acquire(XAI_CLASS_SEASONALITY) for _ in range(in_flight)]
+
+        # A caller finishing while another waits hands its slot over
+        timer = threading.Timer(0.3, manager.release, args=(slots[0],))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertIsNotNone(manager.acquire(XAI_CLASS_SEASONALITY, wait=5))
+
+        # Over quota: denied at once, however long the caller would wait
+        manager.daily_limit = manager.calls_today()
+        with patch.object(xai_token_manager.time, 'sleep', side_effect=AssertionError('waited')):
+            self.assertIsNone(manager.acquire(XAI_CLASS_MENTOR_CHAT, wait=5))
+
+    def test_counts_roll_over_with_the_day(self):
+        manager = self._manager(daily_limit=1)
+        self.assertTrue(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+        self.assertFalse(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+
+        class Tomorrow(date):
+            @classmethod
+            def today(cls):
+                return date(2099, 1, 1)
+        with patch.object(xai_token_manager, 'date', Tomorrow):
+            self.assertTrue(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+
+    def test_falls_back_to_process_limits_without_redis(self):
+        manager = self._manager(daily_limit=2)
+        with patch.object(manager.redis_client, 'evalsha', side_effect=redis.ConnectionError('down')), \
+             patch.object(manager.redis_client, 'script_load', side_effect=redis.ConnectionError('down')):
+            slot = manager.acquire(XAI_CLASS_MENTOR_CHAT)
+            self.assertIsNotNone(slot)
+            manager.release(slot)
+            self.assertTrue(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+            self.assertFalse(manager.request_permission(XAI_CLASS_MENTOR_CHAT))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,6 +12,8 @@ import uuid
 from dotenv import load_dotenv
 import tempfile
 import time
+import threading
+import gzip
 from datetime import datetime
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api.proxies import GenericProxyConfig
@@ -36,11 +38,21 @@ from keepa_deals.business_calculations import (
     load_settings as business_load_settings,
 )
 from keepa_deals.janitor import _clean_stale_deals_logic
-from keepa_deals.ava_advisor import generate_ava_advice, generate_tooltip_advice, get_mentor_config, load_strategies, load_intelligence, query_xai_api, STRATEGIC_CORRECTIONS
+from keepa_deals import deal_filters
+from keepa_deals.write_queue import run_write
+from keepa_deals.data_version import cached_count, data_version, subscribe_events
+from keepa_deals.ava_advisor import load_tooltip_cache, query_xai_api
+from keepa_deals.ava_jobs import JOB_TOOLTIP, JOB_AVA_ADVICE, JOB_MENTOR_CHAT, JobLimitReached, get_job, run_job, submit_job
+from keepa_deals.xai_token_manager import XAI_CLASS_LEARN
 from keepa_deals.maintenance_tasks import homogenize_intelligence_task
 from keepa_deals.inventory_import import fetch_existing_inventory_task, process_bulk_cost_upload, export_missing_costs_csv
 from keepa_deals.sp_api_tasks import fetch_amazon_orders_task
 import redis
+from kombu.exceptions import OperationalError
+try:
+    import brotli
+except ImportError:
+    brotli = None
 # from keepa_deals.recalculator import recalculate_deals # This causes a hang
 # from keepa_deals.Keepa_Deals import run_keepa_script
 
@@ -126,7 +138,7 @@ def extract_strategies(full_text):
         "temperature": 0.2
     }
     
-    primary_data = query_xai_api(xai_payload)
+    primary_data = query_xai_api(xai_payload, caller=XAI_CLASS_LEARN)
 
     if primary_data and 'choices' in primary_data and primary_data['choices']:
         content = primary_data['choices'][0].get('message', {}).get('content')
@@ -179,7 +191,7 @@ def extract_conceptual_ideas(full_text):
         "temperature": 0.3
     }
     
-    response_data = query_xai_api(xai_payload)
+    response_data = query_xai_api(xai_payload, caller=XAI_CLASS_LEARN)
 
     if response_data and 'choices' in response_data and response_data['choices']:
         content = response_data['choices'][0].get('message', {}).get('content')
@@ -1142,55 +1154,52 @@ def confirm_purchase():
         settings = business_load_settings()
         prep_fee_at_purchase = float(settings.get('prep_fee_per_book', 0.0))
 
-        with get_db_connection(DB_PATH) as conn:
-            conn.row_factory = sqlite3.Row
+        def confirm(conn):
             cursor = conn.cursor()
-            
+            cursor.row_factory = sqlite3.Row
+
             # 1. Fetch the row from inventory_ledger to get snapshots and other fields
             cursor.execute("SELECT * FROM inventory_ledger WHERE id = ?", (ledger_id,))
             row = cursor.fetchone()
             if not row:
-                return jsonify({'error': 'Potential buy not found'}), 404
+                return False
 
             asin = row['asin']
 
-            conn.execute("BEGIN TRANSACTION")
+            # 2. Insert into confirmed_buys
+            # Convert snapshot_shipping_included to int (0 or 1) rather than float
+            si_val = row['snapshot_shipping_included']
+            si_int = int(si_val) if si_val is not None else None
 
-            try:
-                # 2. Insert into confirmed_buys
-                # Convert snapshot_shipping_included to int (0 or 1) rather than float
-                si_val = row['snapshot_shipping_included']
-                si_int = int(si_val) if si_val is not None else None
+            cursor.execute('''
+                INSERT INTO confirmed_buys (
+                    asin, title, condition, buy_cost, purchase_date, quantity_purchased,
+                    prep_fee_at_purchase, buyer_order_id, source_deal_id,
+                    snapshot_list_at, snapshot_fba_fee, snapshot_referral_pct, snapshot_shipping_included,
+                    snapshot_estimated_tax, snapshot_estimated_shipping, snapshot_prep_fee
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                asin, row['title'], condition, buy_cost, purchase_date, qty,
+                prep_fee_at_purchase, buyer_order_id, None,
+                row['snapshot_list_at'], row['snapshot_fba_fee'], row['snapshot_referral_pct'], si_int,
+                row['snapshot_estimated_tax'], row['snapshot_estimated_shipping'], row['snapshot_prep_fee']
+            ))
 
+            confirmed_buy_id = cursor.lastrowid
+
+            # 3. Insert into confirmed_buy_units
+            if sku:
                 cursor.execute('''
-                    INSERT INTO confirmed_buys (
-                        asin, title, condition, buy_cost, purchase_date, quantity_purchased,
-                        prep_fee_at_purchase, buyer_order_id, source_deal_id,
-                        snapshot_list_at, snapshot_fba_fee, snapshot_referral_pct, snapshot_shipping_included,
-                        snapshot_estimated_tax, snapshot_estimated_shipping, snapshot_prep_fee
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    asin, row['title'], condition, buy_cost, purchase_date, qty,
-                    prep_fee_at_purchase, buyer_order_id, None,
-                    row['snapshot_list_at'], row['snapshot_fba_fee'], row['snapshot_referral_pct'], si_int,
-                    row['snapshot_estimated_tax'], row['snapshot_estimated_shipping'], row['snapshot_prep_fee']
-                ))
-                
-                confirmed_buy_id = cursor.lastrowid
-                
-                # 3. Insert into confirmed_buy_units
-                if sku:
-                    cursor.execute('''
-                        INSERT INTO confirmed_buy_units (confirmed_buy_id, sku) VALUES (?, ?)
-                    ''', (confirmed_buy_id, sku))
+                    INSERT INTO confirmed_buy_units (confirmed_buy_id, sku) VALUES (?, ?)
+                ''', (confirmed_buy_id, sku))
 
-                # 4. Delete from inventory_ledger
-                cursor.execute("DELETE FROM inventory_ledger WHERE id = ?", (ledger_id,))
+            # 4. Delete from inventory_ledger
+            cursor.execute("DELETE FROM inventory_ledger WHERE id = ?", (ledger_id,))
+            return True
 
-                conn.execute("COMMIT")
-            except Exception as inner_e:
-                conn.execute("ROLLBACK")
-                raise inner_e
+        # Runs as one unit on the shared writer: all three statements commit or none do
+        if not run_write(confirm, DB_PATH):
+            return jsonify({'error': 'Potential buy not found'}), 404
 
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -2100,33 +2109,75 @@ def refresh_prime_picks():
         app.logger.error(f"Failed to start Prime Picks task: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+def _filtered_deal_count(filters, user_id=None, conn=None):
+    """
+    (count, max id) of the deals matching `filters`. Cached until the next write to the
+    feed bumps the data version (see keepa_deals.data_version), so dashboard polls of an
+    unchanged table do not touch SQLite. Without `conn` a connection is only opened on a miss.
+    """
+    # Restrictions only change the count through hide_gated
+    join_user = user_id if filters.get('hide_gated') else None
+
+    def run(count_conn):
+        keyword_index = deal_filters.keyword_index_ready(count_conn, DB_PATH)
+        count_sql, params = deal_filters.count_query(filters, join_user, keyword_index)
+        return tuple(count_conn.execute(count_sql, params).fetchone())
+
+    def count():
+        if conn is not None:
+            return run(conn)
+        with get_db_connection(DB_PATH) as count_conn:
+            # Ensure the table exists before querying
+            if not deal_filters.deal_columns(count_conn, DB_PATH):
+                return (0, 0)
+            return run(count_conn)
+
+    return cached_count((DB_PATH, 'count', deal_filters.filter_key(filters), join_user), count)
+
+# Bodies smaller than this are not worth compressing.
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', '1024'))
+
+def _compressed(response):
+    """
+    Compresses a JSON response body for clients that accept it: brotli when the optional
+    `brotli` package is installed, otherwise gzip. Small bodies are sent as they are.
+    """
+    accepted = request.headers.get('Accept-Encoding', '').lower()
+    if response.direct_passthrough or len(response.get_data()) < RESPONSE_COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(response.get_data(), quality=4))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=5))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/api/deals')
 def api_deals():
     try:
         # DB_PATH is now imported from db_utils
         TABLE_NAME = 'deals'
-        RESTRICTIONS_TABLE = 'user_restrictions'
 
         # Check SP-API connection status from session
         is_sp_api_connected = session.get('sp_api_connected', False)
         user_id = session.get('sp_api_user_id')
 
-        # --- Connect and get column names ---
+        # --- Connect and get column names (cached per process, see deal_filters) ---
         conn = get_db_connection(DB_PATH)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
 
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (TABLE_NAME,))
-        if cursor.fetchone() is None:
+        available_columns = deal_filters.deal_columns(conn, DB_PATH)
+        keyword_index = deal_filters.keyword_index_ready(conn, DB_PATH)
+        if not available_columns:
             conn.close()
             return jsonify({
                 "pagination": {"total_records": 0, "total_pages": 0, "current_page": 1, "limit": 50},
                 "deals": [],
                 "message": "No data found. Please run a scan."
             })
-
-        cursor.execute(f"PRAGMA table_info({TABLE_NAME})")
-        available_columns = [row['name'] for row in cursor.fetchall()]
     except sqlite3.Error as e:
         app.logger.error(f"Database error when fetching column info: {e}")
         return jsonify({"error": "Database error", "message": str(e)}), 500
@@ -2140,191 +2191,54 @@ def api_deals():
     if order not in ['asc', 'desc']:
         order = 'asc'
 
-    # --- Filtering ---
-    filters = {
-        "agents_choice": request.args.get('agents_choice', type=str) == 'true',
-        "sales_rank_current_lte": request.args.get('sales_rank_current_lte', type=int),
-        "roi_gte": request.args.get('roi_gte', type=int),
-        "drops_30_gte": request.args.get('drops_30_gte', type=int),
-        "keyword": request.args.get('keyword', type=str),
-        "deal_trust_gte": request.args.get('deal_trust_gte', type=int),
-        "seller_trust_gte": request.args.get('seller_trust_gte', type=int),
-        "profit_gte": request.args.get('profit_gte', type=float),
-        "percent_down_gte": request.args.get('percent_down_gte', type=int),
-        "hide_gated": request.args.get('hide_gated', type=int),
-        "hide_amz": request.args.get('hide_amz', type=int),
-        "excluded_conditions": request.args.get('excluded_conditions', type=str)
-    }
-    where_clauses = []
-    filter_params = []
-
-    # Exclude Condition Filtering
-    if filters.get("excluded_conditions"):
-        cond_list = filters["excluded_conditions"].split(',')
-        # We process exclusions by adding AND clauses.
-        # Since DB can have '1' OR 'New', we must exclude BOTH representations.
-
-        for c in cond_list:
-            if c == 'New':
-                # Strict check for New to avoid excluding 'New, other' if desired, or exclude all New variations?
-                # Usually 'New' means new condition.
-                where_clauses.append("(\"Condition\" != '1' AND \"Condition\" != 'New' AND \"Condition\" NOT LIKE 'New, %')")
-            elif c == 'U-Like New':
-                where_clauses.append("(\"Condition\" != '2' AND \"Condition\" != 'like new' AND \"Condition\" != 'Used - Like New')")
-            elif c == 'U-Very Good':
-                where_clauses.append("(\"Condition\" != '3' AND \"Condition\" != 'very good' AND \"Condition\" != 'Used - Very Good')")
-            elif c == 'U-Good':
-                where_clauses.append("(\"Condition\" != '4' AND \"Condition\" != 'good' AND \"Condition\" != 'Used - Good')")
-            elif c == 'U-Acceptable':
-                where_clauses.append("(\"Condition\" != '5' AND \"Condition\" != 'acceptable' AND \"Condition\" != 'Used - Acceptable')")
-            elif c == 'Collectible':
-                # Exclude anything starting with Collectible or C-
-                where_clauses.append("(\"Condition\" NOT LIKE 'Collectible%' AND \"Condition\" NOT LIKE 'C-%' AND \"Condition\" NOT LIKE 'C -%')")
-
-    # (Existing filter logic remains the same...)
-    if filters.get("sales_rank_current_lte") is not None:
-        where_clauses.append("\"Sales_Rank_Current\" <= ?")
-        filter_params.append(filters["sales_rank_current_lte"])
-
-    # New ROI Filter: (Profit / All_in_Cost) * 100
-    if filters.get("roi_gte") is not None and filters["roi_gte"] > 0:
-        # Prevent division by zero and negative/zero cost issues by ensuring Cost > 0
-        # Robustly handle currency symbols (e.g., "$15.00") by stripping $ and , before casting
-        sanitized_cost = "CAST(REPLACE(REPLACE(\"All_in_Cost\", '$', ''), ',', '') AS REAL)"
-        sanitized_profit = "CAST(REPLACE(REPLACE(\"Profit\", '$', ''), ',', '') AS REAL)"
-        where_clauses.append(f"({sanitized_cost} > 0 AND (({sanitized_profit} * 1.0 / {sanitized_cost}) * 100) >= ?)")
-        filter_params.append(filters["roi_gte"])
-
-    # New Drops Filter
-    if filters.get("drops_30_gte") is not None and filters["drops_30_gte"] > 0:
-        where_clauses.append("\"Sales_Rank_Drops_last_30_days\" >= ?")
-        filter_params.append(filters["drops_30_gte"])
-
-    if filters.get("keyword"):
-        keyword_like = f"%{filters['keyword']}%"
-        keyword_clauses = ["\"Title\" LIKE ?", "\"Categories_Sub\" LIKE ?", "\"Detailed_Seasonality\" LIKE ?", "\"Manufacturer\" LIKE ?", "\"Author\" LIKE ?", "\"Seller\" LIKE ?"]
-        where_clauses.append(f"({ ' OR '.join(keyword_clauses) })")
-        filter_params.extend([keyword_like] * len(keyword_clauses))
-
-    # New Filters
-    if filters.get("deal_trust_gte") is not None and filters["deal_trust_gte"] > 0:
-        # Cast to INTEGER to handle text values like '75%' correctly against numerical threshold
-        where_clauses.append("CAST(REPLACE(\"Deal_Trust\", '%', '') AS REAL) >= ?")
-        filter_params.append(filters["deal_trust_gte"])
-
-    if filters.get("seller_trust_gte") is not None and filters["seller_trust_gte"] > 0:
-        # User input is 0-10, DB is 0-1 (Wilson Score).
-        # Display logic rounds to nearest tenth (0.95 -> 10/10, 0.85 -> 9/10).
-        # We adjust the filter to match the rounding lower bound: (input - 0.5) / 10.0
-        seller_trust_db_value = (filters["seller_trust_gte"] - 0.5) / 10.0
-        where_clauses.append("\"Seller_Quality_Score\" >= ?")
-        filter_params.append(seller_trust_db_value)
-
-    # Enforce Profit > 0 by default to exclude negative/zero profit deals
-    # Robustly handle currency symbols
-    sanitized_profit = "CAST(REPLACE(REPLACE(\"Profit\", '$', ''), ',', '') AS REAL)"
-    sanitized_cost = "CAST(REPLACE(REPLACE(\"All_in_Cost\", '$', ''), ',', '') AS REAL)"
-    if filters.get("agents_choice"):
-        # The Smart Floor
-        where_clauses.append(f"{sanitized_profit} >= 10")
-        where_clauses.append(f"({sanitized_cost} > 0 AND (({sanitized_profit} * 1.0 / {sanitized_cost}) * 100) >= 15)")
-        where_clauses.append("CAST(REPLACE(\"Deal_Trust\", '%', '') AS REAL) >= 40")
-
-        sanitized_list_at = "CAST(REPLACE(REPLACE(\"List_at\", '$', ''), ',', '') AS REAL)"
-        where_clauses.append(f"{sanitized_list_at} <= 1500")
-
-        # Enforce Data Completeness (Global Filters) - Keep them for Smart Floor
-        where_clauses.append("\"List_at\" IS NOT NULL")
-        where_clauses.append(f"{sanitized_list_at} > 0")
-        where_clauses.append("\"1yr_Avg\" IS NOT NULL")
-        where_clauses.append("\"1yr_Avg\" NOT IN ('-', 'N/A', '', '0', '0.00', '$0.00')")
-        where_clauses.append("\"1yr_Avg\" != 0")
-    else:
-        if filters.get("profit_gte") is None or filters["profit_gte"] <= 0:
-            where_clauses.append(f"{sanitized_profit} > 0")
-        else:
-            where_clauses.append(f"{sanitized_profit} >= ?")
-            filter_params.append(filters["profit_gte"])
-
-        # Enforce Data Completeness (Global Filters)
-        # Using correct column names from DB schema: 'List_at' (sanitized, but originally had space) and '1yr_Avg'
-        # Wait, 'List at' sanitizes to 'List_at' in db_utils.py, but pragma output showed 'List_at' and '1yr_Avg'.
-        # The grep output confirms: 14|1yr_Avg|TEXT and 236|List_at|REAL.
-        # So underscores ARE correct in the DB schema for these specific columns.
-
-        where_clauses.append("\"List_at\" IS NOT NULL")
-        where_clauses.append("\"List_at\" > 0")
-        where_clauses.append("\"1yr_Avg\" IS NOT NULL")
-        # Filter out common placeholders for missing data in TEXT column and ensure numeric validity
-        where_clauses.append("\"1yr_Avg\" NOT IN ('-', 'N/A', '', '0', '0.00', '$0.00')")
-        where_clauses.append("\"1yr_Avg\" != 0")
-
-    if filters.get("percent_down_gte") is not None and filters["percent_down_gte"] > 0:
-        # Cast to INTEGER to handle text values like '20%' correctly against numerical threshold
-        where_clauses.append("CAST(\"Percent_Down\" AS INTEGER) >= ?")
-        filter_params.append(filters["percent_down_gte"])
-
-    if filters.get("hide_gated") == 1:
-        # Exclude restricted items (is_restricted = 1).
-        # Only apply if connected, otherwise ignore this filter to prevent SQL error (missing 'ur' alias).
-        if is_sp_api_connected and user_id:
-             # Include NULL (Pending), 0 (Not Restricted), -1 (Error).
-             where_clauses.append("(ur.is_restricted IS NULL OR ur.is_restricted != 1)")
-        # If not connected, we can't filter gated items, so we default to showing them (safe fail-open).
-
-    if filters.get("hide_amz") == 1:
-        # Exclude items where Amazon is selling (AMZ column has warning icon '⚠️').
-        where_clauses.append("(d.\"AMZ\" IS NULL OR d.\"AMZ\" != '⚠️')")
-
+    # --- Filtering (shared with deal_count) ---
+    filters = deal_filters.parse_filters(request.args)
+    # Restriction status (and the hide_gated filter) need a connected SP-API user
+    restrictions_user = user_id if is_sp_api_connected and user_id else None
+
+    # --- Keyset Pagination ---
+    # Passing `cursor` (empty for the first page) switches from page/OFFSET to keyset
+    # paging: each response carries `next_cursor`, and every page costs the same no
+    # matter how deep it is. Rows inserted meanwhile never shift or repeat a page.
+    page_cursor = request.args.get('cursor', type=str)
+    keyset_after = None
+    # --- Projection ---
+    # `columns=<set>` selects a named column set (deal_filters.COLUMN_SETS) instead of
+    # every deals column; `format=columnar` returns `columns` once and `rows` as arrays.
+    column_set = request.args.get('columns', type=str)
+    select_columns = None
+    if column_set:
+        try:
+            select_columns = deal_filters.projection(column_set, available_columns)
+        except ValueError as e:
+            conn.close()
+            return jsonify({"error": "Bad Request", "message": str(e)}), 400
+    columnar = request.args.get('format') == 'columnar'
+    if page_cursor:
+        try:
+            keyset_after = deal_filters.decode_cursor(page_cursor, sort_by, order)
+        except ValueError as e:
+            conn.close()
+            return jsonify({"error": "Bad Request", "message": str(e)}), 400
+    next_cursor = None
 
     # --- Build and Execute Query ---
     try:
-        # Refactored to remove 'd' alias and use 'deals' explicitly to match deal_count success pattern
-        select_clause = "deals.*"
-        from_clause = f"FROM {TABLE_NAME}"
-        query_params = []
-
-        if is_sp_api_connected and user_id:
-            select_clause += ", ur.is_restricted, ur.approval_url"
-            from_clause += f" LEFT JOIN {RESTRICTIONS_TABLE} AS ur ON deals.\"ASIN\" = ur.asin AND ur.user_id = ?"
-            query_params.append(user_id)
-        
-        query_params.extend(filter_params)
-
-        # Ensure where clauses use table name if they were using alias 'd.'
-        final_where_clauses = []
-        for clause in where_clauses:
-            final_where_clauses.append(clause.replace('d.', 'deals.'))
-
-        where_sql = " WHERE " + " AND ".join(final_where_clauses) if final_where_clauses else ""
+        sort_clause = deal_filters.sort_clause(sort_by, available_columns, bool(restrictions_user))
+        data_query, query_params = deal_filters.page_query(filters, sort_clause, order, restrictions_user, keyword_index,
+                                                             select_columns)
 
-        # Get total count (filtered)
-        count_query = f"SELECT COUNT(*) {from_clause}{where_sql}"
-        total_records = cursor.execute(count_query, query_params).fetchone()[0]
+        # Get total count (filtered); shared with /api/deal-count
+        total_records = _filtered_deal_count(filters, restrictions_user, conn)[0]
         total_pages = (total_records + limit - 1) // limit if limit > 0 else 1
 
         # Get absolute total count (unfiltered) for UI notification logic
-        total_db_records = cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0]
+        total_db_records = cached_count(
+            (DB_PATH, 'total'), lambda: cursor.execute(f"SELECT COUNT(*) FROM {TABLE_NAME}").fetchone()[0])
 
         # Get data for the current page
         query_params.extend([limit, offset])
 
-        if sort_by == 'Gated':
-            if is_sp_api_connected and user_id:
-                sort_clause = 'ur.is_restricted'
-            else:
-                sort_clause = 'deals."id"'
-        elif sort_by == 'ROI':
-            # Dynamically calculate and sort by ROI: (Profit / All_in_Cost)
-            # Use CAST and NULLIF to prevent division by zero errors in SQLite
-            sort_clause = '(CAST(deals."Profit" AS REAL) / NULLIF(CAST(deals."All_in_Cost" AS REAL), 0))'
-        elif sort_by in available_columns:
-            sort_clause = f'deals."{sort_by}"'
-        else:
-            sort_clause = 'deals."id"'
-
-        data_query = f"SELECT {select_clause} {from_clause}{where_sql} ORDER BY {sort_clause} {order} LIMIT ? OFFSET ?"
-
         # Log the query for debugging
         app.logger.debug(f"Executing Deals Query: {data_query} | Params: {query_params}")
 
@@ -2333,19 +2247,8 @@ def api_deals():
         if filters.get("agents_choice"):
             # Fetch cached Prime Picks from background task
             # Apply all existing UI filters via JOIN
-            select_clause = select_clause.replace("deals.*", "deals.*, pp.rank, pp.score")
-            from_clause = f"FROM prime_picks pp INNER JOIN {TABLE_NAME} AS deals ON pp.asin = deals.\"ASIN\""
-
-            if is_sp_api_connected and user_id:
-                from_clause += f" LEFT JOIN {RESTRICTIONS_TABLE} AS ur ON deals.\"ASIN\" = ur.asin AND ur.user_id = ?"
-
-            # Replace 'deals.' in where_clauses if any was prepended
-            where_sql = " WHERE " + " AND ".join(final_where_clauses) if final_where_clauses else ""
-
-            agents_choice_query = f"SELECT {select_clause} {from_clause}{where_sql} ORDER BY pp.rank ASC"
-
-            # The query_params have limit/offset appended at the end. We need to remove them for this fetch
-            agents_choice_params = query_params[:-2]
+            agents_choice_query, agents_choice_params = deal_filters.prime_picks_query(filters, restrictions_user, keyword_index,
+                                                                                       select_columns)
 
             app.logger.debug(f"Executing Cached Prime Picks Query: {agents_choice_query} | Params: {agents_choice_params}")
             deal_rows = cursor.execute(agents_choice_query, agents_choice_params).fetchall()
@@ -2363,6 +2266,21 @@ def api_deals():
             total_pages = 1
             page = 1
 
+        elif page_cursor is not None:
+            # One extra row tells whether another page follows
+            deal_rows = []
+            for keyset_query, keyset_params in deal_filters.keyset_page_queries(
+                    filters, sort_clause, order, restrictions_user, keyset_after, keyword_index, select_columns):
+                deal_rows += cursor.execute(keyset_query, keyset_params + [limit + 1 - len(deal_rows)]).fetchall()
+                if len(deal_rows) > limit:
+                    break
+            deals_list = [dict(row) for row in deal_rows[:limit]]
+            if deals_list and len(deal_rows) > limit:
+                last_deal = deals_list[-1]
+                next_cursor = deal_filters.encode_cursor(sort_by, order, last_deal['_sort_key'], last_deal['ASIN'])
+            for deal in deals_list:
+                deal.pop('_sort_key', None)
+
         else:
             deal_rows = cursor.execute(data_query, query_params).fetchall()
             deals_list = [dict(row) for row in deal_rows]
@@ -2418,12 +2336,19 @@ def api_deals():
             "total_pages": total_pages,
             "current_page": page,
             "limit": limit,
+            "next_cursor": next_cursor,
             "prime_picks_generated_at": prime_picks_generated_at
         },
-        "deals": deals_list
     }
-    
-    return jsonify(response)
+    if columnar:
+        # Every row has the same keys, so the names are sent once
+        columns = list(deals_list[0]) if deals_list else list(select_columns or sorted(available_columns))
+        response["columns"] = columns
+        response["rows"] = [[deal.get(c) for c in columns] for deal in deals_list]
+    else:
+        response["deals"] = deals_list
+
+    return _compressed(jsonify(response))
 
 @app.route('/api/recalc-status')
 def recalc_status():
@@ -2449,16 +2374,24 @@ def debug_deal(asin):
     if not session.get('logged_in'):
         return jsonify({'error': 'Not authenticated'}), 401
 
-    from keepa_deals.keepa_api import fetch_product_batch
-    from keepa_deals.token_manager import TokenManager
+    from keepa_deals.keepa_api import fetch_product_batch, split_cached
+    from keepa_deals.request_scheduler import TokenCostModel, PEEK
+    from keepa_deals.token_manager import TokenManager, PRIORITY_DEBUG
 
     # Use the KEEPA_API_KEY defined at the top of the file
     if not KEEPA_API_KEY:
         return jsonify({'error': 'KEEPA_API_KEY not configured on server.'}), 500
 
+    # Interactive class: skips the background wait queue, but never blocks the request
+    token_manager = TokenManager(KEEPA_API_KEY, priority=PRIORITY_DEBUG)
+    cached, to_fetch = split_cached([asin], days=365, offers=20)
+    if to_fetch and not token_manager.try_reserve(TokenCostModel(token_manager.redis_client).estimate(PEEK, len(to_fetch))):
+        return jsonify({'error': 'Keepa token budget exhausted, try again shortly.', 'asin': asin}), 503
+
     # The fetch_product_batch function expects a list of ASINs
-    # We now receive tokens_left as well, so we unpack it and ignore it with _.
-    product_data, api_info, tokens_consumed, _ = fetch_product_batch(KEEPA_API_KEY, [asin])
+    product_data, api_info, tokens_consumed, tokens_left = fetch_product_batch(KEEPA_API_KEY, [asin], cached=cached)
+    if tokens_left is not None:
+        token_manager.update_after_call(tokens_left)
 
     if api_info and api_info.get('error_status_code'):
         return jsonify({
@@ -2673,140 +2606,117 @@ def deal_count():
          return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
 
     try:
-        with get_db_connection(DB_PATH) as conn:
-            cursor = conn.cursor()
-            # Ensure the table exists before querying
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='deals'")
-            if not cursor.fetchone():
-                 return jsonify({'count': 0, 'max_id': 0})
-
-            # Filtering Logic (Same as api_deals)
-            filters = {
-                "sales_rank_current_lte": request.args.get('sales_rank_current_lte', type=int),
-                "roi_gte": request.args.get('roi_gte', type=int),
-                "drops_30_gte": request.args.get('drops_30_gte', type=int),
-                "keyword": request.args.get('keyword', type=str),
-                "deal_trust_gte": request.args.get('deal_trust_gte', type=int),
-                "seller_trust_gte": request.args.get('seller_trust_gte', type=int),
-                "profit_gte": request.args.get('profit_gte', type=float),
-                "percent_down_gte": request.args.get('percent_down_gte', type=int),
-                "hide_gated": request.args.get('hide_gated', type=int),
-                "hide_amz": request.args.get('hide_amz', type=int),
-                "excluded_conditions": request.args.get('excluded_conditions', type=str)
-            }
-            where_clauses = []
-            filter_params = []
-
-            # Exclude Condition Filtering
-            if filters.get("excluded_conditions"):
-                cond_list = filters["excluded_conditions"].split(',')
-
-                for c in cond_list:
-                    if c == 'New':
-                        where_clauses.append("(\"Condition\" != '1' AND \"Condition\" != 'New' AND \"Condition\" NOT LIKE 'New, %')")
-                    elif c == 'U-Like New':
-                        where_clauses.append("(\"Condition\" != '2' AND \"Condition\" != 'like new' AND \"Condition\" != 'Used - Like New')")
-                    elif c == 'U-Very Good':
-                        where_clauses.append("(\"Condition\" != '3' AND \"Condition\" != 'very good' AND \"Condition\" != 'Used - Very Good')")
-                    elif c == 'U-Good':
-                        where_clauses.append("(\"Condition\" != '4' AND \"Condition\" != 'good' AND \"Condition\" != 'Used - Good')")
-                    elif c == 'U-Acceptable':
-                        where_clauses.append("(\"Condition\" != '5' AND \"Condition\" != 'acceptable' AND \"Condition\" != 'Used - Acceptable')")
-                    elif c == 'Collectible':
-                        where_clauses.append("(\"Condition\" NOT LIKE 'Collectible%' AND \"Condition\" NOT LIKE 'C-%' AND \"Condition\" NOT LIKE 'C -%')")
-
-            # Determine connection status for Gated check
-            # We need to join user_restrictions for the count if hide_gated is used.
-            is_sp_api_connected = session.get('sp_api_connected', False)
-            user_id = session.get('sp_api_user_id')
-
-            join_clause = ""
-            if filters.get("hide_gated") == 1 and is_sp_api_connected and user_id:
-                join_clause = f" LEFT JOIN user_restrictions AS ur ON deals.ASIN = ur.asin AND ur.user_id = ?"
-                # We need to inject user_id into params *before* filter params if we use it in JOIN
-                # But sqlite parameter order matters.
-                # Actually, filtering is in WHERE clause.
-                # If we put user_id in JOIN condition, it needs to be passed.
-                # Let's handle params order carefully.
-
-            # Param Handling for Join
-            params = []
-            if filters.get("hide_gated") == 1 and is_sp_api_connected and user_id:
-                params.append(user_id)
-
-            if filters.get("sales_rank_current_lte") is not None:
-                where_clauses.append("\"Sales_Rank_Current\" <= ?")
-                filter_params.append(filters["sales_rank_current_lte"])
-
-            # New ROI Filter
-            if filters.get("roi_gte") is not None and filters["roi_gte"] > 0:
-                sanitized_cost = "CAST(REPLACE(REPLACE(\"All_in_Cost\", '$', ''), ',', '') AS REAL)"
-                sanitized_profit = "CAST(REPLACE(REPLACE(\"Profit\", '$', ''), ',', '') AS REAL)"
-                where_clauses.append(f"({sanitized_cost} > 0 AND (({sanitized_profit} * 1.0 / {sanitized_cost}) * 100) >= ?)")
-                filter_params.append(filters["roi_gte"])
-
-            # New Drops Filter
-            if filters.get("drops_30_gte") is not None and filters["drops_30_gte"] > 0:
-                where_clauses.append("\"Sales_Rank_Drops_last_30_days\" >= ?")
-                filter_params.append(filters["drops_30_gte"])
-
-            if filters.get("keyword"):
-                keyword_like = f"%{filters['keyword']}%"
-                keyword_clauses = ["\"Title\" LIKE ?", "\"Categories_Sub\" LIKE ?", "\"Detailed_Seasonality\" LIKE ?", "\"Manufacturer\" LIKE ?", "\"Author\" LIKE ?", "\"Seller\" LIKE ?"]
-                where_clauses.append(f"({ ' OR '.join(keyword_clauses) })")
-                filter_params.extend([keyword_like] * len(keyword_clauses))
-
-            if filters.get("deal_trust_gte") is not None and filters["deal_trust_gte"] > 0:
-                where_clauses.append("CAST(REPLACE(\"Deal_Trust\", '%', '') AS REAL) >= ?")
-                filter_params.append(filters["deal_trust_gte"])
-
-            if filters.get("seller_trust_gte") is not None and filters["seller_trust_gte"] > 0:
-                # User input is 0-10, DB is 0-1 (Wilson Score).
-                # Match rounding lower bound: (input - 0.5) / 10.0
-                seller_trust_db_value = (filters["seller_trust_gte"] - 0.5) / 10.0
-                where_clauses.append("\"Seller_Quality_Score\" >= ?")
-                filter_params.append(seller_trust_db_value)
-
-            # Enforce Profit > 0 by default to exclude negative/zero profit deals
-            sanitized_profit = "CAST(REPLACE(REPLACE(\"Profit\", '$', ''), ',', '') AS REAL)"
-            if filters.get("profit_gte") is None or filters["profit_gte"] <= 0:
-                where_clauses.append(f"{sanitized_profit} > 0")
-            else:
-                where_clauses.append(f"{sanitized_profit} >= ?")
-                filter_params.append(filters["profit_gte"])
+        # Filtering Logic (shared with api_deals). The restrictions table is only
+        # joined when hide_gated is used by a connected SP-API user.
+        is_sp_api_connected = session.get('sp_api_connected', False)
+        user_id = session.get('sp_api_user_id')
+        filters = deal_filters.parse_filters(request.args)
+        filters.pop('agents_choice', None)  # The badge counts the regular feed
 
-            # Enforce Data Completeness (Global Filters) to match api_deals
-            where_clauses.append("\"List_at\" IS NOT NULL")
-            where_clauses.append("\"List_at\" > 0")
-            where_clauses.append("\"1yr_Avg\" IS NOT NULL")
-            where_clauses.append("\"1yr_Avg\" NOT IN ('-', 'N/A', '', '0', '0.00', '$0.00')")
-            where_clauses.append("\"1yr_Avg\" != 0")
+        count, max_id = _filtered_deal_count(filters, user_id if is_sp_api_connected else None)
+        return jsonify({'count': count or 0, 'max_id': max_id or 0})
+    except sqlite3.Error as e:
+        app.logger.error(f"Database error in deal_count: {e}")
+        return jsonify({'error': 'Database error', 'message': str(e)}), 500
 
-            if filters.get("percent_down_gte") is not None and filters["percent_down_gte"] > 0:
-                where_clauses.append("CAST(\"Percent_Down\" AS INTEGER) >= ?")
-                filter_params.append(filters["percent_down_gte"])
+# --- Server-Sent Events ---
+# Every open stream holds a mod_wsgi thread (agentarbitrage.conf: 2 processes x 5 threads),
+# so streams are capped per process; a refused dashboard falls back to polling.
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '3'))
+# Streams end after this long and the browser reconnects (EventSource `retry`).
+SSE_STREAM_SECONDS = int(os.getenv('SSE_STREAM_SECONDS', '300'))
+SSE_KEEPALIVE_SECONDS = 15
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
 
-            if filters.get("hide_gated") == 1:
-                # Same logic as api_deals: Only apply if connected
-                if is_sp_api_connected and user_id:
-                     where_clauses.append("(ur.is_restricted IS NULL OR ur.is_restricted != 1)")
+def _sse_message(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-            if filters.get("hide_amz") == 1:
-                where_clauses.append("(deals.\"AMZ\" IS NULL OR deals.\"AMZ\" != '⚠️')")
+@app.route('/api/events')
+def deal_events():
+    """
+    Pushes feed changes to the dashboard instead of polling: `deals` (data version,
+    writer, changed ASINs), `recalc` (recalculation progress) and `prime_picks` events,
+    published by the workers through Redis (keepa_deals.data_version). The first event,
+    `hello`, carries the current data version so a reconnecting client can tell whether
+    it missed a change.
+    """
+    if not session.get('logged_in'):
+        return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
 
-            where_sql = " WHERE " + " AND ".join(where_clauses) if where_clauses else ""
+    if not _sse_slots.acquire(blocking=False):
+        return jsonify({'error': 'Busy', 'message': 'Too many event streams. Poll instead.'}), 503
+    try:
+        pubsub = subscribe_events()
+        version = data_version()
+    except redis.RedisError as e:
+        _sse_slots.release()
+        app.logger.warning(f"Event stream unavailable: {e}")
+        return jsonify({'error': 'Unavailable', 'message': 'Event stream unavailable. Poll instead.'}), 503
+
+    def stream():
+        yield "retry: 5000\n\n"
+        yield _sse_message('hello', {'version': version})
+        deadline = time.monotonic() + SSE_STREAM_SECONDS
+        try:
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=SSE_KEEPALIVE_SECONDS)
+                if message is None:
+                    # Also how a closed connection is noticed: the write fails.
+                    yield ": keepalive\n\n"
+                    continue
+                data = json.loads(message['data'])
+                yield _sse_message(data.pop('event'), data)
+        except redis.RedisError as e:
+            app.logger.warning(f"Event stream lost Redis: {e}")
+
+    def close():
+        pubsub.close()
+        _sse_slots.release()
+
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(close)
+    return response
+
+# --- Ava (user-triggered xAI requests) ---
+# Answered by the `ava` Celery queue (keepa_deals.ava_jobs) rather than in the request:
+# an xAI call can take minutes with its retries, and would hold a mod_wsgi thread all along.
+# The endpoints return 202 with a job id; the page polls /api/ava-jobs/<job_id>.
+
+def _ava_response(result):
+    if 'error' in result:
+        return jsonify(result), 500
+    return jsonify(result)
+
+def _queue_ava_job(kind, params):
+    try:
+        job_id = submit_job(kind, session.get('username'), params)
+    except JobLimitReached:
+        return jsonify({'error': 'Too many questions in progress. Please wait for an answer first.'}), 429
+    except (redis.RedisError, OperationalError) as e:
+        # No queue to hand it to: answer inline as before
+        app.logger.warning(f"Ava queue unavailable, answering {kind} inline: {e}")
+        return _ava_response(run_job(kind, params))
+    return jsonify({'status': 'queued', 'job_id': job_id}), 202
+
+@app.route('/api/ava-jobs/<string:job_id>')
+def get_ava_job_result(job_id):
+    """202 while the job is queued or running, then the answer the endpoint would have returned."""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Not authenticated'}), 401
 
-            # Add filter params to the main params list
-            params.extend(filter_params)
+    try:
+        job = get_job(job_id)
+    except redis.RedisError as e:
+        app.logger.warning(f"Could not read Ava job {job_id}: {e}")
+        return jsonify({'error': 'Unavailable'}), 503
 
-            cursor.execute(f"SELECT COUNT(*), MAX(deals.id) FROM deals {join_clause} {where_sql}", params)
-            row = cursor.fetchone()
-            count = row[0] if row else 0
-            max_id = row[1] if row and row[1] else 0
-            return jsonify({'count': count, 'max_id': max_id})
-    except sqlite3.Error as e:
-        app.logger.error(f"Database error in deal_count: {e}")
-        return jsonify({'error': 'Database error', 'message': str(e)}), 500
+    if not job or job['user'] != session.get('username'):
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] in ('queued', 'running'):
+        return jsonify({'status': job['status']}), 202
+    return _ava_response(job['result'])
 
 @app.route('/api/tooltip/<string:term>')
 def get_tooltip_advice(term):
@@ -2818,8 +2728,11 @@ def get_tooltip_advice(term):
     decoded_term = urllib.parse.unquote(term)
 
     try:
-        advice = generate_tooltip_advice(decoded_term)
-        return jsonify({'tooltip': advice})
+        # Most terms are answered from the cache: no job needed
+        cached = load_tooltip_cache().get(decoded_term)
+        if cached:
+            return jsonify({'tooltip': cached})
+        return _queue_ava_job(JOB_TOOLTIP, {'term': decoded_term})
     except Exception as e:
         app.logger.error(f"Error in tooltip endpoint for term {term}: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -2841,10 +2754,9 @@ def get_ava_advice(asin):
                 return jsonify({'error': 'Deal not found'}), 404
 
             deal_data = dict(row)
-            mentor_type = request.args.get('mentor', 'cfo')
-            advice = generate_ava_advice(deal_data, mentor_type=mentor_type)
 
-            return jsonify({'advice': advice})
+        mentor_type = request.args.get('mentor', 'cfo')
+        return _queue_ava_job(JOB_AVA_ADVICE, {'deal': deal_data, 'mentor': mentor_type})
 
     except Exception as e:
         app.logger.error(f"Error in ava advice endpoint: {e}", exc_info=True)
@@ -2859,83 +2771,7 @@ def mentor_chat():
         data = request.json
         message = data.get('message', '')
         mentor_name = data.get('mentor', 'olyvia')
-
-        mentor = get_mentor_config(mentor_name)
-
-        # Load Strategy Context
-        strategies_text = load_strategies()
-        strategy_section = ""
-        if strategies_text:
-             strategy_section = f"""
-        **Learned Strategies Knowledge Base:**
-        {strategies_text}
-        """
-
-        # Load Intelligence Context
-        intelligence_text = load_intelligence()
-        intelligence_section = ""
-        if intelligence_text:
-             intelligence_section = f"""
-        **Learned Intelligence/Concepts Knowledge Base:**
-        {intelligence_text}
-        """
-
-        prompt = f"""
-        You are {mentor['name']}, {mentor['role']}.
-
-        **Your Persona:**
-        *   **Intro:** "{mentor['intro']}"
-        *   **Focus:** {mentor['focus']}
-        *   **Tone:** {mentor['tone']}
-        *   **Style:** {mentor['style_guide']}
-
-        **Context:**
-        You are chatting with a user (Tim) about online arbitrage, Amazon FBA, and business strategy.
-        Use your specific persona and the knowledge bases below to answer their questions.
-        Prioritize the strategies and intelligence gathered.
-        *   **Constraint:** Do NOT start with an introduction or preamble.
-        *   **Constraint:** Do NOT use markdown. Use HTML tags (e.g., <b>, <br>, <p>) for formatting.
-
-        {strategy_section}
-
-        {intelligence_section}
-
-        {STRATEGIC_CORRECTIONS}
-
-        **User Message:**
-        {message}
-
-        **Your Response:**
-        """
-
-        payload = {
-            "messages": [
-                {
-                    "role": "system",
-                    "content": f"You are {mentor['name']}, an expert book arbitrage assistant. Stay in character."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "model": "grok-4-fast-reasoning", # Use reasoning model
-            "stream": False,
-            "temperature": 0.5,
-            "max_tokens": 300
-        }
-
-        result = query_xai_api(payload)
-
-        if "error" in result:
-             return jsonify({'error': result['error']}), 500
-
-        try:
-             reply = result['choices'][0]['message']['content'].strip()
-             return jsonify({'reply': reply})
-        except (KeyError, IndexError):
-             app.logger.exception(f"Error parsing AI response: {result}")
-             return jsonify({'error': 'Invalid response from AI'}), 500
+        return _queue_ava_job(JOB_MENTOR_CHAT, {'message': message, 'mentor': mentor_name})
 
     except Exception as e:
         app.logger.error(f"Error in mentor chat endpoint: {e}", exc_info=True)